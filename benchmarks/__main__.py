@@ -0,0 +1,193 @@
+"""Run metadataproxy against local stand-ins for docker, STS/IAM and IMDS.
+
+    python -m benchmarks --containers 200 --requests 20000 --concurrency 32
+
+Starts a fake docker API on a unix socket, a fake STS/IAM endpoint and a fake
+metadata service, launches metadataproxy under gunicorn pointed at them, and
+drives the credential and passthrough routes from many loopback source IPs.
+Reports throughput and p50/p99 latency per route, along with the number of
+calls the proxy made to each stand-in.
+"""
+# Import python libs
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# Import benchmark libs
+from benchmarks import fakes
+from benchmarks import loadgen
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.split('\n')[0])
+    parser.add_argument('--containers', type=int, default=100,
+                        help='Number of running containers the fake docker API reports.')
+    parser.add_argument('--callers', type=int, default=None,
+                        help='Number of distinct containers sending requests. Defaults to --containers.')
+    parser.add_argument('--miss-ratio', type=float, default=0.0,
+                        help='Fraction of callers whose IP matches no container, forcing a full scan.')
+    parser.add_argument('--docker-latency', type=float, default=0.0,
+                        help='Seconds added to every fake docker API call.')
+    parser.add_argument('--sts-latency', type=float, default=0.0,
+                        help='Seconds added to every fake STS/IAM call.')
+    parser.add_argument('--imds-latency', type=float, default=0.0,
+                        help='Seconds added to every fake metadata service call.')
+    parser.add_argument('--credential-duration', type=int, default=3600,
+                        help='Lifetime in seconds of credentials issued by the fake STS.')
+    parser.add_argument('--credential-cache', action='store_true',
+                        help='Share assumed roles between workers through a fake redis credential cache, '
+                             'as proxies on different hosts would.')
+    parser.add_argument('--kubelet', action='store_true',
+                        help='Resolve callers to pods from a fake kubelet pods endpoint (KUBELET_RESOLVER).')
+    parser.add_argument('--requests', type=int, default=5000,
+                        help='Number of requests to send in the measured run.')
+    parser.add_argument('--warmup', type=int, default=None,
+                        help='Number of requests to send before measuring. Defaults to one per caller.')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='Number of concurrent client connections.')
+    parser.add_argument('--mix', default=loadgen.DEFAULT_MIX,
+                        help='Weighted route mix, as route=weight pairs. Routes: {0}.'.format(
+                            ', '.join(sorted(loadgen.ROUTES))))
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of gunicorn workers to run the proxy with.')
+    parser.add_argument('--proxy-url', default=None,
+                        help='Benchmark an already running proxy instead of launching one.')
+    parser.add_argument('--proxy-env', action='append', default=[], metavar='KEY=VAL',
+                        help='Extra environment for the launched proxy. May be repeated.')
+    parser.add_argument('--proxy-log', default=None,
+                        help='File to write the launched proxy output to. Discarded by default.')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for the request plan, for repeatable runs.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the report as JSON.')
+    return parser.parse_args(argv)
+
+
+def wait_for_port(host, port, timeout=30.0, proc=None):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError('proxy exited with status {0}'.format(proc.returncode))
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('proxy did not start listening on {0}:{1}'.format(host, port))
+
+
+def launch_proxy(args, docker, aws, imds, extra_env=None):
+    port = fakes.free_port()
+    env = dict(os.environ)
+    env.update({
+        'DOCKER_URL': docker.url,
+        'METADATA_URL': imds.url,
+        'STS_ENDPOINT_URL': aws.url,
+        'IAM_ENDPOINT_URL': aws.url,
+        'AWS_ACCESS_KEY_ID': 'AKIABENCH',
+        'AWS_SECRET_ACCESS_KEY': 'bench',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'PYTHONPATH': REPO_ROOT,
+    })
+    env.update(extra_env or {})
+    for pair in args.proxy_env:
+        key, _, val = pair.partition('=')
+        env[key] = val
+    cmd = [
+        sys.executable, '-m', 'gunicorn', 'metadataproxy:app',
+        '-k', 'gevent',
+        '--workers', str(args.workers),
+        '-b', '127.0.0.1:{0}'.format(port),
+        '--log-level', 'warning',
+    ]
+    if args.proxy_log:
+        output = open(args.proxy_log, 'a')
+    else:
+        output = subprocess.DEVNULL
+    proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=output, stderr=subprocess.STDOUT)
+    wait_for_port('127.0.0.1', port, proc=proc)
+    return proc, 'http://127.0.0.1:{0}'.format(port)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    callers = min(args.callers or args.containers, args.containers)
+    misses = int(round(callers * args.miss_ratio))
+    source_ips = [(i, fakes.container_ip(i)) for i in range(callers - misses)]
+    # Callers on a different /16 that no stand-in container owns.
+    source_ips += [(i, fakes.container_ip(i, '127.2')) for i in range(misses)]
+
+    tmpdir = tempfile.mkdtemp(prefix='metadataproxy-bench-')
+    docker = fakes.FakeDocker(
+        os.path.join(tmpdir, 'docker.sock'),
+        count=args.containers,
+        latency=args.docker_latency
+    ).start()
+    aws = fakes.FakeAWS(latency=args.sts_latency, duration=args.credential_duration).start()
+    imds = fakes.FakeIMDS(latency=args.imds_latency).start()
+    redis = None
+    extra_env = {}
+    if args.credential_cache:
+        redis = fakes.FakeRedis().start()
+        key_file = os.path.join(tmpdir, 'credential-cache.key')
+        with open(key_file, 'w') as f:
+            f.write(fakes.credential_cache_key())
+        extra_env = {'CREDENTIAL_CACHE_URL': redis.url, 'CREDENTIAL_CACHE_KEY_FILE': key_file}
+    kubelet = None
+    if args.kubelet:
+        kubelet = fakes.FakeKubelet(count=args.containers).start()
+        extra_env.update({'KUBELET_RESOLVER': 'true', 'KUBELET_PODS_URL': kubelet.url, 'KUBELET_TOKEN_FILE': ''})
+    proc = None
+    try:
+        if args.proxy_url:
+            proxy_url = args.proxy_url
+        else:
+            proc, proxy_url = launch_proxy(args, docker, aws, imds, extra_env)
+        generator = loadgen.LoadGenerator(proxy_url, source_ips, mix=args.mix, concurrency=args.concurrency)
+        warmup = len(source_ips) if args.warmup is None else args.warmup
+        if warmup:
+            generator.run(warmup, seed=args.seed)
+        before = (dict(docker.calls), dict(aws.calls), imds.calls, kubelet.calls if kubelet else 0)
+        report = generator.run(args.requests, seed=args.seed)
+        report['upstream_calls'] = {
+            'docker_list': docker.calls['list'] - before[0]['list'],
+            'docker_inspect': docker.calls['inspect'] - before[0]['inspect'],
+            'sts_assume_role': aws.calls['AssumeRole'] - before[1]['AssumeRole'],
+            'iam_get_role': aws.calls['GetRole'] - before[1]['GetRole'],
+            'imds': imds.calls - before[2],
+        }
+        if kubelet is not None:
+            report['upstream_calls']['kubelet_pods'] = kubelet.calls - before[3]
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        docker.stop()
+        aws.stop()
+        imds.stop()
+        if kubelet is not None:
+            kubelet.stop()
+        if redis is not None:
+            redis.stop()
+            os.unlink(extra_env['CREDENTIAL_CACHE_KEY_FILE'])
+        os.rmdir(tmpdir)
+
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(loadgen.format_report(report))
+        print('upstream calls: ' + ', '.join(
+            '{0}={1}'.format(k, v) for k, v in sorted(report['upstream_calls'].items())
+        ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,532 @@
+# Import python libs
+import base64
+import datetime
+import json
+import os
+import queue
+import re
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+RE_CONTAINER_LIST = re.compile(r'^(/v[\d.]+)?/containers/json$')
+RE_CONTAINER_INSPECT = re.compile(r'^(/v[\d.]+)?/containers/([^/]+)/json$')
+RE_EVENTS = re.compile(r'^(/v[\d.]+)?/events$')
+
+ACCOUNT_ID = '123456789012'
+
+
+def container_ip(index, base='127.1'):
+    """Source IP for the stand-in container with the given index.
+
+    The whole of 127.0.0.0/8 is routed to the loopback interface on Linux, so
+    the load generator can bind to these addresses without any setup.
+    """
+    return '{0}.{1}.{2}'.format(base, index // 250, index % 250 + 1)
+
+
+def container_token(index):
+    """AWS_CONTAINER_AUTHORIZATION_TOKEN of the stand-in container."""
+    return 'bench-token-{0}'.format(index)
+
+
+def credential_cache_key():
+    """A random key in the Fernet format CREDENTIAL_CACHE_KEY_FILE takes."""
+    return base64.urlsafe_b64encode(os.urandom(32)).decode('utf-8') + '\n'
+
+
+def make_container(index, ip_base='127.1', running=True):
+    _id = '{0:064x}'.format(index + 1)
+    return {
+        'Id': _id,
+        'Name': '/bench-{0}'.format(index),
+        'State': {'Running': running},
+        'Config': {
+            'Hostname': 'bench-{0}'.format(index),
+            'Domainname': 'bench.internal',
+            'Env': [
+                'IAM_ROLE=bench-role-{0}@{1}'.format(index, ACCOUNT_ID),
+                'BENCH_INDEX={0}'.format(index),
+                'AWS_CONTAINER_AUTHORIZATION_TOKEN={0}'.format(container_token(index)),
+            ],
+            'Labels': {'bench.index': str(index)},
+        },
+        'NetworkSettings': {
+            'IPAddress': container_ip(index, ip_base),
+            'Networks': {
+                'bridge': {'IPAddress': container_ip(index, ip_base)},
+            },
+        },
+    }
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Artificial latency, in seconds, added to every response.
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, status=200, content_type='application/json'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length).decode('utf-8') if length else ''
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # A connect to a unix socket with a full backlog fails straight away with
+    # EAGAIN when the client has a timeout set, rather than waiting.
+    request_queue_size = 128
+
+    def get_request(self):
+        request, _ = super(UnixHTTPServer, self).get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address.
+        return request, ('local', 0)
+
+
+class FakeDocker(object):
+    """A stand-in for the docker API, served on a unix socket.
+
+    Serves the container list, container inspect and events endpoints for
+    `count` running containers, with `latency` seconds added to every call.
+    """
+    def __init__(self, socket_path, count=100, latency=0.0, ip_base='127.1'):
+        self.socket_path = socket_path
+        self.ip_base = ip_base
+        self.containers = [make_container(i, ip_base) for i in range(count)]
+        self.by_id = {c['Id']: c for c in self.containers}
+        self.calls = {'list': 0, 'inspect': 0}
+        self.subscribers = []
+        fake = self
+
+        class Handler(QuietHandler):
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if RE_CONTAINER_LIST.match(path):
+                    fake.calls['list'] += 1
+                    summary = [
+                        {
+                            'Id': c['Id'],
+                            'Names': [c['Name']],
+                            'Labels': c['Config']['Labels'],
+                            'NetworkSettings': {'Networks': c['NetworkSettings']['Networks']},
+                        }
+                        for c in fake.containers
+                    ]
+                    return self.send_body(json.dumps(summary))
+                m = RE_CONTAINER_INSPECT.match(path)
+                if m:
+                    fake.calls['inspect'] += 1
+                    container = fake.by_id.get(m.group(2))
+                    if container is None:
+                        return self.send_body(json.dumps({'message': 'No such container'}), 404)
+                    return self.send_body(json.dumps(container))
+                if RE_EVENTS.match(path):
+                    return self.stream_events()
+                if path.endswith('/_ping'):
+                    return self.send_body('OK', content_type='text/plain')
+                if path.endswith('/version'):
+                    return self.send_body(json.dumps({'ApiVersion': '1.24', 'Version': 'bench'}))
+                return self.send_body(json.dumps({'message': 'page not found'}), 404)
+
+            def stream_events(self):
+                events = queue.Queue()
+                fake.subscribers.append(events)
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    while True:
+                        event = events.get()
+                        if event is None:
+                            break
+                        chunk = (json.dumps(event) + '\n').encode('utf-8')
+                        self.wfile.write('{0:x}\r\n'.format(len(chunk)).encode('ascii') + chunk + b'\r\n')
+                        self.wfile.flush()
+                    self.wfile.write(b'0\r\n\r\n')
+                except OSError:
+                    pass
+                finally:
+                    fake.subscribers.remove(events)
+
+        Handler.latency = latency
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.server = UnixHTTPServer(socket_path, Handler)
+
+    @property
+    def url(self):
+        return 'unix://{0}'.format(self.socket_path)
+
+    def publish(self, status, container):
+        event = {'status': status, 'id': container['Id'], 'Type': 'container', 'Action': status,
+                 'Actor': {'ID': container['Id']}, 'time': int(time.time())}
+        for events in list(self.subscribers):
+            events.put(event)
+
+    def start_container(self, index):
+        container = make_container(index, self.ip_base)
+        self.containers.append(container)
+        self.by_id[container['Id']] = container
+        self.publish('start', container)
+        return container
+
+    def stop_container(self, container_id):
+        container = self.by_id.pop(container_id)
+        self.containers.remove(container)
+        self.publish('die', container)
+
+    def start(self):
+        _start(self.server)
+        return self
+
+    def stop(self):
+        for events in list(self.subscribers):
+            events.put(None)
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class FakeAWS(object):
+    """A stand-in for the STS and IAM query APIs.
+
+    Handles sts:AssumeRole and iam:GetRole, and the sts:GetCallerIdentity and
+    iam:ListRoles calls made by the health probes. Issued credentials expire
+    after DurationSeconds, or `duration` seconds if it isn't given. Like a
+    role's maximum session duration, a DurationSeconds over
+    `max_session_duration` is rejected.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, duration=3600, max_session_duration=43200):
+        self.calls = {'AssumeRole': 0, 'GetRole': 0, 'GetCallerIdentity': 0, 'ListRoles': 0}
+        fake = self
+
+        class Handler(QuietHandler):
+            def do_POST(self):
+                params = {k: v[0] for k, v in parse_qs(self.read_body()).items()}
+                action = params.get('Action')
+                if action == 'AssumeRole':
+                    fake.calls[action] += 1
+                    if int(params.get('DurationSeconds', 0)) > fake.max_session_duration:
+                        body = STS_VALIDATION_ERROR_RESPONSE.format(request_id=uuid.uuid4())
+                        return self.send_body(body, 400, content_type='text/xml')
+                    return self.send_body(fake.assume_role(params), content_type='text/xml')
+                if action == 'GetRole':
+                    fake.calls[action] += 1
+                    return self.send_body(fake.get_role(params), content_type='text/xml')
+                if action in ('GetCallerIdentity', 'ListRoles'):
+                    fake.calls[action] += 1
+                    body = PROBE_RESPONSES[action].format(account_id=ACCOUNT_ID, request_id=uuid.uuid4())
+                    return self.send_body(body, content_type='text/xml')
+                return self.send_body('<ErrorResponse/>', 400, content_type='text/xml')
+
+        Handler.latency = latency
+        self.duration = duration
+        self.max_session_duration = max_session_duration
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server.server_address)
+
+    def assume_role(self, params):
+        arn = params['RoleArn']
+        session_name = params.get('RoleSessionName', 'session')
+        role_name = arn.rsplit('/', 1)[-1]
+        duration = int(params.get('DurationSeconds', self.duration))
+        expiration = datetime.datetime.utcnow() + datetime.timedelta(seconds=duration)
+        return STS_ASSUME_ROLE_RESPONSE.format(
+            arn='arn:aws:sts::{0}:assumed-role/{1}/{2}'.format(ACCOUNT_ID, role_name, session_name),
+            role_id='AROABENCH{0}:{1}'.format(abs(hash(role_name)) % 10 ** 8, session_name),
+            access_key='ASIA{0}'.format(uuid.uuid4().hex[:16].upper()),
+            secret_key=uuid.uuid4().hex,
+            token=uuid.uuid4().hex * 4,
+            expiration=expiration.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            request_id=uuid.uuid4()
+        )
+
+    def get_role(self, params):
+        name = params['RoleName']
+        path = params.get('Path', '/')
+        return IAM_GET_ROLE_RESPONSE.format(
+            arn='arn:aws:iam::{0}:role{1}{2}'.format(ACCOUNT_ID, path, name),
+            name=name,
+            path=path,
+            request_id=uuid.uuid4()
+        )
+
+    def start(self):
+        _start(self.server)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeIMDS(object):
+    """A stand-in for the EC2 metadata service.
+
+    Every path returns a small text body, with `latency` seconds added.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.calls = 0
+        fake = self
+
+        class Handler(QuietHandler):
+            def do_GET(self):
+                fake.calls += 1
+                path = urlparse(self.path).path
+                if path.endswith('/'):
+                    return self.send_body('ami-id\ninstance-id\nplacement/', content_type='text/plain')
+                return self.send_body(path.rsplit('/', 1)[-1] + '-mocked', content_type='text/plain')
+
+        Handler.latency = latency
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}'.format(*self.server.server_address)
+
+    def start(self):
+        _start(self.server)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_pod(index, ip_base='127.1'):
+    """The kubelet's description of the pod of stand-in container `index`."""
+    container = make_container(index, ip_base)
+    env = [e.split('=', 1) for e in container['Config']['Env'] if not e.startswith('IAM_ROLE=')]
+    return {
+        'metadata': {
+            'name': 'bench-{0}'.format(index),
+            'namespace': 'bench',
+            'uid': container['Id'],
+            'resourceVersion': '1',
+            'labels': container['Config']['Labels'],
+            'annotations': {'iam.amazonaws.com/role': 'bench-role-{0}@{1}'.format(index, ACCOUNT_ID)},
+        },
+        'spec': {
+            'containers': [{
+                'name': 'bench',
+                'env': [{'name': name, 'value': value} for name, value in env],
+            }],
+        },
+        'status': {
+            'phase': 'Running',
+            'podIP': container_ip(index, ip_base),
+            'podIPs': [{'ip': container_ip(index, ip_base)}],
+        },
+    }
+
+
+class FakeKubelet(object):
+    """A stand-in for the kubelet's pods endpoint.
+
+    Lists a pod per stand-in container, with its role in the
+    iam.amazonaws.com/role annotation, and `latency` seconds added.
+    """
+    def __init__(self, count=100, host='127.0.0.1', port=0, latency=0.0, ip_base='127.1'):
+        self.pods = [make_pod(i, ip_base) for i in range(count)]
+        self.calls = 0
+        fake = self
+
+        class Handler(QuietHandler):
+            def do_GET(self):
+                if urlparse(self.path).path != '/pods':
+                    return self.send_body(json.dumps({'message': 'not found'}), status=404)
+                fake.calls += 1
+                return self.send_body(json.dumps({'kind': 'PodList', 'apiVersion': 'v1', 'items': list(fake.pods)}))
+
+        Handler.latency = latency
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}/pods'.format(*self.server.server_address)
+
+    def start(self):
+        _start(self.server)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeRedis(object):
+    """A stand-in for redis, for the shared credential cache.
+
+    Speaks enough of the redis protocol for PING, SELECT, GET and SET with
+    EX and NX. `calls` counts commands by name.
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        self.data = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    command = self.read_command()
+                    if command is None:
+                        return
+                    self.wfile.write(fake.execute(command))
+
+            def read_command(self):
+                line = self.rfile.readline()
+                if not line.startswith(b'*'):
+                    return None
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int(self.rfile.readline()[1:])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                return args
+
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return 'redis://{0}:{1}/0'.format(*self.server.server_address)
+
+    def execute(self, command):
+        name = command[0].decode('utf-8').upper()
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if name == 'PING':
+                return b'+PONG\r\n'
+            if name == 'SELECT':
+                return b'+OK\r\n'
+            if name == 'GET':
+                value, expires = self.data.get(command[1], (None, 0))
+                if value is None or expires < time.time():
+                    return b'$-1\r\n'
+                return b'$' + str(len(value)).encode('utf-8') + b'\r\n' + value + b'\r\n'
+            if name == 'SET':
+                key, value = command[1], command[2]
+                options = [arg.decode('utf-8').upper() for arg in command[3:]]
+                ttl = float('inf')
+                if 'EX' in options:
+                    ttl = int(options[options.index('EX') + 1])
+                if 'NX' in options and self.data.get(key, (None, 0))[1] >= time.time():
+                    return b'$-1\r\n'
+                self.data[key] = (value, time.time() + ttl)
+                return b'+OK\r\n'
+            return '-ERR unknown command {0}\r\n'.format(name).encode('utf-8')
+
+    def start(self):
+        _start(self.server)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _start(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def free_port(host='127.0.0.1'):
+    s = socket.socket()
+    s.bind((host, 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+STS_ASSUME_ROLE_RESPONSE = '''<AssumeRoleResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <AssumeRoleResult>
+    <AssumedRoleUser>
+      <Arn>{arn}</Arn>
+      <AssumedRoleId>{role_id}</AssumedRoleId>
+    </AssumedRoleUser>
+    <Credentials>
+      <AccessKeyId>{access_key}</AccessKeyId>
+      <SecretAccessKey>{secret_key}</SecretAccessKey>
+      <SessionToken>{token}</SessionToken>
+      <Expiration>{expiration}</Expiration>
+    </Credentials>
+  </AssumeRoleResult>
+  <ResponseMetadata>
+    <RequestId>{request_id}</RequestId>
+  </ResponseMetadata>
+</AssumeRoleResponse>'''
+
+STS_VALIDATION_ERROR_RESPONSE = '''<ErrorResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <Error>
+    <Type>Sender</Type>
+    <Code>ValidationError</Code>
+    <Message>The requested DurationSeconds exceeds the MaxSessionDuration set for this role.</Message>
+  </Error>
+  <RequestId>{request_id}</RequestId>
+</ErrorResponse>'''
+
+IAM_GET_ROLE_RESPONSE = '''<GetRoleResponse xmlns="https://iam.amazonaws.com/doc/2010-05-08/">
+  <GetRoleResult>
+    <Role>
+      <Path>{path}</Path>
+      <Arn>{arn}</Arn>
+      <RoleName>{name}</RoleName>
+      <AssumeRolePolicyDocument>%7B%7D</AssumeRolePolicyDocument>
+      <CreateDate>2020-01-01T00:00:00Z</CreateDate>
+      <RoleId>AROABENCH</RoleId>
+    </Role>
+  </GetRoleResult>
+  <ResponseMetadata>
+    <RequestId>{request_id}</RequestId>
+  </ResponseMetadata>
+</GetRoleResponse>'''
+
+PROBE_RESPONSES = {
+    'GetCallerIdentity': '''<GetCallerIdentityResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <GetCallerIdentityResult>
+    <Arn>arn:aws:iam::{account_id}:user/bench</Arn>
+    <UserId>AIDABENCH</UserId>
+    <Account>{account_id}</Account>
+  </GetCallerIdentityResult>
+  <ResponseMetadata>
+    <RequestId>{request_id}</RequestId>
+  </ResponseMetadata>
+</GetCallerIdentityResponse>''',
+    'ListRoles': '''<ListRolesResponse xmlns="https://iam.amazonaws.com/doc/2010-05-08/">
+  <ListRolesResult>
+    <IsTruncated>false</IsTruncated>
+    <Roles/>
+  </ListRolesResult>
+  <ResponseMetadata>
+    <RequestId>{request_id}</RequestId>
+  </ResponseMetadata>
+</ListRolesResponse>''',
+}
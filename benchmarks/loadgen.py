@@ -0,0 +1,157 @@
+# Import python libs
+import http.client
+import random
+import threading
+import timeit
+from urllib.parse import urlparse
+
+# Import benchmark libs
+from benchmarks import fakes
+
+# Route classes driven by the load generator. Each maps to a function of the
+# stand-in container index that returns the request path and headers.
+ROUTES = {
+    'credentials': lambda i: ('/latest/meta-data/iam/security-credentials/bench-role-{0}'.format(i), {}),
+    'role-name': lambda i: ('/latest/meta-data/iam/security-credentials/', {}),
+    'info': lambda i: ('/latest/meta-data/iam/info', {}),
+    'passthrough': lambda i: ('/latest/meta-data/instance-id', {}),
+    # Needs the proxy to run with ECS_CREDENTIALS_ENABLED=true.
+    'container-credentials': lambda i: ('/v2/credentials', {'Authorization': fakes.container_token(i)}),
+}
+
+DEFAULT_MIX = 'credentials=70,role-name=10,info=10,passthrough=10'
+
+
+def parse_mix(mix):
+    """Parse a `route=weight,...` string into a list of (route, weight)."""
+    weights = []
+    for part in mix.split(','):
+        route, _, weight = part.partition('=')
+        if route not in ROUTES:
+            raise ValueError('Unknown route class {0}; expected one of {1}'.format(
+                route, ', '.join(sorted(ROUTES))
+            ))
+        weights.append((route, float(weight or 1)))
+    return weights
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class LoadGenerator(object):
+    """Drive the proxy from many source IPs and record per-route latencies.
+
+    `source_ips` is a list of (container index, ip) pairs; every request is
+    sent from one of these addresses, so the proxy sees it as coming from the
+    matching stand-in container.
+    """
+    def __init__(self, proxy_url, source_ips, mix=DEFAULT_MIX, concurrency=16, timeout=10):
+        parsed = urlparse(proxy_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.source_ips = source_ips
+        self.mix = parse_mix(mix)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def request(self, route, index, ip):
+        path, headers = ROUTES[route](index)
+        return self.send(path, headers, ip)
+
+    def send(self, path, headers, ip, method='GET'):
+        """Send a request from ip, returning (status, duration)."""
+        conn = http.client.HTTPConnection(
+            self.host,
+            self.port,
+            timeout=self.timeout,
+            source_address=(ip, 0)
+        )
+        start = timeit.default_timer()
+        try:
+            conn.request(method, path, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            status = resp.status
+        except (OSError, http.client.HTTPException):
+            status = None
+        finally:
+            conn.close()
+        return status, timeit.default_timer() - start
+
+    def record(self, route, status, duration):
+        with self.lock:
+            result = self.results.setdefault(route, {'latencies': [], 'errors': 0, 'statuses': {}})
+            result['latencies'].append(duration)
+            result['statuses'][status] = result['statuses'].get(status, 0) + 1
+            if status is None or status >= 500:
+                result['errors'] += 1
+
+    def run(self, total_requests, seed=None):
+        rng = random.Random(seed)
+        routes = [r for r, _ in self.mix]
+        weights = [w for _, w in self.mix]
+        plan = [
+            (rng.choices(routes, weights)[0], rng.choice(self.source_ips))
+            for _ in range(total_requests)
+        ]
+        plan_lock = threading.Lock()
+
+        def worker():
+            while True:
+                with plan_lock:
+                    if not plan:
+                        return
+                    route, (index, ip) = plan.pop()
+                status, duration = self.request(route, index, ip)
+                self.record(route, status, duration)
+
+        self.results = {}
+        threads = [threading.Thread(target=worker) for _ in range(self.concurrency)]
+        start = timeit.default_timer()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return self.report(timeit.default_timer() - start)
+
+    def report(self, elapsed):
+        report = {'elapsed': elapsed, 'routes': {}}
+        total = 0
+        for route, result in sorted(self.results.items()):
+            latencies = sorted(result['latencies'])
+            total += len(latencies)
+            report['routes'][route] = {
+                'requests': len(latencies),
+                'errors': result['errors'],
+                'statuses': {str(k): v for k, v in result['statuses'].items()},
+                'rps': len(latencies) / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p90_ms': percentile(latencies, 90) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+            }
+        report['requests'] = total
+        report['rps'] = total / elapsed if elapsed else 0.0
+        return report
+
+
+def format_report(report):
+    lines = [
+        '{0:<22} {1:>9} {2:>7} {3:>10} {4:>9} {5:>9} {6:>9} {7:>9}'.format(
+            'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'
+        )
+    ]
+    for route, r in sorted(report['routes'].items()):
+        lines.append('{0:<22} {1:>9} {2:>7} {3:>10.1f} {4:>9.2f} {5:>9.2f} {6:>9.2f} {7:>9.2f}'.format(
+            route, r['requests'], r['errors'], r['rps'], r['p50_ms'], r['p90_ms'], r['p99_ms'], r['max_ms']
+        ))
+    lines.append('total: {0} requests in {1:.2f}s ({2:.1f} req/s)'.format(
+        report['requests'], report['elapsed'], report['rps']
+    ))
+    return '\n'.join(lines)
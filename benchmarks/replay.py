@@ -0,0 +1,239 @@
+"""Replay request traces written by metadataproxy's TRACE_FILE against local stand-ins.
+
+    python -m benchmarks.replay /var/log/metadataproxy/trace-*.jsonl --speed 2
+
+Requests are sent at the times they were recorded, divided by --speed, from
+the same number of distinct source IPs: each IP in the trace is remapped to a
+loopback address owned by a stand-in container, and role names in credential
+paths to that container's role. Sending is open loop, so a slow proxy makes
+requests queue up rather than slowing the replay down; how late requests
+were sent is reported as lag.
+
+Reports replayed latency per route next to the latency recorded in the trace,
+the number of replayed requests whose status differs from the recorded one,
+and the calls the proxy made to each stand-in.
+"""
+# Import python libs
+import argparse
+import concurrent.futures
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+# Import benchmark libs
+from benchmarks import fakes
+from benchmarks import loadgen
+from benchmarks.__main__ import launch_proxy
+
+RE_IAM_PATH = re.compile(r'^(/[^/]+/meta-data/iam/)(info|security-credentials)(/?)([^/]*)(/?)$')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.replay', description=__doc__.split('\n')[0])
+    parser.add_argument('traces', nargs='+',
+                        help='Trace files to replay. Traces of several workers are merged by time.')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed, as a multiple of the recorded rate. 0 sends requests as fast '
+                             'as --concurrency allows.')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='Replay only the first LIMIT requests.')
+    parser.add_argument('--concurrency', type=int, default=64,
+                        help='Maximum number of requests in flight.')
+    parser.add_argument('--ecs-credentials-path', default='/v2/credentials',
+                        help='ECS_CREDENTIALS_PATH of the traced proxy.')
+    parser.add_argument('--docker-latency', type=float, default=0.0,
+                        help='Seconds added to every fake docker API call.')
+    parser.add_argument('--sts-latency', type=float, default=0.0,
+                        help='Seconds added to every fake STS/IAM call.')
+    parser.add_argument('--imds-latency', type=float, default=0.0,
+                        help='Seconds added to every fake metadata service call.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of gunicorn workers to run the proxy with.')
+    parser.add_argument('--proxy-url', default=None,
+                        help='Replay against an already running proxy instead of launching one.')
+    parser.add_argument('--proxy-env', action='append', default=[], metavar='KEY=VAL',
+                        help='Extra environment for the launched proxy. May be repeated.')
+    parser.add_argument('--proxy-log', default=None,
+                        help='File to write the launched proxy output to. Discarded by default.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the report as JSON.')
+    return parser.parse_args(argv)
+
+
+def load_traces(paths, limit=None):
+    records = []
+    for path in paths:
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    records.sort(key=lambda r: r['t'])
+    return records[:limit] if limit else records
+
+
+def remap_request(record, index, ecs_path):
+    """Return (route, path, headers) to replay a record as container `index`."""
+    path = record['path']
+    if path == ecs_path or path.startswith(ecs_path + '/'):
+        # Credential keys aren't traced; use the container's token instead.
+        return 'container-credentials', ecs_path, {'Authorization': fakes.container_token(index)}
+    m = RE_IAM_PATH.match(path)
+    if m is None:
+        return 'passthrough', path, {}
+    prefix, resource, slash, role, rest = m.groups()
+    if resource == 'info':
+        return 'info', path, {}
+    if not role:
+        return 'role-name', path, {}
+    return 'credentials', '{0}security-credentials/bench-role-{1}{2}'.format(prefix, index, rest), {}
+
+
+class Replayer(loadgen.LoadGenerator):
+    """Send traced requests on their recorded schedule, and record latencies."""
+    def __init__(self, proxy_url, records, ips, ecs_path, speed=1.0, concurrency=64):
+        super(Replayer, self).__init__(proxy_url, [], concurrency=concurrency)
+        self.records = records
+        self.ips = ips
+        self.ecs_path = ecs_path.rstrip('/')
+        self.speed = speed
+        self.lags = []
+        self.mismatches = {}
+
+    def replay_one(self, record, due):
+        index = self.ips[record['ip']]
+        route, path, headers = remap_request(record, index, self.ecs_path)
+        lag = max(0.0, timeit.default_timer() - due) if self.speed else 0.0
+        status, duration = self.send(path, headers, fakes.container_ip(index), method=record.get('method') or 'GET')
+        self.record(route, status, duration)
+        with self.lock:
+            self.lags.append(lag)
+            if status != record.get('status'):
+                key = '{0}: {1} -> {2}'.format(route, record.get('status'), status)
+                self.mismatches[key] = self.mismatches.get(key, 0) + 1
+
+    def replay(self):
+        self.results = {}
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        semaphore = threading.BoundedSemaphore(self.concurrency)
+        t0 = self.records[0]['t'] if self.records else 0.0
+        start = timeit.default_timer()
+
+        def run(record, due):
+            try:
+                self.replay_one(record, due)
+            finally:
+                semaphore.release()
+
+        for record in self.records:
+            due = start + (record['t'] - t0) / self.speed if self.speed else start
+            delay = due - timeit.default_timer()
+            if delay > 0:
+                time.sleep(delay)
+            # Bounds the backlog; requests that wait here are counted as lag.
+            semaphore.acquire()
+            executor.submit(run, record, due)
+        executor.shutdown(wait=True)
+        report = self.report(timeit.default_timer() - start)
+        lags = sorted(self.lags)
+        report['lag_p50_ms'] = loadgen.percentile(lags, 50) * 1000
+        report['lag_p99_ms'] = loadgen.percentile(lags, 99) * 1000
+        report['status_mismatches'] = self.mismatches
+        return report
+
+
+def recorded_latencies(records, ecs_path):
+    """Latency percentiles per route, as recorded in the trace."""
+    durations = {}
+    for record in records:
+        route = remap_request(record, 0, ecs_path)[0]
+        durations.setdefault(route, []).append(record['dur'])
+    recorded = {}
+    for route, values in durations.items():
+        values.sort()
+        recorded[route] = {
+            'p50_ms': loadgen.percentile(values, 50) * 1000,
+            'p90_ms': loadgen.percentile(values, 90) * 1000,
+            'p99_ms': loadgen.percentile(values, 99) * 1000,
+        }
+    return recorded
+
+
+def format_report(report):
+    lines = [loadgen.format_report(report), '']
+    lines.append('{0:<22} {1:>9} {2:>9} {3:>9}'.format('recorded', 'p50 ms', 'p90 ms', 'p99 ms'))
+    for route, r in sorted(report['recorded'].items()):
+        lines.append('{0:<22} {1:>9.2f} {2:>9.2f} {3:>9.2f}'.format(route, r['p50_ms'], r['p90_ms'], r['p99_ms']))
+    lines.append('')
+    lines.append('send lag: p50 {0:.2f} ms, p99 {1:.2f} ms'.format(report['lag_p50_ms'], report['lag_p99_ms']))
+    if report['status_mismatches']:
+        lines.append('status mismatches: ' + ', '.join(
+            '{0} x{1}'.format(k, v) for k, v in sorted(report['status_mismatches'].items())
+        ))
+    lines.append('upstream calls: ' + ', '.join(
+        '{0}={1}'.format(k, v) for k, v in sorted(report['upstream_calls'].items())
+    ))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    records = load_traces(args.traces, args.limit)
+    if not records:
+        print('No requests in {0}'.format(', '.join(args.traces)), file=sys.stderr)
+        return 1
+    ecs_path = args.ecs_credentials_path.rstrip('/')
+    # Source IPs in order of first appearance, each mapped to a container.
+    ips = {}
+    for record in records:
+        ips.setdefault(record['ip'], len(ips))
+    if any(remap_request(r, 0, ecs_path)[0] == 'container-credentials' for r in records):
+        args.proxy_env = ['ECS_CREDENTIALS_ENABLED=true', 'ECS_CREDENTIALS_PATH=' + ecs_path] + args.proxy_env
+
+    tmpdir = tempfile.mkdtemp(prefix='metadataproxy-replay-')
+    docker = fakes.FakeDocker(
+        os.path.join(tmpdir, 'docker.sock'),
+        count=len(ips),
+        latency=args.docker_latency
+    ).start()
+    aws = fakes.FakeAWS(latency=args.sts_latency).start()
+    imds = fakes.FakeIMDS(latency=args.imds_latency).start()
+    proc = None
+    try:
+        if args.proxy_url:
+            proxy_url = args.proxy_url
+        else:
+            proc, proxy_url = launch_proxy(args, docker, aws, imds)
+        replayer = Replayer(proxy_url, records, ips, ecs_path, speed=args.speed, concurrency=args.concurrency)
+        report = replayer.replay()
+        report['recorded'] = recorded_latencies(records, ecs_path)
+        report['upstream_calls'] = {
+            'docker_list': docker.calls['list'],
+            'docker_inspect': docker.calls['inspect'],
+            'sts_assume_role': aws.calls['AssumeRole'],
+            'iam_get_role': aws.calls['GetRole'],
+            'imds': imds.calls,
+        }
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        docker.stop()
+        aws.stop()
+        imds.stop()
+        os.rmdir(tmpdir)
+
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print(format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""Measure metadataproxy import time, time to first served request and worker restart time.
+
+    python -m benchmarks.startup --runs 5
+
+Import time is measured in a fresh interpreter. The proxy is then launched
+under gunicorn with config/gunicorn.conf against the local stand-ins, once
+with PRELOAD_APP unset and once with PRELOAD_APP=true, and for each the
+report gives:
+
+- first request: seconds from launching gunicorn until the first credentials
+  request is served.
+- worker restart: seconds from killing the worker until the next credentials
+  request is served by its replacement.
+
+Figures are medians over --runs runs.
+"""
+# Import python libs
+import argparse
+import http.client
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+# Import benchmark libs
+from benchmarks import fakes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CREDENTIALS_PATH = '/latest/meta-data/iam/security-credentials/bench-role-0'
+
+IMPORT_SCRIPT = '''
+import timeit
+start = timeit.default_timer()
+import metadataproxy
+print(timeit.default_timer() - start)
+'''
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.startup', description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of runs to take the median of.')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Seconds to wait for the proxy to serve a request.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the report as JSON.')
+    return parser.parse_args(argv)
+
+
+def measure_import():
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_SCRIPT],
+        cwd=REPO_ROOT,
+        env=dict(os.environ, PYTHONPATH=REPO_ROOT)
+    )
+    return float(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def serves_credentials(port):
+    conn = http.client.HTTPConnection(
+        '127.0.0.1', port, timeout=5, source_address=(fakes.container_ip(0), 0)
+    )
+    try:
+        conn.request('GET', CREDENTIALS_PATH)
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status == 200
+    except (OSError, http.client.HTTPException):
+        return False
+    finally:
+        conn.close()
+
+
+def wait_until_served(port, start, timeout, proc):
+    while timeit.default_timer() - start < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError('proxy exited with status {0}'.format(proc.returncode))
+        if serves_credentials(port):
+            return timeit.default_timer() - start
+        time.sleep(0.005)
+    raise RuntimeError('proxy did not serve a request within {0}s'.format(timeout))
+
+
+def worker_pids(master_pid):
+    path = '/proc/{0}/task/{0}/children'.format(master_pid)
+    with open(path, 'r') as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def measure_proxy(docker, aws, imds, preload, timeout):
+    port = fakes.free_port()
+    env = dict(os.environ)
+    env.update({
+        'DOCKER_URL': docker.url,
+        'METADATA_URL': imds.url,
+        'STS_ENDPOINT_URL': aws.url,
+        'IAM_ENDPOINT_URL': aws.url,
+        'AWS_ACCESS_KEY_ID': 'AKIABENCH',
+        'AWS_SECRET_ACCESS_KEY': 'bench',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'LOGGING_CONF_FILE': os.path.join(REPO_ROOT, 'config', 'logging.conf'),
+        'PRELOAD_APP': 'true' if preload else 'false',
+        'PYTHONPATH': REPO_ROOT,
+    })
+    cmd = [
+        sys.executable, '-m', 'gunicorn', 'metadataproxy:app',
+        '-c', os.path.join(REPO_ROOT, 'config', 'gunicorn.conf'),
+        '--workers', '1',
+        '-b', '127.0.0.1:{0}'.format(port),
+        '--log-level', 'warning',
+    ]
+    start = timeit.default_timer()
+    proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_request = wait_until_served(port, start, timeout, proc)
+        pids = worker_pids(proc.pid)
+        start = timeit.default_timer()
+        for pid in pids:
+            os.kill(pid, signal.SIGKILL)
+        # Don't count a request served by the worker before the signal landed.
+        while set(pids) & set(worker_pids(proc.pid)):
+            time.sleep(0.001)
+        worker_restart = wait_until_served(port, start, timeout, proc)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return first_request, worker_restart
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = {'import': statistics.median(measure_import() for _ in range(args.runs))}
+
+    tmpdir = tempfile.mkdtemp(prefix='metadataproxy-bench-')
+    docker = fakes.FakeDocker(os.path.join(tmpdir, 'docker.sock'), count=1).start()
+    aws = fakes.FakeAWS().start()
+    imds = fakes.FakeIMDS().start()
+    try:
+        for name, preload in (('default', False), ('preload', True)):
+            runs = [measure_proxy(docker, aws, imds, preload, args.timeout) for _ in range(args.runs)]
+            report[name] = {
+                'first_request': statistics.median(r[0] for r in runs),
+                'worker_restart': statistics.median(r[1] for r in runs),
+            }
+    finally:
+        docker.stop()
+        aws.stop()
+        imds.stop()
+        os.rmdir(tmpdir)
+
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print('import metadataproxy: {0:.3f}s'.format(report['import']))
+        print('{0:<10} {1:>16} {2:>16}'.format('mode', 'first request s', 'worker restart s'))
+        for name in ('default', 'preload'):
+            print('{0:<10} {1:>16.3f} {2:>16.3f}'.format(
+                name, report[name]['first_request'], report[name]['worker_restart']
+            ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Measure per-worker request rate of the IAM routes through flask and the fast path.
+
+    python -m benchmarks.wsgi --requests 20000
+
+Calls the WSGI application in-process, without a server, so the numbers are
+the cost of dispatching a request and building its response in one worker.
+Callers are mapped to roles with a ROLE_MAPPING_FILE and credentials come
+from the fake STS, cached after the first request, so the container lookup
+and STS calls are kept out of the measurement.
+"""
+# Import python libs
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+# Import benchmark libs
+from benchmarks import fakes
+
+ROLE = 'bench-role-0'
+CALLER_IP = fakes.container_ip(0)
+
+PATHS = {
+    'credentials': '/latest/meta-data/iam/security-credentials/{0}'.format(ROLE),
+    'role-name': '/latest/meta-data/iam/security-credentials/',
+    'info': '/latest/meta-data/iam/info',
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.wsgi', description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=20000,
+                        help='Number of requests to send per route and dispatcher.')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the report as JSON.')
+    return parser.parse_args(argv)
+
+
+def make_environ(path):
+    return {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': '169.254.169.254',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': CALLER_IP,
+        'HTTP_HOST': '169.254.169.254',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': None,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+
+def call(wsgi_app, path):
+    status = []
+
+    def start_response(s, headers, exc_info=None):
+        status.append(s)
+
+    body = b''.join(wsgi_app(make_environ(path), start_response))
+    return status[0], body
+
+
+def measure(wsgi_app, path, count):
+    environ = make_environ(path)
+
+    def start_response(s, headers, exc_info=None):
+        pass
+
+    start = timeit.default_timer()
+    for _ in range(count):
+        b''.join(wsgi_app(dict(environ), start_response))
+    elapsed = timeit.default_timer() - start
+    return count / elapsed
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    aws = fakes.FakeAWS().start()
+    mapping = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+    json.dump({CALLER_IP: ROLE}, mapping)
+    mapping.close()
+    os.environ.update({
+        'ROLE_MAPPING_FILE': mapping.name,
+        'DEFAULT_ACCOUNT_ID': fakes.ACCOUNT_ID,
+        'STS_ENDPOINT_URL': aws.url,
+        'IAM_ENDPOINT_URL': aws.url,
+        'AWS_ACCESS_KEY_ID': 'AKIABENCH',
+        'AWS_SECRET_ACCESS_KEY': 'bench',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'IAM_FAST_PATH': 'false',
+    })
+    try:
+        # Settings are read at import time.
+        from metadataproxy import app
+        from metadataproxy.fastpath import IAMFastPath
+
+        dispatchers = [('flask', app.wsgi_app), ('fastpath', IAMFastPath(app.wsgi_app))]
+        report = {}
+        for route, path in sorted(PATHS.items()):
+            responses = set(call(wsgi_app, path)[0] for _, wsgi_app in dispatchers)
+            if responses != {'200 OK'}:
+                raise RuntimeError('unexpected responses for {0}: {1}'.format(path, responses))
+            report[route] = {
+                name: measure(wsgi_app, path, args.requests) for name, wsgi_app in dispatchers
+            }
+    finally:
+        aws.stop()
+        os.unlink(mapping.name)
+
+    if args.json:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    else:
+        print('{0:<14} {1:>12} {2:>12} {3:>8}'.format('route', 'flask req/s', 'fast req/s', 'speedup'))
+        for route, r in sorted(report.items()):
+            print('{0:<14} {1:>12.0f} {2:>12.0f} {3:>7.2f}x'.format(
+                route, r['flask'], r['fastpath'], r['fastpath'] / r['flask']
+            ))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
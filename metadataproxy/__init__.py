@@ -10,7 +10,40 @@ if app.config['PATCH_ECS_ALLOWED_HOSTS']:
     from botocore.utils import ContainerMetadataFetcher  # NOQA
     ContainerMetadataFetcher._ALLOWED_HOSTS.append(app.config['PATCH_ECS_ALLOWED_HOSTS'])
 
+if app.config['HEALTH_ENDPOINTS_ENABLED']:
+    from metadataproxy.routes import health  # NOQA
+
+if app.config['ECS_CREDENTIALS_ENABLED']:
+    from metadataproxy.routes import ecs  # NOQA
+
 if app.config['MOCK_API']:
     from metadataproxy.routes import mock  # NOQA
 else:
     from metadataproxy.routes import proxy  # NOQA
+    if app.config['IAM_FAST_PATH']:
+        from metadataproxy.fastpath import IAMFastPath
+        app.wsgi_app = IAMFastPath(app.wsgi_app)
+
+if app.config['BULKHEADS_ENABLED']:
+    from metadataproxy.bulkhead import Bulkheads
+    app.wsgi_app = Bulkheads(app.wsgi_app)
+
+if app.config['REQUEST_DEADLINE']:
+    from metadataproxy.deadline import RequestDeadline
+    app.wsgi_app = RequestDeadline(app.wsgi_app)
+
+if app.config['USAGE_STATS']:
+    from metadataproxy.usage import UsageRecorder
+    app.wsgi_app = UsageRecorder(app.wsgi_app)
+
+if app.config['ADMIN_SOCKET']:
+    from metadataproxy.admin import AdminServerStarter
+    app.wsgi_app = AdminServerStarter(app.wsgi_app)
+
+if app.config['SNAPSHOT_FILE']:
+    from metadataproxy.snapshot import SnapshotLoader
+    app.wsgi_app = SnapshotLoader(app.wsgi_app)
+
+if app.config['TRACE_FILE']:
+    from metadataproxy.tracing import TraceRecorder
+    app.wsgi_app = TraceRecorder(app.wsgi_app)
@@ -0,0 +1,433 @@
+# Import python libs
+import atexit
+import datetime
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from wsgiref import simple_server
+
+# Import third party libs
+import dateutil.tz
+from flask import Flask
+from flask import jsonify
+from flask import Response
+from flask import request
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy import bulkhead
+from metadataproxy import metrics
+from metadataproxy import profiler
+from metadataproxy import roles
+from metadataproxy import usage
+from metadataproxy.util import once_per_process
+
+log = logging.getLogger(__name__)
+
+# Served on a unix socket of its own, never on the proxy's listener, since
+# callers of the proxy are untrusted.
+admin_app = Flask(__name__)
+
+CACHES = ('container_mapping', 'roles', 'role_arns', 'mesos', 'proc_index', 'proc_containers',
+          'kubelet_pods', 'container_credentials')
+PROFILE_FORMATS = ('collapsed', 'pstats', 'summary')
+MAX_PROFILE_SECONDS = 300
+
+
+def redact(value):
+    """Keep only enough of an identifier to tell entries apart."""
+    if not value:
+        return value
+    return '{0}...{1}'.format(value[:4], value[-4:])
+
+
+def cache_stats(name, size):
+    counters = metrics.snapshot()['counters']
+    hits = counters.get('cache.{0}.hit'.format(name), 0)
+    misses = counters.get('cache.{0}.miss'.format(name), 0)
+    return {
+        'size': size,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / float(hits + misses) if hits + misses else None
+    }
+
+
+def container_mapping_entries(now):
+    return [
+        {
+            'ip': ip,
+            'container_id': container_id,
+            'age': now - roles.CONTAINER_MAPPING_UPDATED.get(ip, now)
+        }
+        for ip, container_id in list(roles.CONTAINER_MAPPING.items())
+    ]
+
+
+def role_entries(now):
+    utcnow = datetime.datetime.now(dateutil.tz.tzutc())
+    entries = []
+    for arn, assumed_role in list(roles.ROLES.items()):
+        expiration = assumed_role['Credentials']['Expiration']
+        duration = (expiration - assumed_role['LastUpdated']).total_seconds()
+        # Containers can set their own threshold; this is the default one.
+        threshold = roles.get_expiration_threshold(roles.new_role_params(), duration)
+        entries.append({
+            'role_arn': arn,
+            'assumed_role_arn': assumed_role['AssumedRoleUser']['Arn'],
+            'access_key_id': redact(assumed_role['Credentials']['AccessKeyId']),
+            'expiration': expiration.isoformat(),
+            'duration': duration,
+            'expires_in': (expiration - utcnow).total_seconds(),
+            'refresh_in': (expiration - threshold - utcnow).total_seconds(),
+            'age': now - roles.ROLES_UPDATED.get(arn, now)
+        })
+    return entries
+
+
+def role_arn_entries(now):
+    ttl = roles.ROLE_ARNS.ttl
+    return [
+        {'name': name, 'role_arn': arn, 'age': now - updated, 'expires_in': updated + ttl - now}
+        for name, (updated, arn) in list(roles.ROLE_ARNS.items())
+    ]
+
+
+def mesos_entries(now):
+    ttl = roles.MESOS_CONTAINERS.ttl
+    return [
+        {
+            'ip': ip,
+            'found': container is not None,
+            'age': now - updated,
+            'expires_in': updated + ttl - now
+        }
+        for ip, (updated, container) in list(roles.MESOS_CONTAINERS.items())
+    ]
+
+
+def proc_index_entries(now):
+    # Built on the first /proc lookup; entries were current at its last refresh.
+    index = roles._proc_index
+    if index is None:
+        return []
+    return [
+        {'ip': ip, 'container_id': container_id, 'pid': pid, 'age': now - index.refreshed_at}
+        for ip, (container_id, pid) in list(index.ips.items())
+    ]
+
+
+def proc_container_entries(now):
+    return [
+        {'container_id': container_id, 'name': container.get('Name')}
+        for container_id, container in list(roles.PROC_CONTAINERS.items())
+    ]
+
+
+def kubelet_pod_entries(now):
+    # Built on the first kubelet lookup; entries were current at its last refresh.
+    index = roles._kubelet_index
+    if index is None:
+        return []
+    return [
+        {'ip': ip, 'pod_uid': container['Id'], 'name': container['Name'], 'age': now - index.refreshed_at}
+        for ip, container in list(index.ips.items())
+    ]
+
+
+def container_credential_entries(now):
+    return [
+        {
+            'kind': key[0],
+            'key': redact(key[1]),
+            'container_id': roles.CONTAINER_CREDENTIAL_OWNERS.get(key),
+            'role': params['name']
+        }
+        for key, params in list(roles.CONTAINER_CREDENTIALS.items())
+    ]
+
+
+def _index_size(index):
+    return len(index.ips) if index is not None else 0
+
+
+@admin_app.route('/caches')
+def list_caches():
+    return jsonify({
+        'container_mapping': cache_stats('container_mapping', len(roles.CONTAINER_MAPPING)),
+        'roles': cache_stats('roles', len(roles.ROLES)),
+        'role_arns': cache_stats('role_arns', len(roles.ROLE_ARNS)),
+        'mesos': cache_stats('mesos', len(roles.MESOS_CONTAINERS)),
+        'proc_index': cache_stats('proc_index', _index_size(roles._proc_index)),
+        'proc_containers': cache_stats('proc_containers', len(roles.PROC_CONTAINERS)),
+        'kubelet_pods': cache_stats('kubelet_pods', _index_size(roles._kubelet_index)),
+        'container_credentials': cache_stats('container_credentials', len(roles.CONTAINER_CREDENTIALS)),
+    })
+
+
+@admin_app.route('/caches/<name>')
+def list_cache_entries(name):
+    now = time.time()
+    if name == 'container_mapping':
+        entries = container_mapping_entries(now)
+    elif name == 'roles':
+        entries = role_entries(now)
+    elif name == 'role_arns':
+        entries = role_arn_entries(now)
+    elif name == 'mesos':
+        entries = mesos_entries(now)
+    elif name == 'proc_index':
+        entries = proc_index_entries(now)
+    elif name == 'proc_containers':
+        entries = proc_container_entries(now)
+    elif name == 'kubelet_pods':
+        entries = kubelet_pod_entries(now)
+    elif name == 'container_credentials':
+        entries = container_credential_entries(now)
+    else:
+        return jsonify({'error': 'Unknown cache {0}; expected one of {1}'.format(name, ', '.join(CACHES))}), 404
+    return jsonify({'entries': entries})
+
+
+def _invalidate_indexes(ip, container_id, removed):
+    """Drop the entries of an IP's container, or of a container, from the
+    /proc and kubelet indexes and the inspects of containers found by /proc.
+
+    The processes and pods dropped are read again on the next refresh.
+    """
+    container_ids = {container_id} if container_id else set()
+    proc_index = roles._proc_index
+    if proc_index is not None:
+        entry = proc_index.lookup(ip) if ip else None
+        if entry is not None:
+            container_ids.add(entry[0])
+        for pid, _entry in list(proc_index.pids.items()):
+            if _entry is not None and _entry[0] in container_ids:
+                proc_index.forget(pid)
+                removed['proc_index'] += 1
+    kubelet_index = roles._kubelet_index
+    if kubelet_index is not None:
+        container = kubelet_index.lookup(ip) if ip else None
+        if container is not None:
+            container_ids.add(container['Id'])
+        for uid in container_ids:
+            if uid in kubelet_index.pods:
+                kubelet_index.forget(uid)
+                removed['kubelet_pods'] += 1
+    for _id in container_ids:
+        if roles.PROC_CONTAINERS.pop(_id, None) is not None:
+            removed['proc_containers'] += 1
+
+
+def invalidate(ip=None, container_id=None, role_arn=None):
+    """Drop cache entries for an IP, a container ID or a role ARN.
+
+    Returns the number of entries removed from each cache.
+    """
+    removed = {name: 0 for name in CACHES}
+    ips = set()
+    if ip:
+        ips.add(ip)
+    if container_id:
+        ips.update(
+            _ip for _ip, _id in list(roles.CONTAINER_MAPPING.items()) if _id == container_id
+        )
+    for _ip in ips:
+        if _ip in roles.CONTAINER_MAPPING:
+            roles.forget_container_mapping(_ip)
+            removed['container_mapping'] += 1
+        if roles.MESOS_CONTAINERS.pop(_ip, None) is not None:
+            removed['mesos'] += 1
+    if ip or container_id:
+        _invalidate_indexes(ip, container_id, removed)
+    if container_id and container_id in roles.CONTAINER_CREDENTIAL_KEYS:
+        # Inspected again by the next credentials request that misses.
+        removed['container_credentials'] += len(
+            [key for key, owner in list(roles.CONTAINER_CREDENTIAL_OWNERS.items()) if owner == container_id]
+        )
+        roles.unregister_container_credentials(container_id)
+    if role_arn and roles.ROLES.pop(role_arn, None) is not None:
+        roles.ROLES_UPDATED.pop(role_arn, None)
+        removed['roles'] += 1
+    if role_arn:
+        for name, (_, arn) in list(roles.ROLE_ARNS.items()):
+            if arn == role_arn and roles.ROLE_ARNS.pop(name, None) is not None:
+                removed['role_arns'] += 1
+    log.info('Admin invalidation of ip={0} container_id={1} role_arn={2}: {3}'.format(
+        ip, container_id, role_arn, removed
+    ))
+    return removed
+
+
+@admin_app.route('/invalidate', methods=['POST'])
+def invalidate_entries():
+    ip = request.args.get('ip')
+    container_id = request.args.get('container_id')
+    role_arn = request.args.get('role_arn')
+    if not (ip or container_id or role_arn):
+        return jsonify({'error': 'One of ip, container_id or role_arn is required'}), 400
+    return jsonify({'removed': invalidate(ip, container_id, role_arn)})
+
+
+@admin_app.route('/refresh', methods=['POST'])
+def refresh_ip():
+    """Look up the container and assume the role for an IP again."""
+    ip = request.args.get('ip')
+    if not ip:
+        return jsonify({'error': 'ip is required'}), 400
+    removed = invalidate(ip=ip)
+    role_params = roles.get_role_params_from_ip(ip)
+    if not role_params['name']:
+        return jsonify({'removed': removed, 'error': 'No role found for {0}'.format(ip)}), 404
+    arn = roles.get_role_arn(role_params)
+    if roles.ROLES.pop(arn, None) is not None:
+        roles.ROLES_UPDATED.pop(arn, None)
+        removed['roles'] += 1
+    assumed_role = roles.get_assumed_role(role_params)
+    return jsonify({
+        'removed': removed,
+        'container_id': roles.CONTAINER_MAPPING.get(ip),
+        'role_arn': arn,
+        'access_key_id': redact(assumed_role['Credentials']['AccessKeyId']),
+        'expiration': assumed_role['Credentials']['Expiration'].isoformat()
+    })
+
+
+@admin_app.route('/metrics')
+def list_metrics():
+    """Counters and value summaries of this worker.
+
+    `prefix` narrows them to names starting with it, such as `docker.` for
+    the latency and errors of each docker endpoint.
+    """
+    prefix = request.args.get('prefix', '')
+    snapshot = metrics.snapshot()
+    return jsonify({
+        kind: {name: value for name, value in values.items() if name.startswith(prefix)}
+        for kind, values in snapshot.items()
+    })
+
+
+@admin_app.route('/bulkheads')
+def list_bulkheads():
+    return jsonify({name: b.stats() for name, b in bulkhead.bulkheads().items()})
+
+
+@admin_app.route('/usage')
+def list_usage():
+    """The top IPs and roles by requests, cache misses and STS calls.
+
+    `event` and `by` narrow the report to one event and dimension, and `top`
+    sets the number of keys listed.
+    """
+    if not app.config['USAGE_STATS']:
+        return jsonify({'error': 'USAGE_STATS is disabled'}), 404
+    try:
+        k = int(request.args.get('top', 10))
+    except ValueError:
+        return jsonify({'error': 'top must be an integer'}), 400
+    event = request.args.get('event')
+    by = request.args.get('by')
+    if event is None and by is None:
+        return jsonify(usage.report(k))
+    if event not in usage.EVENTS or by not in usage.DIMENSIONS:
+        msg = 'event must be one of {0}, and by one of {1}'
+        return jsonify({'error': msg.format(', '.join(usage.EVENTS), ', '.join(usage.DIMENSIONS))}), 400
+    return jsonify({'entries': usage.top(event, by, k)})
+
+
+@admin_app.route('/profile', methods=['POST'])
+def profile():
+    """Sample the stacks of this worker for `seconds`.
+
+    Returns collapsed stacks, a pstats dump or a summary by roles and routes
+    function, depending on `format`.
+    """
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.01))
+    except ValueError:
+        return jsonify({'error': 'seconds and interval must be numbers'}), 400
+    fmt = request.args.get('format', 'collapsed')
+    if not 0 < seconds <= MAX_PROFILE_SECONDS or not 0 < interval <= seconds:
+        msg = 'seconds must be at most {0}, and interval at most seconds'
+        return jsonify({'error': msg.format(MAX_PROFILE_SECONDS)}), 400
+    if fmt not in PROFILE_FORMATS:
+        msg = 'Unknown format {0}; expected one of {1}'
+        return jsonify({'error': msg.format(fmt, ', '.join(PROFILE_FORMATS))}), 400
+    log.info('Admin profile for {0}s every {1}s'.format(seconds, interval))
+    result = profiler.profile(seconds, interval)
+    if result is None:
+        return jsonify({'error': 'A profile is already running'}), 409
+    if fmt == 'summary':
+        return jsonify(result.summary())
+    if fmt == 'pstats':
+        return Response(result.pstats(), mimetype='application/octet-stream')
+    return Response(result.collapsed(), mimetype='text/plain')
+
+
+class UnixWSGIServer(socketserver.ThreadingMixIn, simple_server.WSGIServer):
+    address_family = socket.AF_UNIX
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+        self.setup_environ()
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        # The request handler expects a (host, port) client address.
+        return request, ('local', 0)
+
+
+class AdminRequestHandler(simple_server.WSGIRequestHandler):
+    def log_message(self, format, *args):
+        log.info('admin: ' + format % args)
+
+
+def _remove_socket(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+@once_per_process
+def start_admin_server():
+    """Serve admin_app on ADMIN_SOCKET.
+
+    `{pid}` in ADMIN_SOCKET is replaced with the process id, so each gunicorn
+    worker, with caches of its own, gets a socket of its own.
+    """
+    path = app.config['ADMIN_SOCKET'].format(pid=os.getpid())
+    # Created without group or other access, rather than chmodded after the
+    # bind, when anyone could have connected to it.
+    umask = os.umask(0o177)
+    try:
+        _remove_socket(path)
+        server = UnixWSGIServer(path, AdminRequestHandler)
+    except OSError:
+        log.exception('Unable to listen on admin socket {0}'.format(path))
+        return
+    finally:
+        os.umask(umask)
+    server.set_app(admin_app)
+    atexit.register(_remove_socket, path)
+    thread = threading.Thread(target=server.serve_forever, name='admin-server', daemon=True)
+    thread.start()
+    log.info('Admin endpoint listening on {0}'.format(path))
+
+
+class AdminServerStarter(object):
+    """WSGI middleware that starts the admin server on the first request."""
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        start_admin_server()
+        return self.wsgi_app(environ, start_response)
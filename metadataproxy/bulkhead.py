@@ -0,0 +1,172 @@
+# Import python libs
+import logging
+import re
+import threading
+import timeit
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy import metrics
+from metadataproxy.util import once_per_process
+
+log = logging.getLogger(__name__)
+
+CLASSES = ('credentials', 'info', 'passthrough')
+
+# IAM paths, as matched by routes/proxy.py.
+RE_IAM_PATH = re.compile(r'^/[^/]+/meta-data/iam/(info|security-credentials)(/?)(.*)$')
+# Served by metadataproxy itself, so never limited.
+EXEMPT_PATHS = ('/healthz', '/readyz')
+
+
+def classify(path):
+    """The route class of a request path, or None if it isn't limited."""
+    if path in EXEMPT_PATHS:
+        return None
+    if app.config['ECS_CREDENTIALS_ENABLED']:
+        prefix = app.config['ECS_CREDENTIALS_PATH'].rstrip('/')
+        if path == prefix or path.startswith(prefix + '/'):
+            return 'credentials'
+    m = RE_IAM_PATH.match(path)
+    if m is None:
+        return 'passthrough'
+    if m.group(1) == 'security-credentials' and m.group(3).strip('/'):
+        return 'credentials'
+    return 'info'
+
+
+class Bulkhead(object):
+    """A concurrency limit with a bounded queue for one route class.
+
+    Up to `concurrency` requests run at once, and up to `queue` more wait for
+    at most `timeout` seconds for a slot. Requests that find the queue full,
+    or time out waiting, are shed.
+    """
+    def __init__(self, name, concurrency, queue, timeout):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.slots = threading.Semaphore(concurrency)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+
+    def acquire(self):
+        """Take a slot. False if the request should be shed."""
+        with self.lock:
+            if self.in_flight >= self.concurrency and self.waiting >= self.queue:
+                metrics.incr('bulkhead.{0}.shed'.format(self.name))
+                return False
+            self.waiting += 1
+        start = timeit.default_timer()
+        try:
+            acquired = self.slots.acquire(timeout=self.timeout)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        if not acquired:
+            metrics.incr('bulkhead.{0}.timeout'.format(self.name))
+            return False
+        with self.lock:
+            self.in_flight += 1
+            in_flight = self.in_flight
+        metrics.observe('bulkhead.{0}.wait'.format(self.name), timeit.default_timer() - start)
+        # Saturation: the fraction of the limit in use as requests are admitted.
+        metrics.observe('bulkhead.{0}.saturation'.format(self.name), in_flight / self.concurrency)
+        return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+    def stats(self):
+        """Limits, load, sheds and timeouts, with wait and saturation summaries.
+
+        `wait` is the seconds admitted requests waited for a slot, and
+        `saturation` the fraction of the limit in use as they were admitted.
+        """
+        snapshot = metrics.snapshot()
+        counters = snapshot['counters']
+        summaries = snapshot['summaries']
+        return {
+            'concurrency': self.concurrency,
+            'queue': self.queue,
+            'timeout': self.timeout,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'shed': counters.get('bulkhead.{0}.shed'.format(self.name), 0),
+            'timeouts': counters.get('bulkhead.{0}.timeout'.format(self.name), 0),
+            'wait': summaries.get('bulkhead.{0}.wait'.format(self.name)),
+            'saturation': summaries.get('bulkhead.{0}.saturation'.format(self.name))
+        }
+
+
+@once_per_process
+def bulkheads():
+    """The bulkheads of this process, by route class."""
+    made = {}
+    for name in CLASSES:
+        key = 'BULKHEAD_{0}'.format(name.upper())
+        if app.config[key + '_CONCURRENCY'] > 0:
+            made[name] = Bulkhead(
+                name,
+                app.config[key + '_CONCURRENCY'],
+                app.config[key + '_QUEUE'],
+                app.config[key + '_TIMEOUT']
+            )
+    return made
+
+
+class _ReleasingIterable(object):
+    """Response iterable that releases the bulkhead slot once it's closed.
+
+    Streamed responses, such as passthrough's, keep running after the WSGI
+    call returns, so the slot is held until the server closes the response.
+    """
+    def __init__(self, iterable, bulkhead):
+        self.iterable = iterable
+        self.bulkhead = bulkhead
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.bulkhead.release()
+
+
+class Bulkheads(object):
+    """WSGI middleware that limits concurrent requests per route class.
+
+    Credential requests, IAM role name and info requests, and requests passed
+    through to the metadata service each have their own limit and queue, so
+    a slow metadata service sheds passthrough requests with a 503 rather than
+    tying up the greenlets credential requests need.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        bulkhead = bulkheads().get(classify(environ.get('PATH_INFO', '')))
+        if bulkhead is None:
+            return self.wsgi_app(environ, start_response)
+        if not bulkhead.acquire():
+            log.debug('Shedding {0} request for {1}; bulkhead is full'.format(
+                bulkhead.name, environ.get('PATH_INFO')
+            ))
+            start_response('503 SERVICE UNAVAILABLE', [
+                ('Content-Type', 'text/plain'),
+                ('Content-Length', '0'),
+                ('Retry-After', '1')
+            ])
+            return [b'']
+        try:
+            return _ReleasingIterable(self.wsgi_app(environ, start_response), bulkhead)
+        except BaseException:
+            bulkhead.release()
+            raise
@@ -0,0 +1,156 @@
+# Import python libs
+import abc
+import hashlib
+import hmac
+import json
+import logging
+from urllib.parse import urlparse
+
+# Import third party libs
+import dateutil.parser
+import redis
+from cryptography.fernet import Fernet
+from cryptography.fernet import InvalidToken
+from cryptography.fernet import MultiFernet
+
+log = logging.getLogger(__name__)
+
+KEY_PREFIX = 'metadataproxy:credentials:'
+LOCK_PREFIX = 'metadataproxy:refreshing:'
+
+
+class CredentialCacheError(Exception):
+    pass
+
+
+def load_keys(path):
+    """Read the encryption keys from a file, one Fernet key per line.
+
+    The first key encrypts; all of them decrypt, so keys can be rotated by
+    adding a new first line on every host before removing the old one. The
+    last key also hashes entry keys, so adding a key keeps the cached
+    entries, and removing the last one flushes them.
+    """
+    with open(path, 'r') as f:
+        keys = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    if not keys:
+        raise CredentialCacheError('No keys in {0}'.format(path))
+    return keys
+
+
+def serialize_role(assumed_role):
+    credentials = assumed_role['Credentials']
+    return json.dumps({
+        'AssumedRoleUser': assumed_role['AssumedRoleUser'],
+        'Credentials': {
+            'AccessKeyId': credentials['AccessKeyId'],
+            'SecretAccessKey': credentials['SecretAccessKey'],
+            'SessionToken': credentials['SessionToken'],
+            'Expiration': credentials['Expiration'].isoformat()
+        },
+        'LastUpdated': assumed_role['LastUpdated'].isoformat()
+    }, separators=(',', ':')).encode('utf-8')
+
+
+def deserialize_role(data):
+    assumed_role = json.loads(data.decode('utf-8'))
+    credentials = assumed_role['Credentials']
+    credentials['Expiration'] = dateutil.parser.parse(credentials['Expiration'])
+    assumed_role['LastUpdated'] = dateutil.parser.parse(assumed_role['LastUpdated'])
+    return assumed_role
+
+
+class CredentialCache(abc.ABC):
+    """Assumed roles shared between proxies, encrypted with a host key.
+
+    Entries are keyed by role ARN, session name, external id and duration,
+    hashed with the oldest key, so neither the ARN nor the external id is
+    readable from the key. Backends store and fetch opaque bytes with _get,
+    _set and _add.
+    """
+    def __init__(self, keys):
+        self.fernet = MultiFernet([Fernet(key) for key in keys])
+        # Not the encrypting key, which changes first when keys are rotated.
+        self.hash_key = hashlib.sha256(keys[-1].encode('utf-8')).digest()
+
+    def key(self, arn, session_name, external_id, duration):
+        ident = '\0'.join([arn, session_name or '', external_id or '', str(duration or '')])
+        return hmac.new(self.hash_key, ident.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def get(self, key):
+        """Return the assumed role stored under key, or None."""
+        data = self._get(KEY_PREFIX + key)
+        if data is None:
+            return None
+        try:
+            return deserialize_role(self.fernet.decrypt(data))
+        except InvalidToken:
+            raise CredentialCacheError('Unable to decrypt entry; is the key the same on all hosts?')
+
+    def set(self, key, assumed_role, ttl):
+        self._set(KEY_PREFIX + key, self.fernet.encrypt(serialize_role(assumed_role)), ttl)
+
+    def lock(self, key, ttl):
+        """Try to take the lock to refresh key. True if taken."""
+        return self._add(LOCK_PREFIX + key, b'1', ttl)
+
+    @abc.abstractmethod
+    def ping(self):
+        """Raise an exception unless the backend is reachable."""
+
+    @abc.abstractmethod
+    def _get(self, key):
+        """Return the value stored under key, or None."""
+
+    @abc.abstractmethod
+    def _set(self, key, value, ttl):
+        """Store value under key for ttl seconds."""
+
+    @abc.abstractmethod
+    def _add(self, key, value, ttl):
+        """Store value under key for ttl seconds unless it's set. True if stored."""
+
+
+class RedisCredentialCache(CredentialCache):
+    """Stores entries in redis, or anything speaking its protocol."""
+    def __init__(self, url, keys, timeout):
+        super(RedisCredentialCache, self).__init__(keys)
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+    def ping(self):
+        self.client.ping()
+
+    def _get(self, key):
+        try:
+            return self.client.get(key)
+        except redis.RedisError as e:
+            raise CredentialCacheError(e)
+
+    def _set(self, key, value, ttl):
+        try:
+            self.client.set(key, value, ex=max(1, int(ttl)))
+        except redis.RedisError as e:
+            raise CredentialCacheError(e)
+
+    def _add(self, key, value, ttl):
+        try:
+            return bool(self.client.set(key, value, ex=max(1, int(ttl)), nx=True))
+        except redis.RedisError as e:
+            raise CredentialCacheError(e)
+
+
+# Backends by URL scheme.
+BACKENDS = {
+    'redis': RedisCredentialCache,
+    'rediss': RedisCredentialCache,
+    'unix': RedisCredentialCache,
+}
+
+
+def make_credential_cache(url, key_file, timeout):
+    scheme = urlparse(url).scheme
+    if scheme not in BACKENDS:
+        raise CredentialCacheError('No credential cache backend for {0}; expected one of {1}'.format(
+            url, ', '.join(sorted(BACKENDS))
+        ))
+    return BACKENDS[scheme](url, load_keys(key_file), timeout)
@@ -0,0 +1,124 @@
+# Import python libs
+import concurrent.futures
+import logging
+import threading
+import timeit
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy import metrics
+from metadataproxy import tracing
+from metadataproxy.util import RequestLocal
+
+log = logging.getLogger(__name__)
+
+# Deadline of the request being handled, as a timeit.default_timer() value.
+_current = RequestLocal()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before `phase` could finish."""
+    def __init__(self, phase):
+        super(DeadlineExceeded, self).__init__(phase)
+        self.phase = phase
+
+
+def start(seconds):
+    _current.expires_at = timeit.default_timer() + seconds
+
+
+def clear():
+    _current.expires_at = None
+
+
+def remaining():
+    """Seconds left until the request's deadline, or None if it has none."""
+    expires_at = getattr(_current, 'expires_at', None)
+    if expires_at is None:
+        return None
+    return expires_at - timeit.default_timer()
+
+
+def check(phase):
+    """Raise DeadlineExceeded if the request's deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        metrics.incr('deadline.exceeded.{0}'.format(phase))
+        raise DeadlineExceeded(phase)
+
+
+def timeout(phase, default):
+    """A timeout for a call made in `phase`: default, capped at the time left.
+
+    Raises DeadlineExceeded if there's no time left.
+    """
+    check(phase)
+    left = remaining()
+    if left is None:
+        return default
+    if default is None:
+        return left
+    return min(default, left)
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=app.config['REQUEST_DEADLINE_WORKERS'],
+                    thread_name_prefix='deadline'
+                )
+    return _executor
+
+
+def call(phase, fn, *args, **kwargs):
+    """Call fn, waiting for it no longer than the request's deadline.
+
+    For calls that can't be given a timeout of their own, such as boto3's
+    and gethostbyaddr. Without a deadline fn is called directly. With one,
+    it runs on a worker thread; if the deadline passes first, DeadlineExceeded
+    is raised and fn is left to finish in the background, so whatever it
+    caches is there for the next request.
+    """
+    if remaining() is None:
+        return fn(*args, **kwargs)
+    check(phase)
+    return wait(phase, executor().submit(tracing.bind(fn), *args, **kwargs))
+
+
+def wait(phase, future):
+    """The result of future, waiting for it no longer than the deadline."""
+    try:
+        return future.result(timeout=remaining())
+    except concurrent.futures.TimeoutError:
+        metrics.incr('deadline.exceeded.{0}'.format(phase))
+        raise DeadlineExceeded(phase)
+
+
+@app.errorhandler(DeadlineExceeded)
+def deadline_exceeded(e):
+    log.error('Request deadline exceeded during {0}; returning 504.'.format(e.phase))
+    return '', 504
+
+
+class RequestDeadline(object):
+    """WSGI middleware that gives each request REQUEST_DEADLINE seconds.
+
+    Container lookups, role ARN lookups and role assumption check the
+    deadline between phases and cap their timeouts at the time left. Once it
+    passes, requests are answered with still valid credentials if there are
+    any, or a 504, rather than keep the client waiting past its own timeout.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        start(app.config['REQUEST_DEADLINE'])
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            clear()
@@ -0,0 +1,119 @@
+# Import python libs
+import functools
+
+# Import third party libs
+import docker
+import docker.errors
+import requests.adapters
+import requests.exceptions
+from docker.transport.unixconn import UnixAdapter
+from docker.transport.unixconn import UnixHTTPConnectionPool
+
+# Import metadataproxy libs
+from metadataproxy import deadline
+from metadataproxy import metrics
+
+
+class PooledUnixAdapter(UnixAdapter):
+    """UnixAdapter that reuses up to pool_size connections to the socket.
+
+    docker-py's adapter keys its connection pools by the full request URL, so
+    every container inspect gets a pool, and a connection, of its own, and
+    each pool only keeps urllib3's default number of idle connections. Every
+    request here goes to the same socket, so they share one pool.
+    """
+    def __init__(self, socket_url, timeout, pool_size):
+        self.pool_size = pool_size
+        self.pool = None
+        super(PooledUnixAdapter, self).__init__(socket_url, timeout, num_pools=1)
+
+    def get_connection(self, url, proxies=None):
+        with self.pools.lock:
+            if self.pool is None:
+                self.pool = UnixHTTPConnectionPool(
+                    url,
+                    self.socket_path,
+                    self.timeout,
+                    maxsize=self.pool_size
+                )
+            return self.pool
+
+    def close(self):
+        with self.pools.lock:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+
+
+def instrumented(endpoint):
+    """Record the latency and errors of a docker API call under endpoint.
+
+    Latency goes to the docker.<endpoint>.duration summary. Failed calls
+    increment docker.<endpoint>.not_found for missing containers,
+    docker.<endpoint>.timeout for timeouts and docker.<endpoint>.error for
+    anything else. Timeouts that ran into the request deadline are raised as
+    DeadlineExceeded.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            try:
+                with metrics.MetricsTimer('docker.{0}.duration'.format(endpoint)):
+                    return method(*args, **kwargs)
+            except docker.errors.NotFound:
+                metrics.incr('docker.{0}.not_found'.format(endpoint))
+                raise
+            except requests.exceptions.Timeout:
+                metrics.incr('docker.{0}.timeout'.format(endpoint))
+                deadline.check('docker.{0}'.format(endpoint))
+                raise
+            except Exception:
+                metrics.incr('docker.{0}.error'.format(endpoint))
+                raise
+        return wrapper
+    return decorator
+
+
+class Client(docker.Client):
+    """docker.Client with a sized connection pool and per-endpoint metrics.
+
+    Every call uses `timeout` seconds as its connect and read timeout, capped
+    at the time left until the request deadline, except for the events
+    stream, which is expected to idle.
+    """
+    def __init__(self, base_url, version, timeout, pool_size):
+        super(Client, self).__init__(base_url=base_url, version=version, timeout=timeout)
+        if isinstance(getattr(self, '_custom_adapter', None), UnixAdapter):
+            self._custom_adapter.close()
+            self._custom_adapter = PooledUnixAdapter(
+                self._custom_adapter.socket_path,
+                timeout,
+                pool_size
+            )
+            self.mount('http+docker://', self._custom_adapter)
+        else:
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+            self.mount('http://', adapter)
+            self.mount('https://', adapter)
+
+    def _set_request_timeout(self, kwargs):
+        kwargs.setdefault('timeout', deadline.timeout('docker', self.timeout))
+        return kwargs
+
+    @instrumented('containers')
+    def containers(self, *args, **kwargs):
+        return super(Client, self).containers(*args, **kwargs)
+
+    @instrumented('inspect_container')
+    def inspect_container(self, *args, **kwargs):
+        return super(Client, self).inspect_container(*args, **kwargs)
+
+    @instrumented('events')
+    def events(self, *args, **kwargs):
+        # Only opening the stream is timed; reading it blocks until the
+        # next event.
+        return super(Client, self).events(*args, **kwargs)
+
+    @instrumented('ping')
+    def ping(self, *args, **kwargs):
+        return super(Client, self).ping(*args, **kwargs)
@@ -0,0 +1,114 @@
+# Import python libs
+import json
+import logging
+import re
+
+# Import third party libs
+from werkzeug.exceptions import InternalServerError
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy import deadline
+from metadataproxy import roles
+from metadataproxy.routes.proxy import _supports_iam
+
+log = logging.getLogger(__name__)
+
+# The IAM paths served by routes/proxy.py, limited to printable ASCII so that
+# anything needing werkzeug's path decoding is left to flask:
+#   /<api_version>/meta-data/iam/info[/<junk>]
+#   /<api_version>/meta-data/iam/security-credentials/[<role>]
+RE_IAM_PATH = re.compile(
+    r'^/([!-.0-~]+)/meta-data/iam/(info|security-credentials)((?:/[!-~]*)?)$'
+)
+
+HTML_CONTENT_TYPE = 'text/html; charset=utf-8'
+
+
+class IAMFastPath(object):
+    """WSGI middleware that serves the IAM credential routes without flask.
+
+    Requests for the paths handled by iam_role_info, iam_role_name and
+    iam_sts_credentials in routes/proxy.py are answered directly, skipping
+    werkzeug's URL matching and the flask request and response objects. The
+    responses are the same as the flask routes'. Everything else, including
+    IAM paths for API versions without IAM support, goes to wsgi_app.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        if app.config['JSONIFY_PRETTYPRINT_REGULAR'] or app.debug:
+            self.json_kwargs = {'indent': 2, 'separators': (', ', ': ')}
+        else:
+            self.json_kwargs = {'separators': (',', ':')}
+        self.json_kwargs['sort_keys'] = app.config['JSON_SORT_KEYS']
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD')
+        if method != 'GET' and method != 'HEAD':
+            return self.wsgi_app(environ, start_response)
+        m = RE_IAM_PATH.match(environ.get('PATH_INFO', ''))
+        if m is None or '//' in m.group(3) or not _supports_iam(m.group(1)):
+            return self.wsgi_app(environ, start_response)
+        api_version, resource, rest = m.groups()
+        if resource == 'security-credentials' and not rest:
+            # flask redirects to the path with a trailing slash.
+            return self.wsgi_app(environ, start_response)
+        ip = environ.get('REMOTE_ADDR')
+        try:
+            if resource == 'info':
+                status, content_type, body = self.iam_role_info(ip)
+            elif rest == '/':
+                status, content_type, body = self.iam_role_name(ip)
+            else:
+                status, content_type, body = self.iam_sts_credentials(ip, api_version, rest[1:])
+        except deadline.DeadlineExceeded as e:
+            log.error('Request deadline exceeded during {0}; returning 504.'.format(e.phase))
+            status, content_type, body = '504 GATEWAY TIMEOUT', HTML_CONTENT_TYPE, ''
+        except Exception:
+            log.exception('Exception on {0} [{1}]'.format(environ.get('PATH_INFO'), method))
+            return InternalServerError()(environ, start_response)
+        body = body.encode('utf-8')
+        start_response(status, [
+            ('Content-Type', content_type),
+            ('Content-Length', str(len(body)))
+        ])
+        if method == 'HEAD':
+            return [b'']
+        return [body]
+
+    def jsonify(self, data):
+        return '200 OK', app.config['JSONIFY_MIMETYPE'], json.dumps(data, **self.json_kwargs) + '\n'
+
+    def iam_role_info(self, ip):
+        role_params_from_ip = roles.get_role_params_from_ip(ip)
+        if role_params_from_ip['name']:
+            log.debug('Providing IAM role info for {0}'.format(role_params_from_ip['name']))
+            return self.jsonify(roles.get_role_info_from_params(role_params_from_ip))
+        log.error('Role name not found; returning 404.')
+        return '404 NOT FOUND', HTML_CONTENT_TYPE, ''
+
+    def iam_role_name(self, ip):
+        role_params_from_ip = roles.get_role_params_from_ip(ip)
+        if role_params_from_ip['name']:
+            return '200 OK', HTML_CONTENT_TYPE, role_params_from_ip['name']
+        log.error('Role name not found; returning 404.')
+        return '404 NOT FOUND', HTML_CONTENT_TYPE, ''
+
+    def iam_sts_credentials(self, ip, api_version, requested_role):
+        try:
+            role_params = roles.get_role_params_from_ip(
+                ip,
+                requested_role=requested_role.rstrip('/')
+            )
+        except roles.UnexpectedRoleError:
+            msg = "Role name {0} doesn't match expected role for container"
+            log.error(msg.format(requested_role))
+            return '404 NOT FOUND', HTML_CONTENT_TYPE, ''
+
+        log.debug('Providing assumed role credentials for {0}'.format(role_params['name']))
+        assumed_role = roles.get_assumed_role_credentials(
+            role_params=role_params,
+            api_version=api_version,
+            client=ip
+        )
+        return self.jsonify(assumed_role)
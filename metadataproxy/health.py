@@ -0,0 +1,181 @@
+# Import python libs
+import logging
+import threading
+import time
+import timeit
+
+# Import third party libs
+import requests
+from botocore.exceptions import ClientError
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy import roles
+from metadataproxy.util import once_per_process
+
+log = logging.getLogger(__name__)
+
+# Latest result of each dependency probe, keyed by probe name.
+PROBE_RESULTS = {}
+_probe_clients = {}
+
+
+def probe_client(service):
+    """STS and IAM clients for probes: no retries, and the probe timeout."""
+    if service not in _probe_clients:
+        roles.load_client_libraries()
+        from botocore.config import Config
+        timeout = app.config['HEALTH_PROBE_TIMEOUT']
+        config = Config(connect_timeout=timeout, read_timeout=timeout, retries={'max_attempts': 0})
+        if service == 'sts':
+            _probe_clients[service] = roles.make_sts_client(config=config)
+        else:
+            _probe_clients[service] = roles.make_iam_client(config=config)
+    return _probe_clients[service]
+
+
+def probe_docker():
+    # Uses the shared client, so the timeout is DOCKER_TIMEOUT.
+    roles.docker_client().ping()
+
+
+def probe_sts():
+    probe_client('sts').get_caller_identity()
+
+
+def probe_iam():
+    try:
+        probe_client('iam').list_roles(MaxItems=1)
+    except ClientError as e:
+        # metadataproxy only needs iam:GetRole, so an access denied error
+        # still shows IAM is answering.
+        if e.response['Error']['Code'] != 'AccessDenied':
+            raise
+
+
+def probe_metadata():
+    resp = requests.get(
+        '{0}/latest/meta-data/'.format(app.config['METADATA_URL']),
+        timeout=app.config['HEALTH_PROBE_TIMEOUT']
+    )
+    resp.raise_for_status()
+
+
+def probe_mesos():
+    # The state document can be large; only wait for the headers.
+    with requests.get(
+        app.config['MESOS_STATE_URL'],
+        timeout=app.config['HEALTH_PROBE_TIMEOUT'],
+        stream=True
+    ) as resp:
+        resp.raise_for_status()
+
+
+def probe_kubelet():
+    roles.kubelet_index().fetch()
+
+
+def probe_credential_cache():
+    roles.credential_cache().ping()
+
+
+def enabled_probes():
+    """The dependencies metadataproxy uses with the current settings."""
+    probes = {'sts': probe_sts}
+    if not app.config['ROLE_MAPPING_FILE']:
+        probes['docker'] = probe_docker
+    if not app.config['DEFAULT_ACCOUNT_ID']:
+        probes['iam'] = probe_iam
+    if not app.config['MOCK_API']:
+        probes['metadata'] = probe_metadata
+    if app.config['MESOS_STATE_LOOKUP']:
+        probes['mesos'] = probe_mesos
+    if app.config['KUBELET_RESOLVER']:
+        probes['kubelet'] = probe_kubelet
+    if app.config['CREDENTIAL_CACHE_URL']:
+        probes['credential_cache'] = probe_credential_cache
+    return probes
+
+
+def run_probe(name, probe):
+    start = timeit.default_timer()
+    error = None
+    try:
+        probe()
+    except Exception as e:
+        error = '{0}: {1}'.format(type(e).__name__, e)
+    PROBE_RESULTS[name] = {
+        'ok': error is None,
+        'error': error,
+        'latency': timeit.default_timer() - start,
+        'checked_at': time.time()
+    }
+
+
+def run_probes():
+    for name, probe in sorted(enabled_probes().items()):
+        run_probe(name, probe)
+
+
+def probe_forever():
+    while True:
+        try:
+            run_probes()
+        except Exception:
+            log.exception('Error while running health probes')
+        time.sleep(app.config['HEALTH_PROBE_INTERVAL'])
+
+
+@once_per_process
+def start_prober():
+    """Start probing dependencies in the background, on the first health request."""
+    thread = threading.Thread(target=probe_forever, name='health-prober', daemon=True)
+    thread.start()
+
+
+def probe_results():
+    now = time.time()
+    results = {}
+    for name, result in list(PROBE_RESULTS.items()):
+        result = dict(result)
+        result['age'] = now - result.pop('checked_at')
+        results[name] = result
+    return results
+
+
+def readiness():
+    """Return (ready, reasons) from the latest probe results.
+
+    Results older than three probe intervals count as failures, so a prober
+    that is stuck makes the worker unready rather than reporting old results.
+    """
+    max_age = 3 * app.config['HEALTH_PROBE_INTERVAL'] + app.config['HEALTH_PROBE_TIMEOUT']
+    results = probe_results()
+    reasons = []
+    for name in sorted(enabled_probes()):
+        result = results.get(name)
+        if result is None:
+            reasons.append('{0}: not probed yet'.format(name))
+        elif not result['ok']:
+            reasons.append('{0}: {1}'.format(name, result['error']))
+        elif result['age'] > max_age:
+            reasons.append('{0}: last probed {1:.0f}s ago'.format(name, result['age']))
+    return not reasons, reasons
+
+
+def cache_warmth():
+    """Number of entries in each cache requests are served from."""
+    warmth = {
+        'container_mapping': len(roles.CONTAINER_MAPPING),
+        'roles': len(roles.ROLES),
+        'role_arns': len(roles.ROLE_ARNS),
+    }
+    if app.config['ECS_CREDENTIALS_ENABLED']:
+        warmth['container_credentials'] = len(roles.CONTAINER_CREDENTIAL_PARAMS)
+    if app.config['MESOS_STATE_LOOKUP']:
+        warmth['mesos'] = len(roles.MESOS_CONTAINERS)
+    if app.config['PROC_RESOLVER'] and roles._proc_index is not None:
+        warmth['proc_index'] = len(roles._proc_index.ips)
+    if app.config['KUBELET_RESOLVER'] and roles._kubelet_index is not None:
+        warmth['kubelet_pods'] = len(roles._kubelet_index.ips)
+    return warmth
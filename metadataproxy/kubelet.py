@@ -0,0 +1,168 @@
+# Import python libs
+import logging
+import threading
+import time
+
+# Import third party libs
+import requests
+
+log = logging.getLogger(__name__)
+
+
+def pod_ips(pod):
+    status = pod.get('status') or {}
+    ips = [p['ip'] for p in status.get('podIPs') or [] if p.get('ip')]
+    if not ips and status.get('podIP'):
+        ips = [status['podIP']]
+    return ips
+
+
+def pod_container(pod, role_annotation, external_id_annotation):
+    """Describe a pod in the shape of a docker container inspect.
+
+    Env has the literal env vars of the pod's containers, followed by
+    IAM_ROLE and IAM_EXTERNAL_ID from the role annotations. The last of an
+    env var is the one read, so the annotations take precedence over the
+    env, as they do for kube2iam; either is set by whoever creates the pod.
+    Labels has the pod's labels and annotations, annotations taking
+    precedence.
+    """
+    metadata = pod['metadata']
+    annotations = metadata.get('annotations') or {}
+    env = []
+    for container in pod['spec'].get('containers') or []:
+        for var in container.get('env') or []:
+            # Values from secrets, config maps or fields aren't in the pod list.
+            if 'value' in var:
+                env.append('{0}={1}'.format(var['name'], var['value']))
+    if annotations.get(role_annotation):
+        env.append('IAM_ROLE={0}'.format(annotations[role_annotation]))
+    if annotations.get(external_id_annotation):
+        env.append('IAM_EXTERNAL_ID={0}'.format(annotations[external_id_annotation]))
+    labels = dict(metadata.get('labels') or {})
+    labels.update(annotations)
+    return {
+        'Id': metadata['uid'],
+        'Name': '{0}/{1}'.format(metadata.get('namespace'), metadata.get('name')),
+        'State': {'Running': True},
+        'Config': {'Env': env, 'Labels': labels}
+    }
+
+
+class KubeletPodIndex(object):
+    """An index of pod IP to pod, built from the kubelet's list of pods.
+
+    Only running pods are indexed, and pods in the host network are skipped,
+    since their address doesn't identify a pod. Pods are stored as
+    pod_container describes them, so a lookup is a single dict lookup.
+
+    refresh() is incremental: pods whose uid and resourceVersion are unchanged
+    keep their entries, only new and changed pods are read, and pods that are
+    gone are dropped.
+    """
+    def __init__(self, pods_url, token_file='', ca_file='', timeout=2.0,
+                 role_annotation='iam.amazonaws.com/role',
+                 external_id_annotation='iam.amazonaws.com/external-id'):
+        self.pods_url = pods_url
+        self.token_file = token_file
+        self.ca_file = ca_file
+        self.timeout = timeout
+        self.role_annotation = role_annotation
+        self.external_id_annotation = external_id_annotation
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        # uid -> (resourceVersion, ips)
+        self.pods = {}
+        # ip -> container
+        self.ips = {}
+        self.refreshed_at = 0
+
+    def _headers(self):
+        # Read on every fetch, since service account tokens are rotated.
+        if not self.token_file:
+            return {}
+        try:
+            with open(self.token_file, 'r') as f:
+                return {'Authorization': 'Bearer {0}'.format(f.read().strip())}
+        except OSError:
+            return {}
+
+    def fetch(self, timeout=None):
+        resp = self.session.get(
+            self.pods_url,
+            headers=self._headers(),
+            verify=self.ca_file or True,
+            timeout=timeout or self.timeout
+        )
+        resp.raise_for_status()
+        return resp.json().get('items') or []
+
+    def refresh(self, timeout=None):
+        items = self.fetch(timeout)
+        with self.lock:
+            live = set()
+            for pod in items:
+                metadata = pod.get('metadata') or {}
+                uid = metadata.get('uid')
+                if not uid:
+                    continue
+                ips = pod_ips(pod)
+                if (pod.get('status') or {}).get('phase') != 'Running' or not ips or \
+                        (pod.get('spec') or {}).get('hostNetwork'):
+                    continue
+                live.add(uid)
+                version = metadata.get('resourceVersion')
+                entry = self.pods.get(uid)
+                if entry is not None and entry[0] == version:
+                    continue
+                self._remove_pod(uid)
+                container = pod_container(pod, self.role_annotation, self.external_id_annotation)
+                self.pods[uid] = (version, ips)
+                for ip in ips:
+                    self.ips[ip] = container
+            for uid in set(self.pods) - live:
+                self._remove_pod(uid)
+            self.refreshed_at = time.time()
+
+    def _remove_pod(self, uid):
+        entry = self.pods.pop(uid, None)
+        if entry is None:
+            return
+        for ip in entry[1]:
+            container = self.ips.get(ip)
+            # The IP may already have been given to a new pod.
+            if container is not None and container['Id'] == uid:
+                del self.ips[ip]
+
+    def refresh_if_older(self, seconds, timeout=None):
+        """Refresh unless the index was refreshed in the last `seconds`.
+
+        Callers that aren't pods, such as processes in the host network, miss
+        the index on every request; this keeps them from fetching the pod
+        list on every request too. True if the index was refreshed.
+        """
+        if time.time() - self.refreshed_at < seconds:
+            return False
+        self.refresh(timeout)
+        return True
+
+    def forget(self, uid):
+        """Drop the pod uid from the index, so the next refresh reads it again."""
+        with self.lock:
+            self._remove_pod(uid)
+
+    def lookup(self, ip):
+        """Return the pod owning ip, as pod_container describes it, or None."""
+        return self.ips.get(ip)
+
+    def start_refresher(self, interval):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception:
+                    log.exception('Error while refreshing the kubelet pod index')
+        thread = threading.Thread(target=run, name='kubelet-refresher', daemon=True)
+        thread.start()
+        return thread
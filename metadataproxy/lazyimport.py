@@ -0,0 +1,18 @@
+# Import python libs
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Return module name, deferring its import until an attribute is used.
+
+    If the module is already imported it is returned as is.
+    """
+    module = sys.modules.get(name)
+    if module is None:
+        spec = importlib.util.find_spec(name)
+        spec.loader = importlib.util.LazyLoader(spec.loader)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,72 @@
+# Import python libs
+import collections
+import threading
+import timeit
+
+# In-process counters and value summaries. Memory is fixed by the number of
+# metric names, which are all static strings in the code.
+_lock = threading.Lock()
+COUNTERS = {}
+SUMMARIES = {}
+# The most recent values of each summary, for percentiles.
+RECENT = {}
+RECENT_VALUES = 1024
+PERCENTILES = (50, 90, 99)
+
+
+def incr(name, value=1):
+    with _lock:
+        COUNTERS[name] = COUNTERS.get(name, 0) + value
+
+
+def observe(name, value):
+    """Add a value to the count/total/min/max summary for name."""
+    with _lock:
+        summary = SUMMARIES.get(name)
+        if summary is None:
+            SUMMARIES[name] = {'count': 1, 'total': value, 'min': value, 'max': value}
+            RECENT[name] = collections.deque([value], maxlen=RECENT_VALUES)
+        else:
+            summary['count'] += 1
+            summary['total'] += value
+            summary['min'] = min(summary['min'], value)
+            summary['max'] = max(summary['max'], value)
+            RECENT[name].append(value)
+
+
+class MetricsTimer(object):
+    """Block timer that records its duration, in seconds, under name."""
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = timeit.default_timer()
+        return self
+
+    def __exit__(self, *args):
+        self.exec_duration = timeit.default_timer() - self.start_time
+        observe(self.name, self.exec_duration)
+
+
+def snapshot():
+    """Counters, and summaries with their mean and percentiles.
+
+    Percentiles are of the last RECENT_VALUES values of each summary.
+    """
+    with _lock:
+        summaries = {}
+        for name, summary in SUMMARIES.items():
+            summary = dict(summary)
+            summary['mean'] = summary['total'] / summary['count']
+            recent = sorted(RECENT[name])
+            for p in PERCENTILES:
+                summary['p{0}'.format(p)] = recent[min(len(recent) - 1, len(recent) * p // 100)]
+            summaries[name] = summary
+        return {'counters': dict(COUNTERS), 'summaries': summaries}
+
+
+def reset():
+    with _lock:
+        COUNTERS.clear()
+        SUMMARIES.clear()
+        RECENT.clear()
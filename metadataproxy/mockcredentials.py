@@ -0,0 +1,96 @@
+# Import python libs
+import base64
+import datetime
+import hashlib
+import hmac
+import logging
+import random
+import time
+
+# Import third party libs
+import dateutil.tz
+from botocore.exceptions import ClientError
+
+# Import metadataproxy libs
+from metadataproxy import app
+
+log = logging.getLogger(__name__)
+
+DEFAULT_ACCOUNT_ID = '000000000000'
+
+
+def _simulate(operation):
+    """Sleep for the configured latency, then fail at the configured rate."""
+    latency = app.config['MOCK_CREDENTIALS_LATENCY']
+    if latency:
+        time.sleep(latency)
+    if random.random() < app.config['MOCK_CREDENTIALS_ERROR_RATE']:
+        raise ClientError({
+            'Error': {'Code': 'Throttling', 'Message': 'Rate exceeded (mocked)'},
+            'ResponseMetadata': {'HTTPStatusCode': 400}
+        }, operation)
+
+
+def _digest(*parts):
+    key = app.config['MOCK_CREDENTIALS_SEED'].encode('utf-8')
+    return hmac.new(key, '\0'.join(parts).encode('utf-8'), hashlib.sha256).digest()
+
+
+def mint_credentials(arn, session_name, external_id, issued_at, duration):
+    """Credentials in the shape of an sts:AssumeRole response.
+
+    The keys and token are derived from MOCK_CREDENTIALS_SEED, the role, the
+    session name, the external id and the duration only, so they're the same
+    on every refresh and on every proxy with the same seed. Only the
+    expiration depends on when they were issued.
+    """
+    ident = [arn, session_name, external_id or '', str(duration)]
+    key_id = base64.b32encode(_digest('key', *ident)).decode('ascii')[:16]
+    secret = base64.b64encode(_digest('secret', *ident) + _digest('secret2', *ident)).decode('ascii')[:40]
+    token = base64.b64encode(b''.join(_digest('token', str(i), *ident) for i in range(10))).decode('ascii')
+    role_id = base64.b32encode(_digest('role', arn)).decode('ascii')[:17]
+    role_name = arn.split(':role/', 1)[-1].rsplit('/', 1)[-1]
+    account_id = arn.split(':')[4]
+    expiration = datetime.datetime.fromtimestamp(int(issued_at) + duration, dateutil.tz.tzutc())
+    return {
+        'Credentials': {
+            'AccessKeyId': 'ASIA' + key_id,
+            'SecretAccessKey': secret,
+            'SessionToken': token,
+            'Expiration': expiration
+        },
+        'AssumedRoleUser': {
+            'AssumedRoleId': 'AROA{0}:{1}'.format(role_id, session_name),
+            'Arn': 'arn:aws:sts::{0}:assumed-role/{1}/{2}'.format(account_id, role_name, session_name)
+        }
+    }
+
+
+class MockSTSClient(object):
+    """Stands in for the boto3 STS client, minting credentials locally."""
+    def assume_role(self, RoleArn, RoleSessionName, ExternalId=None, DurationSeconds=None):
+        _simulate('AssumeRole')
+        duration = DurationSeconds or app.config['MOCK_CREDENTIALS_DURATION']
+        return mint_credentials(RoleArn, RoleSessionName, ExternalId, time.time(), duration)
+
+    def get_caller_identity(self):
+        _simulate('GetCallerIdentity')
+        account_id = app.config['DEFAULT_ACCOUNT_ID'] or DEFAULT_ACCOUNT_ID
+        return {
+            'UserId': 'AIDAMOCKED',
+            'Account': account_id,
+            'Arn': 'arn:aws:iam::{0}:user/metadataproxy'.format(account_id)
+        }
+
+
+class MockIAMClient(object):
+    """Stands in for the boto3 IAM client, for role ARN lookups."""
+    def get_role(self, RoleName, Path='/'):
+        _simulate('GetRole')
+        account_id = app.config['DEFAULT_ACCOUNT_ID'] or DEFAULT_ACCOUNT_ID
+        arn = 'arn:aws:iam::{0}:role{1}{2}'.format(account_id, Path, RoleName)
+        return {'Role': {'RoleName': RoleName, 'Path': Path, 'Arn': arn}}
+
+    def list_roles(self, MaxItems=100):
+        _simulate('ListRoles')
+        return {'Roles': [], 'IsTruncated': False}
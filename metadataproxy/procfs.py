@@ -0,0 +1,238 @@
+# Import python libs
+import logging
+import os
+import re
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Container ids as they appear in cgroup paths for docker (cgroupfs and
+# systemd drivers) and for kubelet-managed containers:
+#   12:memory:/docker/<id>
+#   0::/system.slice/docker-<id>.scope
+#   0::/kubepods/besteffort/pod<uid>/<id>
+RE_CGROUP_CONTAINER_ID = re.compile(r'[/-]([0-9a-f]{64})(?:\.scope)?$')
+
+
+class ProcNetIndex(object):
+    """An index of caller IP to container, built from local kernel state.
+
+    For every process on the host that belongs to a container cgroup, the
+    container id is read from /proc/<pid>/cgroup and its network namespace
+    from /proc/<pid>/ns/net. The IPv4 addresses local to each network
+    namespace are read once per namespace from /proc/<pid>/net/fib_trie.
+    Processes in the host network namespace are skipped, since their address
+    doesn't identify a container.
+
+    refresh() is incremental: it only reads the cgroup and namespace of
+    processes it hasn't seen before, and drops processes and namespaces that
+    are gone. A new process may not have been moved into its container's
+    cgroup yet, and a new namespace may not have its interface configured
+    yet, so processes that didn't resolve to a container are read again for
+    `retry_window` seconds after they're first seen, and namespaces without
+    addresses are read again on every refresh.
+    """
+    def __init__(self, proc_root='/proc', retry_window=60):
+        self.proc_root = proc_root
+        self.retry_window = retry_window
+        self.lock = threading.Lock()
+        # pid -> (container_id, netns inode, start time), or None for
+        # non-container pids
+        self.pids = {}
+        # pid -> time first seen, for pids that didn't resolve to a container
+        # and are still read again on refresh
+        self.unresolved = {}
+        # netns inode -> set of pids in it
+        self.netns_pids = {}
+        # netns inode -> list of IPs local to it
+        self.netns_ips = {}
+        # ip -> (container_id, pid)
+        self.ips = {}
+        self.host_netns = self._netns('1')
+        self.refreshed_at = 0
+
+    def _path(self, pid, *parts):
+        return os.path.join(self.proc_root, pid, *parts)
+
+    def _netns(self, pid):
+        try:
+            return os.stat(self._path(pid, 'ns', 'net')).st_ino
+        except OSError:
+            return None
+
+    def _container_id(self, pid):
+        try:
+            with open(self._path(pid, 'cgroup'), 'r') as f:
+                for line in f:
+                    m = RE_CGROUP_CONTAINER_ID.search(line.strip())
+                    if m:
+                        return m.group(1)
+        except OSError:
+            pass
+        return None
+
+    def _start_time(self, pid):
+        """Start time of pid in clock ticks since boot, or None if it exited."""
+        try:
+            with open(self._path(pid, 'stat'), 'r') as f:
+                stat = f.read()
+        except OSError:
+            return None
+        # Field 22; the command name in field 2 can contain spaces and parens.
+        try:
+            return int(stat[stat.rindex(')') + 2:].split()[19])
+        except (ValueError, IndexError):
+            return None
+
+    def _oldest(self, pids):
+        # By start time, since pids wrap around.
+        return min(pids, key=lambda pid: (self.pids[pid][2], int(pid)))
+
+    def _netns_ips(self, pid):
+        ips = []
+        last = None
+        try:
+            with open(self._path(pid, 'net', 'fib_trie'), 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith('|--'):
+                        last = line[3:].strip()
+                    elif line.startswith('/32 host LOCAL') and last:
+                        if not last.startswith('127.') and last not in ips:
+                            ips.append(last)
+        except OSError:
+            return None
+        return ips
+
+    def refresh(self):
+        with self.lock:
+            try:
+                live = set(p for p in os.listdir(self.proc_root) if p.isdigit())
+            except OSError:
+                log.exception('Unable to list processes in {0}'.format(self.proc_root))
+                return
+            for pid in set(self.pids) - live:
+                self._remove_pid(pid)
+            now = time.time()
+            for pid, first_seen in list(self.unresolved.items()):
+                if now - first_seen > self.retry_window:
+                    # Not a container process, after all.
+                    del self.unresolved[pid]
+                else:
+                    del self.pids[pid]
+                    self._add_pid(pid, first_seen)
+            for pid in live - set(self.pids):
+                self._add_pid(pid)
+            self._read_unaddressed_netns()
+            self.refreshed_at = time.time()
+
+    def refresh_if_older(self, seconds):
+        """Refresh unless the index was refreshed in the last `seconds`.
+
+        Callers that aren't containers, such as processes in the host
+        network, miss the index on every request; this keeps them from
+        listing /proc on every request too. True if the index was refreshed.
+        """
+        if time.time() - self.refreshed_at < seconds:
+            return False
+        self.refresh()
+        return True
+
+    def rebuild(self):
+        with self.lock:
+            self.pids = {}
+            self.unresolved = {}
+            self.netns_pids = {}
+            self.netns_ips = {}
+            self.ips = {}
+        self.refresh()
+
+    def _add_pid(self, pid, first_seen=None):
+        container_id = self._container_id(pid)
+        netns = self._netns(pid) if container_id else None
+        if not container_id or netns is None or netns == self.host_netns:
+            self.pids[pid] = None
+            self.unresolved[pid] = first_seen or time.time()
+            return
+        start_time = self._start_time(pid)
+        if start_time is None:
+            # The process exited while we were reading it.
+            self.unresolved.pop(pid, None)
+            return
+        self.unresolved.pop(pid, None)
+        self.pids[pid] = (container_id, netns, start_time)
+        if netns not in self.netns_pids:
+            ips = self._netns_ips(pid)
+            if ips is None:
+                # The process exited while we were reading it.
+                del self.pids[pid]
+                return
+            self.netns_ips[netns] = ips
+            self.netns_pids[netns] = set()
+            for ip in ips:
+                self.ips[ip] = (container_id, pid)
+        self.netns_pids[netns].add(pid)
+        # Map the namespace to its oldest process, normally the init of the
+        # container that owns it, rather than to a container sharing it.
+        current = self.ips.get(self.netns_ips[netns][0]) if self.netns_ips[netns] else None
+        if current and self._oldest([pid, current[1]]) == pid:
+            for ip in self.netns_ips[netns]:
+                self.ips[ip] = (container_id, pid)
+
+    def _read_unaddressed_netns(self):
+        # Namespaces read before their interface was configured, or with
+        # only a loopback interface.
+        for netns, ips in list(self.netns_ips.items()):
+            if ips:
+                continue
+            pid = self._oldest(self.netns_pids[netns])
+            ips = self._netns_ips(pid)
+            if not ips:
+                continue
+            self.netns_ips[netns] = ips
+            for ip in ips:
+                self.ips[ip] = (self.pids[pid][0], pid)
+
+    def _remove_pid(self, pid):
+        self.unresolved.pop(pid, None)
+        entry = self.pids.pop(pid, None)
+        if entry is None:
+            return
+        netns = entry[1]
+        pids = self.netns_pids.get(netns, set())
+        pids.discard(pid)
+        if pids:
+            # Point the namespace's IPs at a process that is still alive.
+            survivor = self._oldest(pids)
+            for ip in self.netns_ips[netns]:
+                self.ips[ip] = (self.pids[survivor][0], survivor)
+            return
+        for ip in self.netns_ips.pop(netns, []):
+            self.ips.pop(ip, None)
+        self.netns_pids.pop(netns, None)
+
+    def forget(self, pid):
+        """Drop pid from the index, so the next refresh reads it again."""
+        with self.lock:
+            self._remove_pid(pid)
+
+    def lookup(self, ip):
+        """Return (container_id, pid) for the container owning ip, or None."""
+        return self.ips.get(ip)
+
+    def is_current(self, pid, container_id):
+        """Check that pid still belongs to container_id, in case it was reused."""
+        return self._container_id(pid) == container_id
+
+    def start_refresher(self, interval):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception:
+                    log.exception('Error while refreshing the /proc network index')
+        thread = threading.Thread(target=run, name='procfs-refresher', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,158 @@
+# Import python libs
+import collections
+import marshal
+import sys
+import threading
+import time
+
+try:
+    from gevent import monkey
+except ImportError:
+    monkey = None
+
+# Functions time is attributed to in profile summaries.
+ATTRIBUTED_PREFIXES = ('metadataproxy.roles.', 'metadataproxy.routes.')
+
+_profile_lock = threading.Lock()
+
+
+def _original(module, name):
+    """module.name as it was before gevent monkey patched it, if it did.
+
+    The sampler has to run in an OS thread of its own, or it would only get
+    to sample when the greenlet it interrupts yields.
+    """
+    if monkey is not None:
+        return monkey.get_original(module, name)
+    return getattr(sys.modules[module], name)
+
+
+def _frame_key(frame):
+    code = frame.f_code
+    return (
+        frame.f_globals.get('__name__', '?'),
+        code.co_name,
+        code.co_filename,
+        code.co_firstlineno
+    )
+
+
+class SamplingProfile(object):
+    """Stacks of all threads, sampled every `interval` seconds.
+
+    Under gevent, all greenlets share the main thread, so each sample of it
+    is the stack of whichever greenlet was running, or of the hub if none
+    was. Greenlets waiting on I/O aren't sampled; docker and STS latency is
+    in the metrics instead.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = 0
+        # Number of samples of each stack, as a tuple of frame keys from the
+        # outermost frame in.
+        self.stacks = collections.Counter()
+        self.done = False
+
+    def sample(self, own_thread_id):
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_key(frame))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self, seconds):
+        sleep = _original('time', 'sleep')
+        own_thread_id = _original('threading', 'get_ident')()
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                self.sample(own_thread_id)
+                sleep(self.interval)
+        finally:
+            self.done = True
+
+    def collapsed(self):
+        """Stacks in the collapsed format of flamegraph.pl and speedscope."""
+        lines = []
+        for stack, count in self.stacks.most_common():
+            lines.append('{0} {1}'.format(';'.join('{0}.{1}'.format(*key) for key in stack), count))
+        return '\n'.join(lines) + '\n'
+
+    def pstats(self):
+        """Stacks as a marshalled stats dict, for pstats.Stats to load.
+
+        Times are estimated as samples times the interval.
+        """
+        functions = {}
+
+        def entry(key):
+            module, name, filename, lineno = key
+            pkey = (filename, lineno, name)
+            if pkey not in functions:
+                functions[pkey] = [0, 0, 0.0, 0.0, collections.Counter()]
+            return functions[pkey]
+
+        for stack, count in self.stacks.items():
+            for key in set(stack):
+                stats = entry(key)
+                stats[0] += count
+                stats[1] += count
+                stats[3] += count * self.interval
+            entry(stack[-1])[2] += count * self.interval
+            for caller, callee in set(zip(stack, stack[1:])):
+                entry(callee)[4][(caller[2], caller[3], caller[1])] += count
+        stats = {}
+        for pkey, (cc, nc, tt, ct, callers) in functions.items():
+            stats[pkey] = (cc, nc, tt, ct, {
+                caller: (n, n, 0.0, n * self.interval) for caller, n in callers.items()
+            })
+        return marshal.dumps(stats)
+
+    def summary(self):
+        """Samples attributed to roles and routes functions.
+
+        Each sample counts towards the innermost roles or routes function on
+        its stack, broken down by the module of the innermost frame, such as
+        json.decoder, re, docker.api.container or botocore.auth.
+        """
+        functions = {}
+        for stack, count in self.stacks.items():
+            for key in reversed(stack):
+                name = '{0}.{1}'.format(*key)
+                if name.startswith(ATTRIBUTED_PREFIXES):
+                    break
+            else:
+                continue
+            function = functions.setdefault(name, {'samples': 0, 'leaf_modules': collections.Counter()})
+            function['samples'] += count
+            function['leaf_modules'][stack[-1][0]] += count
+        return {
+            'samples': self.samples,
+            'interval': self.interval,
+            'functions': {
+                name: {'samples': f['samples'], 'leaf_modules': dict(f['leaf_modules'].most_common())}
+                for name, f in functions.items()
+            }
+        }
+
+
+def profile(seconds, interval):
+    """Sample all threads for `seconds`, and return the SamplingProfile.
+
+    Returns None if a profile is already running in this process.
+    """
+    if not _profile_lock.acquire(False):
+        return None
+    try:
+        result = SamplingProfile(interval)
+        _original('_thread', 'start_new_thread')(result.run, (seconds,))
+        # Cooperative under gevent, so the workload keeps running meanwhile.
+        while not result.done:
+            time.sleep(min(0.1, seconds))
+        return result
+    finally:
+        _profile_lock.release()
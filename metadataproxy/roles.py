@@ -1,30 +1,91 @@
 # Import python libs
+import concurrent.futures
 import datetime
+import hashlib
 import json
 import logging
 import re
 import socket
+import threading
+import time
 import timeit
+from urllib.parse import urlparse
 
 # Import third party libs
-import boto3
 import dateutil.tz
-import docker
-import docker.errors
+import ijson
 import requests
 from botocore.exceptions import ClientError
-from cachetools import cached, TTLCache
+from cachetools import LRUCache
+from cachetools import TTLCache
 
 # Import metadataproxy libs
 from metadataproxy import app
+from metadataproxy import deadline
+from metadataproxy import kubelet
+from metadataproxy import metrics
+from metadataproxy import mockcredentials
+from metadataproxy import procfs
+from metadataproxy import tracing
+from metadataproxy import usage
+from metadataproxy.lazyimport import lazy_import
+from metadataproxy.util import once_per_process
+
+# boto3 and docker account for much of the import time of metadataproxy, so
+# they are imported on first use. See load_client_libraries.
+boto3 = lazy_import('boto3')
+docker = lazy_import('docker')
+dockerclient = lazy_import('metadataproxy.dockerclient')
+# Only imported if CREDENTIAL_CACHE_URL is set, as it needs redis and
+# cryptography.
+credcache = lazy_import('metadataproxy.credcache')
 
 log = logging.getLogger(__name__)
 
 ROLES = {}
+# Time each role in ROLES was assumed at.
+ROLES_UPDATED = {}
+# ARNs of roles looked up with iam:GetRole, keyed by role name, as (lookup
+# time, ARN). Looked up again after an hour, in case the role was recreated
+# under another path.
+ROLE_ARNS = TTLCache(maxsize=1024, ttl=3600)
 CONTAINER_MAPPING = {}
+# Time each IP in CONTAINER_MAPPING was mapped at.
+CONTAINER_MAPPING_UPDATED = {}
+# Result of the mesos state lookup for each IP, as (lookup time, container).
+# The container is None if no running task has the IP.
+MESOS_CONTAINERS = TTLCache(maxsize=512, ttl=60)
+# Inspects of containers found by the /proc resolver, keyed by container id.
+# A container's env and labels don't change while it exists.
+PROC_CONTAINERS = LRUCache(maxsize=1024)
+# Role params of running containers, keyed by the credential key the container
+# was launched with: ('token', <authorization token>) or ('path', <path>).
+CONTAINER_CREDENTIALS = {}
+# Container id that owns each credential key in CONTAINER_CREDENTIALS.
+CONTAINER_CREDENTIAL_OWNERS = {}
+# Credential keys each running container id was launched with, empty for
+# containers without any, and the role params of the ones with keys. Includes
+# keys owned by another container, which are handed over when that container
+# stops.
+CONTAINER_CREDENTIAL_KEYS = {}
+CONTAINER_CREDENTIAL_PARAMS = {}
+# Role refreshes running for requests with a deadline, by assume_key.
+# Requests for a role being refreshed with the same session name, external id
+# and duration wait for that refresh rather than start another.
+REFRESHES = {}
 _docker_client = None
 _iam_client = None
 _sts_client = None
+_credential_cache = None
+_proc_index = None
+_kubelet_index = None
+_scan_executor = None
+_client_libraries_lock = threading.Lock()
+_client_libraries_loaded = False
+# Guards the CONTAINER_CREDENTIAL* registry, updated by the watcher and by
+# requests that miss it.
+_container_credentials_registry_lock = threading.RLock()
+_container_credentials_scanned_at = 0
 
 if app.config['ROLE_MAPPING_FILE']:
     with open(app.config.get('ROLE_MAPPING_FILE'), 'r') as f:
@@ -33,6 +94,9 @@ else:
     ROLE_MAPPINGS = {}
 
 RE_IAM_ARN = re.compile(r"arn:aws:iam::(\d+):role/(.*)")
+# Seconds a proxy has to refresh a role in the credential cache before another
+# proxy may take over.
+REFRESH_LOCK_TTL = 30
 
 
 class BlockTimer(object):
@@ -55,6 +119,7 @@ class PrintingBlockTimer(BlockTimer):
         if self.prefix:
             msg = self.prefix + ': ' + msg
         log.debug(msg)
+        tracing.add_phase(self.prefix, self.exec_duration)
 
 
 def log_exec_time(method):
@@ -65,35 +130,305 @@ def log_exec_time(method):
     return timed
 
 
+def load_client_libraries():
+    """Import the docker and AWS client libraries, if they aren't yet.
+
+    Called before creating a client. A gunicorn master preloading the app
+    calls it before forking, so workers start with the libraries imported and
+    share them.
+    """
+    global _client_libraries_loaded
+    if _client_libraries_loaded:
+        return
+    # Deferred imports aren't safe to trigger from several threads at once.
+    with _client_libraries_lock:
+        with PrintingBlockTimer('Client library import'):
+            # Attribute access runs the deferred import.
+            dockerclient.Client
+            boto3.client
+        _client_libraries_loaded = True
+
+
+def credential_cache():
+    """The cache shared between proxies, or None if it isn't configured."""
+    global _credential_cache
+    if _credential_cache is None and app.config['CREDENTIAL_CACHE_URL']:
+        _credential_cache = credcache.make_credential_cache(
+            app.config['CREDENTIAL_CACHE_URL'],
+            app.config['CREDENTIAL_CACHE_KEY_FILE'],
+            app.config['CREDENTIAL_CACHE_TIMEOUT']
+        )
+    return _credential_cache
+
+
 def docker_client():
     global _docker_client
     if _docker_client is None:
-        _docker_client = docker.Client(base_url=app.config['DOCKER_URL'])
+        load_client_libraries()
+        _docker_client = dockerclient.Client(
+            base_url=app.config['DOCKER_URL'],
+            version=app.config['DOCKER_API_VERSION'],
+            timeout=app.config['DOCKER_TIMEOUT'],
+            pool_size=app.config['DOCKER_POOL_SIZE']
+        )
     return _docker_client
 
 
+def make_iam_client(**kwargs):
+    """Create an IAM client; kwargs are passed to boto3.client."""
+    if app.config['MOCK_CREDENTIALS']:
+        return mockcredentials.MockIAMClient()
+    load_client_libraries()
+    return boto3.client(
+        'iam',
+        endpoint_url=app.config['IAM_ENDPOINT_URL'] or None,
+        **kwargs
+    )
+
+
 def iam_client():
     global _iam_client
     if _iam_client is None:
-        _iam_client = boto3.client('iam')
+        _iam_client = make_iam_client()
     return _iam_client
 
 
+def make_sts_client(**kwargs):
+    """Create an STS client; kwargs are passed to boto3.client."""
+    if app.config['MOCK_CREDENTIALS']:
+        return mockcredentials.MockSTSClient()
+    load_client_libraries()
+    aws_region = app.config.get('AWS_REGION')
+    endpoint_url = app.config.get('STS_ENDPOINT_URL')
+    if not endpoint_url and aws_region:
+        endpoint_url = f'https://sts.{aws_region}.amazonaws.com'
+
+    return boto3.client(
+        service_name='sts',
+        region_name=aws_region or None,
+        endpoint_url=endpoint_url or None,
+        **kwargs
+    )
+
+
 def sts_client():
     global _sts_client
     if _sts_client is None:
-        aws_region = app.config.get('AWS_REGION')
-
-        _sts_client = boto3.client(
-            service_name='sts',
-            region_name=aws_region,
-            endpoint_url=f'https://sts.{aws_region}.amazonaws.com'
-        ) if aws_region else boto3.client(service_name='sts')
+        _sts_client = make_sts_client()
     return _sts_client
 
 
+def proc_index():
+    global _proc_index
+    if _proc_index is None:
+        _proc_index = procfs.ProcNetIndex(app.config['PROC_ROOT'])
+        with PrintingBlockTimer('/proc index build'):
+            _proc_index.refresh()
+        _proc_index.start_refresher(app.config['PROC_RESOLVER_REFRESH_INTERVAL'])
+    return _proc_index
+
+
+def kubelet_index():
+    global _kubelet_index
+    if _kubelet_index is None:
+        _kubelet_index = kubelet.KubeletPodIndex(
+            app.config['KUBELET_PODS_URL'],
+            token_file=app.config['KUBELET_TOKEN_FILE'],
+            ca_file=app.config['KUBELET_CA_FILE'],
+            timeout=app.config['KUBELET_TIMEOUT'],
+            role_annotation=app.config['KUBELET_ROLE_ANNOTATION'],
+            external_id_annotation=app.config['KUBELET_EXTERNAL_ID_ANNOTATION']
+        )
+        with PrintingBlockTimer('Kubelet pod index build'):
+            try:
+                _kubelet_index.refresh()
+            except Exception:
+                log.exception('Unable to build the kubelet pod index')
+        _kubelet_index.start_refresher(app.config['KUBELET_REFRESH_INTERVAL'])
+    return _kubelet_index
+
+
+@log_exec_time
+def find_kubelet_container(ip):
+    """Find the pod for ip in the kubelet pod index, without calling docker.
+
+    The pod is described as a container inspect, with the env of its
+    containers and the role annotations in Env, and its labels and
+    annotations in Labels.
+    """
+    index = kubelet_index()
+    container = index.lookup(ip)
+    if container is None:
+        # Pick up pods started since the last refresh.
+        try:
+            with PrintingBlockTimer('Kubelet pod list'):
+                if index.refresh_if_older(1, timeout=deadline.timeout('kubelet', index.timeout)):
+                    container = index.lookup(ip)
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception:
+            log.exception('Unable to refresh the kubelet pod index')
+    if container is None:
+        metrics.incr('cache.kubelet_pods.miss')
+        return None
+    metrics.incr('cache.kubelet_pods.hit')
+    msg = 'Pod {0} mapped to {1} by kubelet pod IP match'
+    log.debug(msg.format(container['Name'], ip))
+    return container
+
+
+@log_exec_time
+def find_proc_container(ip):
+    """Find the container for ip from /proc, inspecting it once.
+
+    /proc only maps the IP to a container id. The container's env and
+    labels come from docker, inspected once per container and cached by id.
+    They're never read from process memory: any process in the container
+    can rewrite its own environment, and with it the role it would get.
+    """
+    index = proc_index()
+    entry = index.lookup(ip)
+    if entry is not None and not index.is_current(entry[1], entry[0]):
+        # The process exited and its pid was reused.
+        index.forget(entry[1])
+        entry = None
+    if entry is None:
+        # Pick up containers started since the last refresh.
+        if index.refresh_if_older(1):
+            entry = index.lookup(ip)
+    if entry is None:
+        metrics.incr('cache.proc_index.miss')
+        return None
+    metrics.incr('cache.proc_index.hit')
+    container_id = entry[0]
+    container = PROC_CONTAINERS.get(container_id)
+    if container is None:
+        metrics.incr('cache.proc_containers.miss')
+        try:
+            with PrintingBlockTimer('Container inspect'):
+                container = docker_client().inspect_container(container_id)
+        except docker.errors.NotFound:
+            return None
+        PROC_CONTAINERS[container_id] = container
+    else:
+        metrics.incr('cache.proc_containers.hit')
+    msg = 'Container id {0} mapped to {1} by /proc network namespace match'
+    log.debug(msg.format(container_id, ip))
+    return container
+
+
+def scan_executor():
+    global _scan_executor
+    if _scan_executor is None:
+        _scan_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=app.config['DOCKER_SCAN_CONCURRENCY'],
+            thread_name_prefix='docker-scan'
+        )
+    return _scan_executor
+
+
+def match_container(c, ip, _fqdn, pattern):
+    """Check whether container c belongs to the caller at ip.
+
+    Returns a description of how it matched, or None.
+    """
+    # Try matching container to caller by IP address
+    _ip = c['NetworkSettings']['IPAddress']
+    if ip == _ip:
+        return 'IP'
+    # Try matching container to caller by sub network IP address
+    _networks = c['NetworkSettings']['Networks']
+    if _networks:
+        for _network in _networks:
+            if _networks[_network]['IPAddress'] == ip:
+                return 'sub-network IP'
+    # Not Found ? Let's see if we are running under rancher 1.2+,which uses a label to store the IP
+    try:
+        _labels = c.get('Config', {}).get('Labels', {})
+    except (KeyError, ValueError):
+        _labels = {}
+    if _labels and _labels.get('io.rancher.container.ip'):
+        _ip = _labels.get('io.rancher.container.ip').split("/")[0]
+    if ip == _ip:
+        return 'Rancher IP'
+    # Try matching container to caller by hostname match
+    if app.config['ROLE_REVERSE_LOOKUP']:
+        hostname = c['Config']['Hostname']
+        domain = c['Config']['Domainname']
+        fqdn = '{0}.{1}'.format(hostname, domain)
+        # Default pattern matches _fqdn == fqdn
+        _groups = re.match(pattern, _fqdn).groups()
+        groups = re.match(pattern, fqdn).groups()
+        if _groups and groups:
+            if groups[0] == _groups[0]:
+                return 'FQDN'
+    return None
+
+
+def _inspect_and_match(client, _id, ip, _fqdn, pattern):
+    try:
+        with PrintingBlockTimer('Container inspect'):
+            c = client.inspect_container(_id)
+    except docker.errors.NotFound:
+        log.error('Container id {0} not found'.format(_id))
+        return None
+    how = match_container(c, ip, _fqdn, pattern)
+    if how:
+        return c, how
+    return None
+
+
+def scan_containers(client, _ids, ip, _fqdn, pattern):
+    """Inspect containers concurrently until one matches ip.
+
+    At most DOCKER_SCAN_CONCURRENCY inspects run at once. Once a match is
+    found, inspects that haven't started are cancelled; ones in flight are
+    left to finish and their results dropped. Returns (container, how) or
+    None.
+    """
+    executor = scan_executor()
+    inspect_and_match = tracing.bind(_inspect_and_match)
+    futures = [
+        executor.submit(inspect_and_match, client, _id, ip, _fqdn, pattern)
+        for _id in _ids
+    ]
+    match = None
+    with metrics.MetricsTimer('docker.scan.duration'):
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=deadline.remaining()):
+                match = future.result()
+                if match:
+                    break
+        except concurrent.futures.TimeoutError:
+            metrics.incr('deadline.exceeded.docker.scan')
+            raise deadline.DeadlineExceeded('docker.scan')
+        finally:
+            cancelled = sum(1 for f in futures if f.cancel())
+    metrics.incr('docker.scan.hit' if match else 'docker.scan.miss')
+    metrics.observe('docker.scan.fanout', len(futures) - cancelled)
+    return match
+
+
+def forget_container_mapping(ip):
+    CONTAINER_MAPPING.pop(ip, None)
+    CONTAINER_MAPPING_UPDATED.pop(ip, None)
+
+
 @log_exec_time
 def find_container(ip):
+    if app.config['KUBELET_RESOLVER']:
+        container = find_kubelet_container(ip)
+        if container:
+            return container
+    if app.config['PROC_RESOLVER']:
+        container = find_proc_container(ip)
+        if container:
+            return container
+    if app.config['KUBELET_RESOLVER']:
+        # Every pod on the node is in the kubelet's list, so scanning docker
+        # for a caller that isn't a pod would only find nothing, slowly.
+        log.error('No pod found for ip {0}'.format(ip))
+        return None
     pattern = re.compile(app.config['HOSTNAME_MATCH_REGEX'])
     client = docker_client()
     # Try looking at the container mapping cache first
@@ -105,22 +440,24 @@ def find_container(ip):
                 container = client.inspect_container(container_id)
             # Only return a cached container if it is running.
             if container['State']['Running']:
+                metrics.incr('cache.container_mapping.hit')
                 return container
             else:
                 log.error('Container id {0} is no longer running'.format(ip))
-                if ip in CONTAINER_MAPPING:
-                    del CONTAINER_MAPPING[ip]
+                forget_container_mapping(ip)
         except docker.errors.NotFound:
             msg = 'Container id {0} no longer mapped to {1}'
             log.error(msg.format(container_id, ip))
-            if ip in CONTAINER_MAPPING:
-                del CONTAINER_MAPPING[ip]
+            forget_container_mapping(ip)
+    metrics.incr('cache.container_mapping.miss')
+    usage.record('container_misses', ip=ip)
 
     _fqdn = None
     with PrintingBlockTimer('Reverse DNS'):
         if app.config['ROLE_REVERSE_LOOKUP']:
             try:
-                _fqdn = socket.gethostbyaddr(ip)[0]
+                # gethostbyaddr can't be given a timeout of its own.
+                _fqdn = deadline.call('reverse_dns', socket.gethostbyaddr, ip)[0]
             except socket.error as e:
                 log.error('gethostbyaddr failed: {0}'.format(e.args))
                 pass
@@ -128,98 +465,88 @@ def find_container(ip):
     with PrintingBlockTimer('Container fetch'):
         _ids = [c['Id'] for c in client.containers()]
 
-    for _id in _ids:
-        try:
-            with PrintingBlockTimer('Container inspect'):
-                c = client.inspect_container(_id)
-        except docker.errors.NotFound:
-            log.error('Container id {0} not found'.format(_id))
-            continue
-        # Try matching container to caller by IP address
-        _ip = c['NetworkSettings']['IPAddress']
-        if ip == _ip:
-            msg = 'Container id {0} mapped to {1} by IP match'
-            log.debug(msg.format(_id, ip))
-            CONTAINER_MAPPING[ip] = _id
-            return c
-        # Try matching container to caller by sub network IP address
-        _networks = c['NetworkSettings']['Networks']
-        if _networks:
-            for _network in _networks:
-                if _networks[_network]['IPAddress'] == ip:
-                    msg = 'Container id {0} mapped to {1} by sub-network IP match'
-                    log.debug(msg.format(_id, ip))
-                    CONTAINER_MAPPING[ip] = _id
-                    return c
-        # Not Found ? Let's see if we are running under rancher 1.2+,which uses a label to store the IP
-        try:
-            _labels = c.get('Config', {}).get('Labels', {})
-        except (KeyError, ValueError):
-            _labels = {}
-        try:
-            if _labels.get('io.rancher.container.ip'):
-                _ip = _labels.get('io.rancher.container.ip').split("/")[0]
-        except docker.errors.NotFound:
-            log.error('Container: {0} Label container.ip not found'.format(_id))
-        if ip == _ip:
-            msg = 'Container id {0} mapped to {1} by Rancher IP match'
-            log.debug(msg.format(_id, ip))
-            CONTAINER_MAPPING[ip] = _id
-            return c
-        # Try matching container to caller by hostname match
-        if app.config['ROLE_REVERSE_LOOKUP']:
-            hostname = c['Config']['Hostname']
-            domain = c['Config']['Domainname']
-            fqdn = '{0}.{1}'.format(hostname, domain)
-            # Default pattern matches _fqdn == fqdn
-            _groups = re.match(pattern, _fqdn).groups()
-            groups = re.match(pattern, fqdn).groups()
-            if _groups and groups:
-                if groups[0] == _groups[0]:
-                    msg = 'Container id {0} mapped to {1} by FQDN match'
-                    log.debug(msg.format(_id, ip))
-                    CONTAINER_MAPPING[ip] = _id
-                    return c
-        # Try to find the container over the mesos state api and use the labels attached to it
-        # as a replacement for docker env and labels
-        if app.config['MESOS_STATE_LOOKUP']:
-            mesos_container = find_mesos_container(ip)
-            if mesos_container is not None:
-                return mesos_container
+    with PrintingBlockTimer('Container scan'):
+        match = scan_containers(client, _ids, ip, _fqdn, pattern)
+    if match:
+        c, how = match
+        msg = 'Container id {0} mapped to {1} by {2} match'
+        log.debug(msg.format(c['Id'], ip, how))
+        CONTAINER_MAPPING[ip] = c['Id']
+        CONTAINER_MAPPING_UPDATED[ip] = time.time()
+        return c
+
+    # Try to find the container over the mesos state api and use the labels attached to it
+    # as a replacement for docker env and labels
+    if app.config['MESOS_STATE_LOOKUP']:
+        mesos_container = find_mesos_container(ip)
+        if mesos_container is not None:
+            return mesos_container
 
     log.error('No container found for ip {0}'.format(ip))
     return None
 
 
-@cached(cache=TTLCache(maxsize=512, ttl=60))
-@log_exec_time
+# Prefix of running tasks in the mesos agent state document. Tasks under
+# completed_frameworks and completed_executors are skipped by the parser.
+MESOS_TASK_PREFIX = 'frameworks.item.executors.item.tasks.item'
+
+
+def iter_mesos_running_tasks(stream):
+    """Stream a mesos state document, yielding (ips, labels) per running task.
+
+    Only one task is materialized at a time, so memory stays bounded no
+    matter how large the document is. `ips` are the addresses of the task's
+    TASK_RUNNING statuses, and `labels` is None if the task has no labels.
+    """
+    for task in ijson.items(stream, MESOS_TASK_PREFIX, use_float=True):
+        ips = []
+        for status in task['statuses']:
+            if status['state'] == 'TASK_RUNNING':
+                for network in status['container_status']['network_infos']:
+                    for ip_map in network['ip_addresses']:
+                        ips.append(ip_map['ip_address'])
+        if ips:
+            yield ips, task.get('labels')
+
+
 def find_mesos_container(ip):
+    entry = MESOS_CONTAINERS.get(ip)
+    # Entries restored from a snapshot keep their original lookup time.
+    if entry is not None and time.time() - entry[0] < MESOS_CONTAINERS.ttl:
+        metrics.incr('cache.mesos.hit')
+        return entry[1]
+    metrics.incr('cache.mesos.miss')
+    # Results of lookups cut short by the request deadline aren't cached.
+    container = lookup_mesos_container(ip)
+    MESOS_CONTAINERS[ip] = (time.time(), container)
+    return container
+
+
+@log_exec_time
+def lookup_mesos_container(ip):
     mesos_state_url = app.config['MESOS_STATE_URL']
+    timeout = deadline.timeout('mesos', app.config['MESOS_STATE_TIMEOUT'])
     try:
-        state = requests.get(mesos_state_url, timeout=app.config['MESOS_STATE_TIMEOUT']).json()
-        for framework in state['frameworks']:
-            for executor in framework['executors']:
-                for task in executor['tasks']:
-                    for status in task['statuses']:
-                        if status['state'] == 'TASK_RUNNING':
-                            for network in status['container_status']['network_infos']:
-                                for ip_map in network['ip_addresses']:
-                                    if ip_map['ip_address'] == ip:
-                                        if 'labels' in task:
-                                            env = []
-                                            for label in task['labels']:
-                                                key = label['key']
-                                                val = label['value']
-                                                env_var = '{0}={1}'.format(key, val)
-                                                env.append(env_var)
-                                            container = {'Config': {'Env': env, 'Labels': env}}
-                                            return container
+        with requests.get(mesos_state_url, timeout=timeout, stream=True) as resp:
+            resp.raw.decode_content = True
+            for ips, labels in iter_mesos_running_tasks(resp.raw):
+                deadline.check('mesos')
+                if ip in ips and labels is not None:
+                    env = []
+                    for label in labels:
+                        key = label['key']
+                        val = label['value']
+                        env_var = '{0}={1}'.format(key, val)
+                        env.append(env_var)
+                    container = {'Config': {'Env': env, 'Labels': env}}
+                    return container
 
     except requests.exceptions.Timeout:
+        deadline.check('mesos')
         log.error('Timeout when trying to call the mesos http api: {0}'.format(mesos_state_url))
     except requests.exceptions.RequestException:
         log.exception('Error while trying to call the mesos http api: {0}'.format(mesos_state_url))
-    except KeyError:
+    except (KeyError, ijson.JSONError):
         log.exception('Error while trying to lookup the required keys in the json object')
     return None
 
@@ -232,9 +559,113 @@ def split_envvar(envvar):
     return (envvar.split('=', 1) + [None])[:2]
 
 
+def container_value(container, skey):
+    """Read the value of a `Env:` or `Labels:` prefixed key from a container.
+
+    Returns None if the key is unset or the container doesn't have it.
+    """
+    sval = None
+    if skey.startswith('Env:'):
+        skey = skey[4:]
+        for e in container['Config']['Env'] or []:
+            key, val = split_envvar(e)
+            if skey == key:
+                sval = val
+    elif skey.startswith('Labels:'):
+        skey = skey[7:]
+        labels = container['Config']['Labels']
+        # Containers found through mesos have their labels in a list.
+        if isinstance(labels, dict) and skey in labels:
+            sval = labels[skey]
+    return sval
+
+
+def _role_name_from_container(container, params):
+    """Read the role name and role params of a container.
+
+    The external id, session name, session duration and expiration threshold
+    are set on `params`; the role name is returned, in `name@account` form.
+    """
+    role_name = None
+    env = container['Config']['Env'] or []
+    # Look up IAM_ROLE and IAM_EXTERNAL_ID values from environment
+    for e in env:
+        key, val = split_envvar(e)
+        if key == 'IAM_ROLE':
+            m = RE_IAM_ARN.match(val)
+            if m:
+                val = '{0}@{1}'.format(m.group(2), m.group(1))
+            role_name = val
+        elif key == 'IAM_EXTERNAL_ID':
+            params['external_id'] = val
+    if not role_name:
+        msg = "Couldn't find IAM_ROLE variable. Returning DEFAULT_ROLE: {0}"
+        log.debug(msg.format(app.config['DEFAULT_ROLE']))
+        role_name = app.config['DEFAULT_ROLE']
+
+    # Optionally, look up role session name from environment or labels
+    sval = container_value(container, app.config['ROLE_SESSION_KEY'])
+    if sval and len(sval) > 1:
+        # The docs on RoleSessionName are slightly contradictory, and state:
+        # > The regex used to validate this parameter is a string of characters consisting
+        # > of upper- and lower-case alphanumeric characters with no spaces. You can also
+        # > include underscores or any of the following characters: =,.@-
+        # > Type: String
+        # > Length Constraints: Minimum length of 2. Maximum length of 64.
+        # > Pattern: [\w+=,.@-]*
+        # We replace any invalid chars with underscore, and trim to 64.
+        params['session_name'] = re.sub(r'[^\w+=,.@-]', '_', sval)[:64]
+
+    # Optionally, look up the session duration and expiration threshold
+    for param, setting in (('duration', 'ROLE_SESSION_DURATION_KEY'),
+                           ('expiration_threshold', 'ROLE_EXPIRATION_THRESHOLD_KEY')):
+        sval = container_value(container, app.config[setting])
+        if sval:
+            try:
+                params[param] = int(sval)
+            except ValueError:
+                msg = 'Ignoring invalid {0} {1!r} of container {2}'
+                log.error(msg.format(param, sval, container.get('Id')))
+    return role_name
+
+
+def _set_role_name(params, role_name):
+    if role_name:
+        role_parts = role_name.split('@')
+        params['name'] = role_parts[0]
+        if len(role_parts) > 1:
+            params['account_id'] = role_parts[1]
+
+
+def role_key(role_params):
+    """The role of role params, as `name@account` if it has an account."""
+    if role_params['account_id']:
+        return '{0}@{1}'.format(role_params['name'], role_params['account_id'])
+    return role_params['name']
+
+
+def new_role_params():
+    return {
+        'name': None,
+        'account_id': None,
+        'external_id': None,
+        'session_name': None,
+        # Session duration in seconds and expiration threshold in minutes;
+        # None to use the settings.
+        'duration': None,
+        'expiration_threshold': None
+    }
+
+
+def get_role_params_from_container(container):
+    params = new_role_params()
+    _set_role_name(params, _role_name_from_container(container, params))
+    return params
+
+
 @log_exec_time
 def get_role_params_from_ip(ip, requested_role=None):
-    params = {'name': None, 'account_id': None, 'external_id': None, 'session_name': None}
+    params = new_role_params()
     role_name = None
     if app.config['ROLE_MAPPING_FILE']:
         role = ROLE_MAPPINGS.get(ip, app.config['DEFAULT_ROLE'])
@@ -245,51 +676,10 @@ def get_role_params_from_ip(ip, requested_role=None):
     else:
         container = find_container(ip)
         if container:
-            env = container['Config']['Env'] or []
-            # Look up IAM_ROLE and IAM_EXTERNAL_ID values from environment
-            for e in env:
-                key, val = split_envvar(e)
-                if key == 'IAM_ROLE':
-                    m = RE_IAM_ARN.match(val)
-                    if m:
-                        val = '{0}@{1}'.format(m.group(2), m.group(1))
-                    role_name = val
-                elif key == 'IAM_EXTERNAL_ID':
-                    params['external_id'] = val
-            if not role_name:
-                msg = "Couldn't find IAM_ROLE variable. Returning DEFAULT_ROLE: {0}"
-                log.debug(msg.format(app.config['DEFAULT_ROLE']))
-                role_name = app.config['DEFAULT_ROLE']
-
-            # Optionally, look up role session name from environment or labels
-            if app.config['ROLE_SESSION_KEY']:
-                skey = app.config['ROLE_SESSION_KEY']
-                sval = None
-                if skey.startswith('Env:'):
-                    skey = skey[4:]
-                    for e in env:
-                        key, val = split_envvar(e)
-                        if skey == key:
-                            sval = val
-                elif skey.startswith('Labels:'):
-                    skey = skey[7:]
-                    if container['Config']['Labels'] and skey in container['Config']['Labels']:
-                        sval = container['Config']['Labels'][skey]
-                if sval and len(sval) > 1:
-                    # The docs on RoleSessionName are slightly contradictory, and state:
-                    # > The regex used to validate this parameter is a string of characters consisting
-                    # > of upper- and lower-case alphanumeric characters with no spaces. You can also
-                    # > include underscores or any of the following characters: =,.@-
-                    # > Type: String
-                    # > Length Constraints: Minimum length of 2. Maximum length of 64.
-                    # > Pattern: [\w+=,.@-]*
-                    # We replace any invalid chars with underscore, and trim to 64.
-                    params['session_name'] = re.sub(r'[^\w+=,.@-]', '_', sval)[:64]
-    if role_name:
-        role_parts = role_name.split('@')
-        params['name'] = role_parts[0]
-        if len(role_parts) > 1:
-            params['account_id'] = role_parts[1]
+            role_name = _role_name_from_container(container, params)
+    _set_role_name(params, role_name)
+    if params['name']:
+        usage.record('requests', role=role_key(params))
 
     if requested_role and requested_role != params['name']:
         raise UnexpectedRoleError
@@ -297,6 +687,191 @@ def get_role_params_from_ip(ip, requested_role=None):
     return params
 
 
+def get_container_credential_keys(container):
+    """Credential keys a container was launched with.
+
+    The authorization token is read from AWS_CONTAINER_AUTHORIZATION_TOKEN.
+    The path is read from AWS_CONTAINER_CREDENTIALS_FULL_URI or
+    AWS_CONTAINER_CREDENTIALS_RELATIVE_URI, relative to ECS_CREDENTIALS_PATH.
+    """
+    keys = []
+    prefix = app.config['ECS_CREDENTIALS_PATH'].rstrip('/') + '/'
+    for e in container['Config']['Env'] or []:
+        key, val = split_envvar(e)
+        if not val:
+            continue
+        if key == 'AWS_CONTAINER_AUTHORIZATION_TOKEN':
+            keys.append(('token', val))
+        elif key in ('AWS_CONTAINER_CREDENTIALS_FULL_URI', 'AWS_CONTAINER_CREDENTIALS_RELATIVE_URI'):
+            path = urlparse(val).path
+            if path.startswith(prefix) and len(path) > len(prefix):
+                keys.append(('path', path[len(prefix):].rstrip('/')))
+    return keys
+
+
+def register_container_credentials(container):
+    if not container['State']['Running']:
+        return
+    keys = get_container_credential_keys(container)
+    with _container_credentials_registry_lock:
+        unregister_container_credentials(container['Id'])
+        CONTAINER_CREDENTIAL_KEYS[container['Id']] = keys
+        if keys:
+            _register_container_credential_keys(container['Id'], keys, get_role_params_from_container(container))
+
+
+def _register_container_credential_keys(container_id, keys, params):
+    CONTAINER_CREDENTIAL_PARAMS[container_id] = params
+    for key in keys:
+        owner = CONTAINER_CREDENTIAL_OWNERS.get(key)
+        if owner is not None:
+            # Serving either container's credentials for the key would be a
+            # guess, so the key stays with the container that had it first.
+            msg = 'Container id {0} has the same credential {1} as container id {2}; not registering it.'
+            log.error(msg.format(container_id, key[0], owner))
+            metrics.incr('container_credentials.duplicate_key')
+            continue
+        CONTAINER_CREDENTIALS[key] = params
+        CONTAINER_CREDENTIAL_OWNERS[key] = container_id
+    msg = 'Registered {0} credential keys for container id {1}'
+    log.debug(msg.format(len(keys), container_id))
+
+
+def unregister_container_credentials(container_id):
+    with _container_credentials_registry_lock:
+        CONTAINER_CREDENTIAL_PARAMS.pop(container_id, None)
+        for key in CONTAINER_CREDENTIAL_KEYS.pop(container_id, []):
+            if CONTAINER_CREDENTIAL_OWNERS.get(key) != container_id:
+                continue
+            del CONTAINER_CREDENTIAL_OWNERS[key]
+            del CONTAINER_CREDENTIALS[key]
+            # Hand the key to another running container launched with it.
+            for _id, keys in CONTAINER_CREDENTIAL_KEYS.items():
+                if key in keys:
+                    CONTAINER_CREDENTIALS[key] = CONTAINER_CREDENTIAL_PARAMS[_id]
+                    CONTAINER_CREDENTIAL_OWNERS[key] = _id
+                    break
+
+
+def register_new_container_credentials():
+    """Inspect running containers that haven't been registered yet.
+
+    For credentials requests that arrive before the watcher has registered
+    their container, such as while it syncs or before it gets the container's
+    start event. Runs at most once a second. Inspects run on the scan
+    executor, and are waited for no longer than the request's deadline.
+    """
+    global _container_credentials_scanned_at
+    if time.time() - _container_credentials_scanned_at < 1:
+        return
+    _container_credentials_scanned_at = time.time()
+    client = docker_client()
+    with PrintingBlockTimer('Container fetch'):
+        _ids = [c['Id'] for c in client.containers() if c['Id'] not in CONTAINER_CREDENTIAL_KEYS]
+    inspect = tracing.bind(client.inspect_container)
+    futures = [scan_executor().submit(inspect, _id) for _id in _ids]
+    try:
+        for future in concurrent.futures.as_completed(futures, timeout=deadline.remaining()):
+            try:
+                register_container_credentials(future.result())
+            except docker.errors.NotFound:
+                pass
+    except concurrent.futures.TimeoutError:
+        for future in futures:
+            future.cancel()
+        metrics.incr('deadline.exceeded.container_credentials')
+        raise deadline.DeadlineExceeded('container_credentials')
+
+
+@log_exec_time
+def sync_container_credentials():
+    """Register all running containers and drop the ones that are gone."""
+    client = docker_client()
+    _ids = [c['Id'] for c in client.containers()]
+    for _id in set(CONTAINER_CREDENTIAL_KEYS) - set(_ids):
+        unregister_container_credentials(_id)
+    for _id in _ids:
+        try:
+            register_container_credentials(client.inspect_container(_id))
+        except docker.errors.NotFound:
+            unregister_container_credentials(_id)
+
+
+def watch_container_credentials(since=None):
+    """Keep CONTAINER_CREDENTIALS up to date from the docker events stream.
+
+    Follows events from since, if the containers were synced at that time;
+    otherwise syncs first. Runs forever; on any error it waits, resyncs all
+    containers and resubscribes.
+    """
+    client = docker_client()
+    while True:
+        try:
+            if since is None:
+                since = int(time.time())
+                sync_container_credentials()
+            events = client.events(since=since, filters={'type': 'container'}, decode=True)
+            for event in events:
+                status = event.get('status') or event.get('Action')
+                _id = event.get('id') or event.get('Actor', {}).get('ID')
+                if not _id:
+                    continue
+                if status == 'start':
+                    try:
+                        register_container_credentials(client.inspect_container(_id))
+                    except docker.errors.NotFound:
+                        unregister_container_credentials(_id)
+                elif status in ('die', 'destroy'):
+                    unregister_container_credentials(_id)
+        except Exception:
+            log.exception('Error while watching docker events for container credentials')
+        since = None
+        time.sleep(app.config['ECS_CREDENTIALS_RESYNC_DELAY'])
+
+
+@once_per_process
+def start_container_credentials_watcher():
+    """Start syncing running containers and following docker events.
+
+    Runs on the first container credentials request. The watcher syncs
+    before following events; requests that arrive before it has registered
+    their container inspect it themselves.
+    """
+    thread = threading.Thread(
+        target=watch_container_credentials,
+        args=(None,),
+        name='container-credentials-watcher',
+        daemon=True
+    )
+    thread.start()
+
+
+def get_container_credentials_params(token=None, path=None):
+    """Look up the role params registered for a container credential key."""
+    start_container_credentials_watcher()
+    if token:
+        key = ('token', token)
+    elif path:
+        key = ('path', path.rstrip('/'))
+    else:
+        return None
+    params = CONTAINER_CREDENTIALS.get(key)
+    if params is None:
+        metrics.incr('cache.container_credentials.miss')
+        try:
+            register_new_container_credentials()
+        except deadline.DeadlineExceeded:
+            raise
+        except Exception:
+            log.exception('Error while registering new containers for container credentials')
+        params = CONTAINER_CREDENTIALS.get(key)
+    else:
+        metrics.incr('cache.container_credentials.hit')
+    if params and params['name']:
+        usage.record('requests', role=role_key(params))
+    return params
+
+
 @log_exec_time
 def get_role_info_from_params(role_params):
     if not role_params['name']:
@@ -306,16 +881,25 @@ def get_role_info_from_params(role_params):
     except GetRoleError:
         return {}
     time_format = "%Y-%m-%dT%H:%M:%SZ"
-    expiration = role['Credentials']['Expiration']
-    updated = expiration - datetime.timedelta(minutes=60)
     return {
         'Code': 'Success',
-        'LastUpdated': updated.strftime(time_format),
+        'LastUpdated': role['LastUpdated'].strftime(time_format),
         'InstanceProfileArn': role['AssumedRoleUser']['Arn'],
         'InstanceProfileId': role['AssumedRoleUser']['AssumedRoleId']
     }
 
 
+def _lookup_role_arn(role_name):
+    iam = iam_client()
+    if '/' in role_name:
+        path, name = role_name.rsplit('/', 1)
+        role = iam.get_role(Path=path + '/', RoleName=name)
+    else:
+        role = iam.get_role(RoleName=role_name)
+    ROLE_ARNS[role_name] = (time.time(), role['Role']['Arn'])
+    return role['Role']['Arn']
+
+
 def get_role_arn(role_params):
     if role_params['account_id']:
         # Try to map the name to an account ID. If it isn't found, assume an ID was passed
@@ -331,54 +915,284 @@ def get_role_arn(role_params):
         # name. This is a backwards compat use-case for when we didn't require
         # the default account id.
         else:
-            iam = iam_client()
+            entry = ROLE_ARNS.get(role_params['name'])
+            # Entries restored from a snapshot keep their original lookup time.
+            if entry is not None and time.time() - entry[0] < ROLE_ARNS.ttl:
+                metrics.incr('cache.role_arns.hit')
+                return entry[1]
+            metrics.incr('cache.role_arns.miss')
             try:
                 with PrintingBlockTimer('iam.get_role'):
-                    if '/' in role_params['name']:
-                        path, name = role_params['name'].rsplit('/', 1)
-                        role = iam.get_role(Path=path + '/', RoleName=name)
-                    else:
-                        role = iam.get_role(RoleName=role_params['name'])
-                    return role['Role']['Arn']
+                    return deadline.call('iam.get_role', _lookup_role_arn, role_params['name'])
             except ClientError as e:
                 response = e.response['ResponseMetadata']
-                raise GetRoleError((response['HTTPStatusCode'], e.message))
+                raise GetRoleError((response['HTTPStatusCode'], str(e)))
     # Return a generated ARN
     return 'arn:aws:iam::{account_id}:role/{name}'.format(**role_params)
 
 
+def get_session_duration(role_params, arn):
+    """Session duration in seconds for a role, or None for the STS default.
+
+    A duration from the container or role mapping file takes precedence over
+    ROLE_SESSION_DURATIONS, which takes precedence over ROLE_SESSION_DURATION.
+    """
+    if role_params['duration']:
+        return role_params['duration']
+    durations = app.config['ROLE_SESSION_DURATIONS']
+    duration = durations.get(arn) or durations.get(role_params['name'])
+    return duration or app.config['ROLE_SESSION_DURATION'] or None
+
+
+def _client_expiration_threshold(role_params, duration):
+    """The expiration threshold, before CLIENT_REFRESH_SPREAD is added."""
+    threshold = datetime.timedelta(
+        minutes=role_params['expiration_threshold'] or app.config['ROLE_EXPIRATION_THRESHOLD']
+    )
+    return min(threshold, datetime.timedelta(seconds=(duration or 3600) / 2))
+
+
+def get_expiration_threshold(role_params, duration):
+    """Time before expiration at which a role's credentials are refreshed.
+
+    Capped at half the session duration, so a threshold longer than a short
+    session doesn't make every request assume the role again. With
+    CLIENT_REFRESH_SPREAD, credentials are refreshed that much earlier, ahead
+    of the clients; see get_client_expiration.
+    """
+    threshold = _client_expiration_threshold(role_params, duration)
+    spread = datetime.timedelta(seconds=app.config['CLIENT_REFRESH_SPREAD'])
+    return min(threshold + spread, datetime.timedelta(seconds=(duration or 3600) / 2))
+
+
+def get_client_offset(role_params, assumed_role, client):
+    """How much earlier to report credentials to a client, by CLIENT_REFRESH_SPREAD.
+
+    SDKs refresh credentials a few minutes before they expire. Reported as
+    is, the expiration brings every client of a role back at the moment the
+    proxy's copy is due for refresh, so they all miss the cache at once.
+    Instead each client is told its credentials expire earlier by an offset
+    within the spread, fixed per client by a hash of `client`. Clients that
+    refresh up to ROLE_EXPIRATION_THRESHOLD minutes before expiry come back
+    spread over the spread, and after the proxy has refreshed the role.
+    LastUpdated is moved by the same offset, so clients that work out the
+    lifetime of credentials from both get the real one.
+    """
+    expiration = assumed_role['Credentials']['Expiration']
+    if not app.config['CLIENT_REFRESH_SPREAD'] or not client:
+        return datetime.timedelta(0)
+    duration = (expiration - assumed_role['LastUpdated']).total_seconds()
+    threshold = _client_expiration_threshold(role_params, duration)
+    spread = get_expiration_threshold(role_params, duration) - threshold
+    digest = hashlib.sha1(client.encode('utf-8')).digest()
+    offset = spread * (int.from_bytes(digest[:8], 'big') / 2 ** 64)
+    # Credentials served past their refresh point, while the refresh is in
+    # flight, aren't shortened into the client's own refresh window; that
+    # would only bring the client straight back.
+    if expiration - offset - datetime.datetime.now(dateutil.tz.tzutc()) <= threshold:
+        return datetime.timedelta(0)
+    return offset
+
+
+def _assume_role(arn, role_params, duration):
+    sts = sts_client()
+    session_name = role_params['session_name'] or 'devproxyauth'
+    kwargs = {'RoleArn': arn, 'RoleSessionName': session_name}
+    if role_params['external_id']:
+        kwargs['ExternalId'] = role_params['external_id']
+    if duration:
+        kwargs['DurationSeconds'] = duration
+    try:
+        return sts.assume_role(**kwargs)
+    except ClientError as e:
+        if not duration or e.response['Error']['Code'] != 'ValidationError':
+            raise
+        # Most likely longer than the role's maximum session duration. Fall
+        # back to the default, rather than not serving credentials at all.
+        msg = 'Unable to assume role {0} for {1}s, assuming it for the default duration: {2}'
+        log.error(msg.format(arn, duration, e))
+        del kwargs['DurationSeconds']
+        return sts.assume_role(**kwargs)
+
+
+def assume_key(arn, role_params, duration):
+    """What a role is assumed with: its ARN, session name, external id and duration."""
+    return (arn, role_params['session_name'] or 'devproxyauth', role_params['external_id'], duration)
+
+
+def _servable(assumed_role, key):
+    """Whether assumed_role is still valid, and was assumed with key."""
+    return (
+        assumed_role is not None and assumed_role.get('AssumeKey') == key and
+        _expires_in(assumed_role).total_seconds() > 0
+    )
+
+
+def _expires_in(assumed_role):
+    now = datetime.datetime.now(dateutil.tz.tzutc())
+    return assumed_role['Credentials']['Expiration'] - now
+
+
+def _call_credential_cache(operation, fn, *args):
+    """Call the credential cache, within the request's deadline.
+
+    CREDENTIAL_CACHE_TIMEOUT can be longer than the request's deadline, so
+    with a deadline the call is waited for no longer than half the time
+    left, and then treated as failed, leaving the rest for assuming the role.
+    """
+    left = deadline.remaining()
+    if left is None:
+        return fn(*args)
+    deadline.check('credential_cache.{0}'.format(operation))
+    future = deadline.executor().submit(tracing.bind(fn), *args)
+    try:
+        return future.result(timeout=left / 2)
+    except concurrent.futures.TimeoutError:
+        metrics.incr('cache.shared_credentials.deadline')
+        raise credcache.CredentialCacheError(
+            'No {0} response within half the time left to the request deadline'.format(operation)
+        )
+
+
+def get_shared_assumed_role(key, threshold, current):
+    """Look up a role in the credential cache shared between proxies.
+
+    key is the role's assume_key(). Returns the shared credentials if they're fresh. If not, and another
+    proxy is already assuming the role, returns `current` while it has at
+    least half the threshold left, so proxies that share credentials don't
+    all refresh them at once. Otherwise returns None, and the caller should
+    assume the role and share it.
+    """
+    try:
+        cache = credential_cache()
+        cache_key = cache.key(*key)
+        with PrintingBlockTimer('credential_cache.get'):
+            shared = _call_credential_cache('get', cache.get, cache_key)
+        if shared is not None and _expires_in(shared) > threshold:
+            metrics.incr('cache.shared_credentials.hit')
+            return shared
+        metrics.incr('cache.shared_credentials.miss')
+        if current is not None and _expires_in(current) > threshold / 2:
+            if not _call_credential_cache('lock', cache.lock, cache_key, REFRESH_LOCK_TTL):
+                metrics.incr('cache.shared_credentials.deferred')
+                return current
+    except deadline.DeadlineExceeded:
+        raise
+    except Exception:
+        log.exception('Unable to look up {0} in the credential cache'.format(key[0]))
+        metrics.incr('cache.shared_credentials.error')
+    return None
+
+
+def share_assumed_role(key, assumed_role):
+    try:
+        cache = credential_cache()
+        with PrintingBlockTimer('credential_cache.set'):
+            cache.set(cache.key(*key), assumed_role, _expires_in(assumed_role).total_seconds())
+    except Exception:
+        log.exception('Unable to store {0} in the credential cache'.format(key[0]))
+        metrics.incr('cache.shared_credentials.error')
+
+
 @log_exec_time
 def get_assumed_role(role_params):
     arn = get_role_arn(role_params)
-    if arn in ROLES:
-        assumed_role = ROLES[arn]
-        expiration = assumed_role['Credentials']['Expiration']
-        now = datetime.datetime.now(dateutil.tz.tzutc())
-        expire_check = now + datetime.timedelta(minutes=app.config['ROLE_EXPIRATION_THRESHOLD'])
-        if expire_check < expiration:
-            return assumed_role
-    with PrintingBlockTimer('sts.assume_role'):
-        sts = sts_client()
-        session_name = role_params['session_name'] or 'devproxyauth'
-        kwargs = {'RoleArn': arn, 'RoleSessionName': session_name}
-        if role_params['external_id']:
-            kwargs['ExternalId'] = role_params['external_id']
-        assumed_role = sts.assume_role(**kwargs)
+    duration = get_session_duration(role_params, arn)
+    threshold = get_expiration_threshold(role_params, duration)
+    current = ROLES.get(arn)
+    if current is not None and _expires_in(current) > threshold:
+        metrics.incr('cache.roles.hit')
+        return current
+    metrics.incr('cache.roles.miss')
+    usage.record('role_misses', ip=usage.caller(), role=role_key(role_params))
+    key = assume_key(arn, role_params, duration)
+    # Credentials due for refresh are only served, while the refresh runs,
+    # to requests asking for the same session name, external id and duration.
+    if current is not None and current.get('AssumeKey') != key:
+        current = None
+    try:
+        if app.config['CREDENTIAL_CACHE_URL']:
+            assumed_role = get_shared_assumed_role(key, threshold, current)
+            if assumed_role is current and current is not None:
+                return current
+            if assumed_role is not None:
+                assumed_role['AssumeKey'] = key
+                ROLES[arn] = assumed_role
+                ROLES_UPDATED[arn] = time.time()
+                return assumed_role
+        with PrintingBlockTimer('sts.assume_role'):
+            if deadline.remaining() is None:
+                usage.record('sts_calls', ip=usage.caller(), role=role_key(role_params))
+                return _refresh_assumed_role(arn, role_params, duration)
+            deadline.check('sts.assume_role')
+            if key in REFRESHES and _servable(current, key):
+                # Another request is waiting for the refresh already.
+                metrics.incr('deadline.served_current')
+                return current
+            return deadline.wait('sts.assume_role', _start_refresh(key, arn, role_params, duration))
+    except deadline.DeadlineExceeded:
+        # The refresh carries on in the background. Until it's done, serve
+        # the credentials being refreshed while they're still valid.
+        if _servable(current, key):
+            metrics.incr('deadline.served_current')
+            return current
+        raise
+
+
+def _start_refresh(key, arn, role_params, duration):
+    future = REFRESHES.get(key)
+    if future is None:
+        usage.record('sts_calls', ip=usage.caller(), role=role_key(role_params))
+        future = deadline.executor().submit(tracing.bind(_refresh_assumed_role), arn, role_params, duration)
+        REFRESHES[key] = future
+        future.add_done_callback(lambda f: REFRESHES.pop(key, None))
+    else:
+        metrics.incr('deadline.joined_refresh')
+    return future
+
+
+def _refresh_assumed_role(arn, role_params, duration):
+    assumed_role = _assume_role(arn, role_params, duration)
+    # Served as LastUpdated. With the session duration varying by role,
+    # it can't be worked out from the expiration.
+    assumed_role['LastUpdated'] = datetime.datetime.now(dateutil.tz.tzutc())
+    assumed_role['AssumeKey'] = assume_key(arn, role_params, duration)
     ROLES[arn] = assumed_role
+    ROLES_UPDATED[arn] = time.time()
+    if app.config['CREDENTIAL_CACHE_URL']:
+        if app.config['REQUEST_DEADLINE']:
+            # Requests waiting for the refresh needn't wait for the cache too.
+            deadline.executor().submit(share_assumed_role, assumed_role['AssumeKey'], assumed_role)
+        else:
+            share_assumed_role(assumed_role['AssumeKey'], assumed_role)
     return assumed_role
 
 
 @log_exec_time
-def get_assumed_role_credentials(role_params, api_version='latest'):
+def get_assumed_role_credentials(role_params, api_version='latest', client=None):
     assumed_role = get_assumed_role(role_params)
     time_format = "%Y-%m-%dT%H:%M:%SZ"
     credentials = assumed_role['Credentials']
-    expiration = credentials['Expiration']
-    updated = expiration - datetime.timedelta(minutes=60)
+    offset = get_client_offset(role_params, assumed_role, client)
     return {
         'Code': 'Success',
-        'LastUpdated': updated.strftime(time_format),
+        'LastUpdated': (assumed_role['LastUpdated'] - offset).strftime(time_format),
         'Type': 'AWS-HMAC',
+        'AccessKeyId': credentials['AccessKeyId'],
+        'SecretAccessKey': credentials['SecretAccessKey'],
+        'Token': credentials['SessionToken'],
+        'Expiration': (credentials['Expiration'] - offset).strftime(time_format)
+    }
+
+
+@log_exec_time
+def get_assumed_role_container_credentials(role_params, client=None):
+    """Credentials in the format of the ECS container credentials endpoint."""
+    assumed_role = get_assumed_role(role_params)
+    time_format = "%Y-%m-%dT%H:%M:%SZ"
+    credentials = assumed_role['Credentials']
+    expiration = credentials['Expiration'] - get_client_offset(role_params, assumed_role, client)
+    return {
         'AccessKeyId': credentials['AccessKeyId'],
         'SecretAccessKey': credentials['SecretAccessKey'],
         'Token': credentials['SessionToken'],
@@ -0,0 +1,31 @@
+import logging
+
+from flask import request
+from flask import jsonify
+
+from metadataproxy import app
+from metadataproxy import roles
+
+log = logging.getLogger(__name__)
+
+ECS_CREDENTIALS_PATH = app.config['ECS_CREDENTIALS_PATH'].rstrip('/')
+
+
+@app.route(ECS_CREDENTIALS_PATH, strict_slashes=False)
+@app.route(ECS_CREDENTIALS_PATH + '/<path:key>')
+def container_credentials(key=None):
+    token = request.headers.get('Authorization')
+    if not token and not key:
+        log.error('No authorization token or credentials path; returning 401.')
+        return '', 401
+    role_params = roles.get_container_credentials_params(token=token, path=key)
+    if not role_params or not role_params['name']:
+        log.error('No container registered for credentials request; returning 404.')
+        return '', 404
+
+    log.debug('Providing container credentials for {0}'.format(role_params['name']))
+    try:
+        credentials = roles.get_assumed_role_container_credentials(role_params, client=token or key)
+    except roles.GetRoleError as e:
+        return '', e.args[0][0]
+    return jsonify(credentials)
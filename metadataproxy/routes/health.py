@@ -0,0 +1,23 @@
+from flask import jsonify
+
+from metadataproxy import app
+from metadataproxy import health
+
+
+@app.route('/healthz')
+def healthz():
+    health.start_prober()
+    return jsonify({'status': 'ok', 'probes': health.probe_results()})
+
+
+@app.route('/readyz')
+def readyz():
+    health.start_prober()
+    ready, reasons = health.readiness()
+    body = {
+        'ready': ready,
+        'reasons': reasons,
+        'probes': health.probe_results(),
+        'caches': health.cache_warmth()
+    }
+    return jsonify(body), 200 if ready else 503
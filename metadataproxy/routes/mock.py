@@ -1,10 +1,16 @@
 import datetime
-import dateutil
+import dateutil.tz
+import json
 import logging
+import os
+import re
+import string
 
+import yaml
+from flask import Response
+from flask import abort
 from flask import request
 from flask import redirect
-from flask import url_for
 from flask import jsonify
 
 from metadataproxy import app
@@ -12,105 +18,93 @@ from metadataproxy import roles
 
 log = logging.getLogger(__name__)
 
-
-@app.route(
-    '/<api_version>'
+DEFAULT_MOCK_METADATA_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)),
+    'mock_metadata.yaml'
 )
-def root_noslash(api_version):
-    return redirect(
-        url_for('root_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route(
-    '/<api_version>/'
-)
-def root_slash(api_version):
-    return 'meta-data', 200
-
-
-@app.route(
-    '/<api_version>/meta-data'
-)
-def get_meta_data_noslash(api_version):
-    return redirect(
-        url_for('get_meta_data_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route('/<api_version>/meta-data/')
-def get_meta_data_slash(api_version):
-    meta_data_list = [
-        'ami-id', 'ami-launch-index', 'ami-manifest-path',
-        'block-device-mapping/', 'hostname', 'iam/', 'instance-action',
-        'instance-id', 'instance-type', 'local-hostname', 'local-ipv4',
-        'mac', 'metrics/', 'network/', 'placement/', 'profile',
-        'public-hostname', 'public-ipv4', 'public-keys/', 'reservation-id',
-        'security-groups', 'services/'
-    ]
-    return '\n'.join(meta_data_list), 200
-
-
-@app.route('/<api_version>/meta-data/ami-id')
-def get_ami_id(api_version):
-    return 'ami-mockedami', 200
-
-
-@app.route('/<api_version>/meta-data/ami-launch-index')
-def get_ami_launch_index(api_version):
-    return '0', 200
-
-
-@app.route('/<api_version>/meta-data/ami-manifest-path')
-def get_ami_manifest_path(api_version):
-    return '(unknown)', 200
-
-
-@app.route('/<api_version>/meta-data/block-device-mapping')
-def get_block_device_mapping_noslash(api_version):
-    return redirect(
-        url_for('get_block_device_mapping_slash', api_version=api_version),
-        code=301
-    )
 
-
-@app.route('/<api_version>/meta-data/block-device-mapping/')
-def get_block_device_mapping_slash(api_version):
-    return 'ami\nroot', 200
-
-
-@app.route('/<api_version>/meta-data/block-device-mapping/ami')
-def get_block_device_mapping_ami(api_version):
-    return '/dev/sda1', 200
-
-
-@app.route('/<api_version>/meta-data/block-device-mapping/root')
-def get_block_device_mapping_root(api_version):
-    return '/dev/sda1', 200
-
-
-@app.route('/<api_version>/meta-data/hostname')
-def get_hostname(api_version):
-    return 'mocked.internal', 200
-
-
-@app.route('/<api_version>/meta-data/iam')
-def get_iam_noslash(api_version):
-    return redirect(
-        url_for('get_iam_slash', api_version=api_version),
-        301
-    )
-
-
-@app.route('/<api_version>/meta-data/iam/')
-def get_iam_slash(api_version):
-    return 'info\nsecurity-credentials/', 200
+# Table entry for a directory path without its trailing slash.
+REDIRECT = object()
+# Key of a directory's listing, where it isn't generated from its entries.
+LISTING_KEY = '_listing'
+
+
+class JsonLeaf(object):
+    """A leaf of the mock tree that is served as a JSON document."""
+    def __init__(self, value):
+        self.value = value
+
+
+class MockMetadataLoader(yaml.SafeLoader):
+    pass
+
+
+def _construct_json_leaf(loader, node):
+    return JsonLeaf(loader.construct_mapping(node, deep=True))
+
+
+MockMetadataLoader.add_constructor('!json', _construct_json_leaf)
+
+
+def _substitute(value, context):
+    if isinstance(value, str):
+        return string.Template(value).safe_substitute(context)
+    if isinstance(value, dict):
+        return {k: _substitute(v, context) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_substitute(v, context) for v in value]
+    return value
+
+
+def compile_mock_tree(tree, context, prefix='', table=None):
+    """Flatten a mock metadata tree into a path -> response table.
+
+    Paths are relative to the api version, so `/latest/meta-data/ami-id` is
+    looked up as `/meta-data/ami-id`. Every directory gets a listing at
+    `dir/` and a redirect at `dir`. Static entries are (body, mimetype)
+    tuples; redirects are the REDIRECT sentinel. JSON leaves are serialized
+    as jsonify would.
+    """
+    if table is None:
+        table = {}
+    listing = []
+    for key, value in tree.items():
+        key = str(key)
+        if key == LISTING_KEY:
+            continue
+        path = '{0}/{1}'.format(prefix, key)
+        if isinstance(value, dict):
+            listing.append(key + '/')
+            table[path] = REDIRECT
+            compile_mock_tree(value, context, path, table)
+        else:
+            listing.append(key)
+            if value is None:
+                continue
+            if isinstance(value, JsonLeaf):
+                body = json.dumps(_substitute(value.value, context), sort_keys=True, separators=(',', ':'))
+                table[path] = (body + '\n', 'application/json')
+            else:
+                table[path] = (_substitute(str(value), context), 'text/html')
+    table[prefix + '/'] = (str(tree.get(LISTING_KEY, '\n'.join(listing))), 'text/html')
+    return table
+
+
+def load_mock_table(path):
+    with open(path, 'r') as f:
+        tree = yaml.load(f, Loader=MockMetadataLoader)
+    time_format = "%Y-%m-%dT%H:%M:%SZ"
+    now = datetime.datetime.now(dateutil.tz.tzutc())
+    context = {k: v for k, v in app.config.items() if isinstance(v, str)}
+    context['PENDING_TIME'] = now.strftime(time_format)
+    table = compile_mock_tree(tree, context)
+    # The root has no noslash redirect of its own in the tree.
+    table[''] = REDIRECT
+    table.update(_DYNAMIC_ROUTES)
+    log.debug('Loaded {0} mock metadata paths from {1}'.format(len(table), path))
+    return table
 
 
-@app.route('/<api_version>/meta-data/iam/info', strict_slashes=False)
-@app.route('/<api_version>/meta-data/iam/info/<path:junk>')
 def get_iam_info(api_version, junk=None):
     role_params_from_ip = roles.get_role_params_from_ip(request.remote_addr)
     if role_params_from_ip['name']:
@@ -121,32 +115,15 @@ def get_iam_info(api_version, junk=None):
         return '', 404
 
 
-@app.route('/<api_version>/meta-data/iam/security-credentials')
-def get_security_credentials_noslash(api_version):
-    return redirect(
-        url_for('get_security_credentials_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route('/<api_version>/meta-data/iam/security-credentials/')
-def get_security_credentials_slash(api_version):
+def get_security_credentials_slash(api_version, junk=None):
     role_params = roles.get_role_params_from_ip(request.remote_addr)
     if not role_params['name']:
         return '', 404
     return role_params['name'], 200
 
 
-@app.route(
-    '/<api_version>/meta-data/iam/security-credentials/<requested_role>',
-    methods=['GET'],
-    strict_slashes=False
-)
-@app.route(
-    '/<api_version>/meta-data/iam/security-credentials/<requested_role>/<path:junk>',
-    methods=['GET']
-)
-def get_role_credentials(api_version, requested_role, junk=None):
+def get_role_credentials(api_version, junk):
+    requested_role = junk.split('/', 1)[0]
     try:
         role_params = roles.get_role_params_from_ip(
             request.remote_addr,
@@ -158,353 +135,54 @@ def get_role_credentials(api_version, requested_role, junk=None):
     try:
         assumed_role = roles.get_assumed_role_credentials(
             role_params=role_params,
-            api_version=api_version
+            api_version=api_version,
+            client=request.remote_addr
         )
     except roles.GetRoleError as e:
         return '', e.args[0][0]
     return jsonify(assumed_role)
 
 
-@app.route('/<api_version>/meta-data/instance-action')
-def get_instance_action(api_version):
-    return 'none', 200
-
-
-@app.route('/<api_version>/meta-data/instance-id')
-def get_instance_id(api_version):
-    return 'i-{0}'.format(app.config['MOCKED_INSTANCE_ID']), 200
-
-
-@app.route('/<api_version>/meta-data/instance-type')
-def get_instance_type(api_version):
-    return 't2.medium', 200
-
-
-@app.route('/<api_version>/meta-data/mac')
-def get_mac(api_version):
-    return 'AE-30-76-CE-38-62', 200
-
-
-@app.route('/<api_version>/meta-data/metrics')
-def get_metrics_noslash(api_version):
-    return redirect(
-        url_for('get_metrics_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route('/<api_version>/meta-data/metrics/')
-def get_metrics_slash(api_version):
-    return 'vhostmd', 200
-
-
-@app.route('/<api_version>/meta-data/metrics/vhostmd')
-def get_metrics_vhostmd(api_version):
-    return '<?xml version="1.0" encoding="UTF-8"?>', 200
-
-
-@app.route('/<api_version>/meta-data/network')
-def get_network_noslash(api_version):
-    return redirect(
-        url_for('get_network_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route('/<api_version>/meta-data/network/')
-def get_network_slash(api_version):
-    return 'interfaces/', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces')
-def get_network_interfaces_noslash(api_version):
-    return redirect(
-        url_for('get_network_interfaces_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/')
-def get_network_interfaces_slash(api_version):
-    return 'macs/', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs')
-def get_network_interfaces_macs_noslash(api_version):
-    return redirect(
-        url_for('get_network_interfaces_macs_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/')
-def get_network_interfaces_macs_slash(api_version):
-    return 'AE:30:76:CE:38:62/', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62')
-def get_network_interfaces_macaddr_noslash(api_version):
-    return redirect(
-        url_for(
-            'get_network_interfaces_macaddr_slash',
-            api_version=api_version
-        ),
-        code=301
-    )
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/')
-def get_network_interfaces_macaddr_slash(api_version):
-    info = [
-        'device-number', 'interface-id', 'ipv4-associations/',
-        'local-hostname', 'local-ipv4s', 'mac', 'owner-id', 'public-hostname',
-        'public-ipv4s', 'security-group-ids', 'security-groups', 'subnet-id',
-        'subnet-ipv4-cidr-block', 'vpc-id', 'vpc-ipv4-cidr-block'
-    ]
-    return '\n'.join(info), 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/device-number')
-def get_macaddr_device_number(api_version):
-    return '0', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/interface-id')
-def get_macaddr_interface_id(api_version):
-    return 'eni-1234', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/ipv4-associations')
-def get_macaddr_ipv4_associations_noslash(api_version):
-    return redirect(
-        url_for(
-            'get_macaddr_ipv4_associations_slash',
-            api_version=api_version
-        ),
-        code=301
-    )
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/ipv4-associations/')
-def get_macaddr_ipv4_associations_slash(api_version):
-    return '127.255.0.1', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/local-hostname')
-def get_macaddr_local_hostname(api_version):
-    return 'mocked.internal', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/local-ipv4s')
-def get_macaddr_local_ipv4s(api_version):
-    return 'mocked.internal', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/mac')
-def get_macaddr_mac(api_version):
-    return 'AE:30:76:CE:38:62', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/owner-id')
-def get_macaddr_owner_id(api_version):
-    return '12345', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/public-hostname')
-def get_macaddr_public_hostname(api_version):
-    return 'mocked.internal', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/public-ipv4s')
-def get_macaddr_public_ipv4s(api_version):
-    return '127.255.0.1', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/security-group-ids')
-def get_macaddr_security_group_ids(api_version):
-    return 'sg-1234', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/security-groups')
-def get_macaddr_security_groups(api_version):
-    return 'default', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/subnet-id')
-def get_macaddr_subnet_id(api_version):
-    return 'subnet-1234', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/subnet-ipv4-cidr-block')
-def get_macaddr_subnet_ipv4_cidr_block(api_version):
-    return '127.255.0.0/20', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/vpc-id')
-def get_macaddr_vpc_id(api_version):
-    return 'vpc-1234', 200
-
-
-@app.route('/<api_version>/meta-data/network/interfaces/macs/AE:30:76:CE:38:62/vpc-ipv4-cidr-block')
-def get_macaddr_vpc_ipv4_cidr_block(api_version):
-    return '127.255.0.0/16', 200
-
-
-@app.route('/<api_version>/meta-data/placement')
-def get_placement_noslash(api_version):
-    return redirect(
-        url_for('get_placement_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route('/<api_version>/meta-data/placement/')
-def get_placement_slash(api_version):
-    return 'availability-zone', 200
-
-
-@app.route('/<api_version>/meta-data/placement/availability-zone')
-def get_placement_az(api_version):
-    return 'us-east-1a', 200
-
-
-@app.route('/<api_version>/meta-data/profile')
-def get_profile(api_version):
-    return 'default-hvm', 200
-
-
-@app.route('/<api_version>/meta-data/public-hostname')
-def get_public_hostname(api_version):
-    return 'mocked.internal', 200
-
-
-@app.route('/<api_version>/meta-data/public-ipv4')
-def get_public_ipv4s(api_version):
-    return '127.255.0.1', 200
-
-
-@app.route('/<api_version>/meta-data/public-keys')
-def get_public_keys_noslash(api_version):
-    return redirect(
-        url_for('get_public_keys_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route('/<api_version>/meta-data/public-keys/')
-def get_public_keys_slash(api_version):
-    return '0=boot', 200
-
-
-@app.route('/<api_version>/meta-data/reservation-id')
-def get_reservation_id(api_version):
-    return 'r-1234', 200
-
-
-@app.route('/<api_version>/meta-data/security-groups')
-def get_security_groups(api_version):
-    return 'default', 200
-
-
-@app.route('/<api_version>/meta-data/services')
-def get_services_noslash(api_version):
-    return redirect(
-        url_for('get_services_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route('/<api_version>/meta-data/services/')
-def get_services_slash(api_version):
-    return 'domain', 200
-
-
-@app.route('/<api_version>/meta-data/services/domain')
-def get_services_domain(api_version):
-    return 'amazonaws.com', 200
-
-
-@app.route('/<api_version>/dynamic')
-def get_dynamic_noslash(api_version):
-    return redirect(
-        url_for('get_dynamic_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route('/<api_version>/dynamic/')
-def get_dynamic_slash(api_version):
-    return 'instance-identity/\nfws/\n', 200
-
-
-@app.route('/<api_version>/dynamic/instance-identity')
-def get_instance_identity_noslash(api_version):
-    return redirect(
-        url_for('get_instance_identity_slash', api_version=api_version),
-        code=301
-    )
+# Exact paths that are served by calling into roles.
+_DYNAMIC_ROUTES = {
+    '/meta-data/iam/info': get_iam_info,
+    '/meta-data/iam/security-credentials/': get_security_credentials_slash,
+}
 
+# Path prefixes that are served by calling into roles, checked in order after
+# the table lookup misses. Handlers get the remainder of the path.
+_DYNAMIC_PREFIXES = (
+    ('/meta-data/iam/info/', get_iam_info),
+    ('/meta-data/iam/security-credentials/', get_role_credentials),
+)
 
-@app.route('/<api_version>/dynamic/instance-identity/')
-def get_instance_identity_slash(api_version):
-    return 'document\npkcs7\nsignature\ndsa2048', 200
+MOCK_TABLE = load_mock_table(
+    app.config['MOCK_METADATA_FILE'] or DEFAULT_MOCK_METADATA_FILE
+)
 
 
-@app.route('/<api_version>/dynamic/instance-identity/document')
-def get_instance_identity_document(api_version):
-    time_format = "%Y-%m-%dT%H:%M:%SZ"
-    now = datetime.datetime.now(dateutil.tz.tzutc())
-    ret = {
-        'privateIp': '127.255.0.1',
-        'devpayProductCodes': None,
-        'availabilityZone': 'us-east-1a',
-        'version': '2010-08-31',
-        'accountId': '1234',
-        'instanceId': 'i-{0}'.format(app.config['MOCKED_INSTANCE_ID']),
-        'billingProducts': None,
-        'instanceType': 't2.medium',
-        # This may be a terrible mock for this...
-        'pendingTime': now.strftime(time_format),
-        'imageId': 'ami-1234',
-        'kernelId': None,
-        'ramdiskId': None,
-        'architecture': 'x86_64',
-        'region': 'us-east-1'
-    }
-    return jsonify(ret)
-
-
-@app.route('/<api_version>/dynamic/instance-identity/pkcs7')
-def get_instance_identity_pkcs7(api_version):
-    # TODO: determine a reasonable mock for this
-    return 'mocked', 200
-
-
-@app.route('/<api_version>/dynamic/instance-identity/signature')
-def get_instance_identity_signature(api_version):
-    # TODO: determine a reasonable mock for this
-    return 'mocked', 200
-
-
-@app.route('/<api_version>/dynamic/instance-identity/dsa2048')
-def get_instance_identity_dsa2048(api_version):
-    # TODO: determine a reasonable mock for this
-    return 'mocked', 200
-
-
-@app.route('/<api_version>/dynamic/fws')
-def get_fws_noslash(api_version):
-    return redirect(
-        url_for('get_fws_slash', api_version=api_version),
-        code=301
-    )
-
-
-@app.route('/<api_version>/dynamic/fws/')
-def get_fws_slash(api_version):
-    return 'instance-monitoring\n', 200
-
-
-@app.route('/<api_version>/dynamic/fws/instance-monitoring')
-def get_instance_monitoring(api_version):
-    return 'enabled', 200
+def _resolves(path):
+    return path in MOCK_TABLE or any(path.startswith(prefix) for prefix, _ in _DYNAMIC_PREFIXES)
+
+
+@app.route('/<path:url>')
+def get_mock_metadata(url):
+    api_version, sep, path = url.partition('/')
+    path = sep + path
+    if '//' in path and _resolves(re.sub('/+', '/', path)):
+        # Like flask's routing, which redirects to the path with repeated
+        # slashes merged.
+        merged = request.host_url + re.sub('/+', '/', request.path.lstrip('/'))
+        return redirect(merged, code=308)
+    entry = MOCK_TABLE.get(path)
+    if entry is REDIRECT:
+        return redirect(request.path + '/', code=301)
+    if callable(entry):
+        return entry(api_version)
+    if entry is not None:
+        body, mimetype = entry
+        return Response(body, status=200, mimetype=mimetype)
+    for prefix, handler in _DYNAMIC_PREFIXES:
+        if path.startswith(prefix):
+            return handler(api_version, path[len(prefix):])
+    abort(404)
@@ -7,6 +7,7 @@ from flask import stream_with_context
 from flask import jsonify
 
 from metadataproxy import app
+from metadataproxy import deadline
 from metadataproxy import roles
 
 log = logging.getLogger(__name__)
@@ -70,7 +71,8 @@ def iam_sts_credentials(api_version, requested_role):
     log.debug('Providing assumed role credentials for {0}'.format(role_params['name']))
     assumed_role = roles.get_assumed_role_credentials(
         role_params=role_params,
-        api_version=api_version
+        api_version=api_version,
+        client=request.remote_addr
     )
     return jsonify(assumed_role)
 
@@ -79,10 +81,16 @@ def iam_sts_credentials(api_version, requested_role):
 @app.route('/')
 def passthrough(url=''):
     log.debug('Did not match credentials request url; passing through.')
-    req = requests.get(
-        '{0}/{1}'.format(app.config['METADATA_URL'], url),
-        stream=True
-    )
+    try:
+        req = requests.get(
+            '{0}/{1}'.format(app.config['METADATA_URL'], url),
+            stream=True,
+            timeout=deadline.timeout('passthrough', app.config['METADATA_TIMEOUT'])
+        )
+    except requests.exceptions.Timeout:
+        deadline.check('passthrough')
+        log.error('Timed out passing through {0}; returning 504.'.format(url))
+        return '', 504
     return Response(
         stream_with_context(req.iter_content()),
         content_type=req.headers['content-type'],
@@ -59,15 +59,116 @@ DEBUG = bool_env('DEBUG', False)
 
 # Url of the docker daemon. The default is to access docker via its socket.
 DOCKER_URL = str_env('DOCKER_URL', 'unix://var/run/docker.sock')
+# Docker API version to use. Pinned by default, so no version negotiation is
+# done at startup. Set to auto to use the daemon's version.
+DOCKER_API_VERSION = str_env('DOCKER_API_VERSION', '1.24')
+# Timeout in seconds for connecting to docker and reading each response. The
+# events stream, used by the container credentials endpoint, doesn't time out.
+DOCKER_TIMEOUT = float_env('DOCKER_TIMEOUT', 5.0)
+# Number of connections to the docker daemon kept open for reuse. Should be at
+# least DOCKER_SCAN_CONCURRENCY.
+DOCKER_POOL_SIZE = int_env('DOCKER_POOL_SIZE', 16)
+# Maximum number of concurrent container inspects when scanning all containers
+# for a caller that isn't in the container mapping cache.
+DOCKER_SCAN_CONCURRENCY = int_env('DOCKER_SCAN_CONCURRENCY', 8)
 # URL of the metadata service. Default is the normal location of the
 # metadata service in AWS.
 METADATA_URL = str_env('METADATA_URL', 'http://169.254.169.254')
+# Timeout in seconds for connecting to the metadata service and reading each
+# response, for requests passed through to it.
+METADATA_TIMEOUT = float_env('METADATA_TIMEOUT', 5.0)
 # Whether or not to mock all metadata endpoints. If True, mocked data will be
 # returned to callers. If False, all endpoints except for IAM endpoints will be
 # proxied through to the real metadata service.
 MOCK_API = bool_env('MOCK_API', False)
+# Mint credentials locally rather than calling STS and IAM, for development
+# and load testing without AWS. Credentials are shaped like real ones and
+# derived from MOCK_CREDENTIALS_SEED, the role, the session name, the external
+# id and the duration, so they're reproducible. Each STS or IAM call takes
+# MOCK_CREDENTIALS_LATENCY seconds, and fails with a throttling error at
+# MOCK_CREDENTIALS_ERROR_RATE (0 to 1). Credentials last
+# MOCK_CREDENTIALS_DURATION seconds, unless a session duration is set for the
+# role.
+MOCK_CREDENTIALS = bool_env('MOCK_CREDENTIALS', False)
+MOCK_CREDENTIALS_DURATION = int_env('MOCK_CREDENTIALS_DURATION', 3600)
+MOCK_CREDENTIALS_LATENCY = float_env('MOCK_CREDENTIALS_LATENCY', 0)
+MOCK_CREDENTIALS_ERROR_RATE = float_env('MOCK_CREDENTIALS_ERROR_RATE', 0)
+MOCK_CREDENTIALS_SEED = str_env('MOCK_CREDENTIALS_SEED', 'metadataproxy')
+# Limit the number of concurrent requests of each route class: credentials
+# (IAM and container credentials), info (IAM role name and info) and
+# passthrough (everything passed through to the metadata service). Up to
+# BULKHEAD_<CLASS>_CONCURRENCY requests of a class run at once, and up to
+# BULKHEAD_<CLASS>_QUEUE more wait for at most BULKHEAD_<CLASS>_TIMEOUT
+# seconds. Requests beyond that get a 503, so overload of one class doesn't
+# delay the others. A concurrency of 0 doesn't limit the class.
+BULKHEADS_ENABLED = bool_env('BULKHEADS_ENABLED', False)
+BULKHEAD_CREDENTIALS_CONCURRENCY = int_env('BULKHEAD_CREDENTIALS_CONCURRENCY', 200)
+BULKHEAD_CREDENTIALS_QUEUE = int_env('BULKHEAD_CREDENTIALS_QUEUE', 200)
+BULKHEAD_CREDENTIALS_TIMEOUT = float_env('BULKHEAD_CREDENTIALS_TIMEOUT', 1.0)
+BULKHEAD_INFO_CONCURRENCY = int_env('BULKHEAD_INFO_CONCURRENCY', 50)
+BULKHEAD_INFO_QUEUE = int_env('BULKHEAD_INFO_QUEUE', 100)
+BULKHEAD_INFO_TIMEOUT = float_env('BULKHEAD_INFO_TIMEOUT', 1.0)
+BULKHEAD_PASSTHROUGH_CONCURRENCY = int_env('BULKHEAD_PASSTHROUGH_CONCURRENCY', 50)
+BULKHEAD_PASSTHROUGH_QUEUE = int_env('BULKHEAD_PASSTHROUGH_QUEUE', 100)
+BULKHEAD_PASSTHROUGH_TIMEOUT = float_env('BULKHEAD_PASSTHROUGH_TIMEOUT', 1.0)
+# Seconds each request has to be answered in, from docker and mesos lookups
+# through to assuming its role. Lookups and calls cap their timeouts at the
+# time left; once it runs out, requests are answered with credentials that are
+# due for refresh but still valid, or a 504. Set it below the metadata
+# timeout of the SDKs in use, often 1 second. Disabled if 0.
+REQUEST_DEADLINE = float_env('REQUEST_DEADLINE', 0)
+# Number of threads running calls that can't be given a timeout of their
+# own, such as STS and IAM calls and reverse DNS lookups, for requests with a
+# deadline. Calls that outlive the deadline carry on, and cache their results.
+REQUEST_DEADLINE_WORKERS = int_env('REQUEST_DEADLINE_WORKERS', 32)
+# Count requests, container and role cache misses and STS calls by source IP
+# and by role, over the last USAGE_STATS_WINDOW seconds, for the admin
+# endpoint's /usage. Counts are kept in USAGE_STATS_BUCKETS buckets, each of
+# which tracks the USAGE_STATS_CAPACITY most frequent IPs and roles per event,
+# so memory is fixed however many callers there are.
+USAGE_STATS = bool_env('USAGE_STATS', False)
+USAGE_STATS_WINDOW = int_env('USAGE_STATS_WINDOW', 600)
+USAGE_STATS_BUCKETS = int_env('USAGE_STATS_BUCKETS', 10)
+USAGE_STATS_CAPACITY = int_env('USAGE_STATS_CAPACITY', 100)
+# Serve the IAM credential, role name and info routes from a plain WSGI
+# dispatcher in front of flask, skipping flask's routing and request handling.
+# Only applies when MOCK_API is disabled.
+IAM_FAST_PATH = bool_env('IAM_FAST_PATH', False)
+# Path of a unix socket to serve the admin endpoint on, for listing and
+# invalidating cached container mappings, roles and mesos lookups. `{pid}` is
+# replaced with the process id, since each gunicorn worker has its own caches.
+# Disabled if unset.
+ADMIN_SOCKET = str_env('ADMIN_SOCKET')
+# Serve /healthz and /readyz. Both report the latest results of probes of
+# docker, STS, IAM, the metadata service and mesos, whichever are in use, run
+# in the background every HEALTH_PROBE_INTERVAL seconds. /readyz returns 503
+# while a probe is failing.
+HEALTH_ENDPOINTS_ENABLED = bool_env('HEALTH_ENDPOINTS_ENABLED', False)
+HEALTH_PROBE_INTERVAL = int_env('HEALTH_PROBE_INTERVAL', 10)
+# Timeout in seconds for the STS, IAM, metadata service and mesos probes. The
+# docker probe uses DOCKER_TIMEOUT.
+HEALTH_PROBE_TIMEOUT = float_env('HEALTH_PROBE_TIMEOUT', 2.0)
+# Path of a file to snapshot the container mapping, role ARN and mesos lookup
+# caches to, every SNAPSHOT_INTERVAL seconds and on exit. Each worker merges
+# its caches into the file, keeping the latest lookup of each IP. Workers
+# load it before serving their first request, dropping mappings to
+# containers that are no longer running, so a restarted proxy starts warm.
+# Credentials aren't included. Disabled if unset.
+SNAPSHOT_FILE = str_env('SNAPSHOT_FILE')
+SNAPSHOT_INTERVAL = int_env('SNAPSHOT_INTERVAL', 60)
+# Snapshots older than this, in seconds, aren't loaded.
+SNAPSHOT_MAX_AGE = int_env('SNAPSHOT_MAX_AGE', 3600)
+# Path of a file to write a line of JSON per request to, with its source IP,
+# path, status and timings, for replaying with benchmarks/replay.py. `{pid}`
+# is replaced with the process id. Disabled if unset.
+TRACE_FILE = str_env('TRACE_FILE')
+# Fraction of requests to trace.
+TRACE_SAMPLE_RATE = float_env('TRACE_SAMPLE_RATE', 1.0)
 # When mocking the API, use the following instance id in returned data.
 MOCKED_INSTANCE_ID = str_env('MOCKED_INSTANCE_ID', 'mockedid')
+# When mocking the API, path to a YAML or JSON document describing the mocked
+# metadata tree. If unset, the tree bundled with metadataproxy is used.
+MOCK_METADATA_FILE = str_env('MOCK_METADATA_FILE')
 
 # Role to use if IAM_ROLE is not set in a container's environment. If unset
 # the container will get no IAM credentials.
@@ -88,10 +189,47 @@ DEFAULT_ACCOUNT_ID = str_env('DEFAULT_ACCOUNT_ID')
 AWS_ACCOUNT_MAP = json.loads(str_env('AWS_ACCOUNT_MAP', '{}'))
 # AWS Region to resolve region based STS service endpoint and to make calls against it.
 AWS_REGION = str_env('AWS_REGION')
+# Override the endpoint URL used for STS or IAM calls. Takes precedence over the
+# region based STS endpoint. Useful for VPC endpoints, or for pointing
+# metadataproxy at the local stand-ins used by the benchmarks.
+STS_ENDPOINT_URL = str_env('STS_ENDPOINT_URL')
+IAM_ENDPOINT_URL = str_env('IAM_ENDPOINT_URL')
 # The threshold before credentials expire in minutes at which metadataproxy will attempt
 # to load new credentials. The default in previous versions of metadataproxy was 5, but
 # we choose to make the new default 15 for better compatibility with aws-sdk-java.
 ROLE_EXPIRATION_THRESHOLD = int_env('ROLE_EXPIRATION_THRESHOLD', 15)
+# Duration in seconds of the sessions metadataproxy assumes roles for. Roles
+# can allow sessions of up to 12 hours. The default, 0, leaves it to STS,
+# which issues one hour sessions.
+ROLE_SESSION_DURATION = int_env('ROLE_SESSION_DURATION', 0)
+# A mapping of role names or ARNs to session durations in seconds, overriding
+# ROLE_SESSION_DURATION for those roles; for instance:
+#
+#   ROLE_SESSION_DURATIONS={"my-long-lived-role": 43200}
+ROLE_SESSION_DURATIONS = json.loads(str_env('ROLE_SESSION_DURATIONS', '{}'))
+# Optional keys in container labels or environment variables to read a
+# container's session duration in seconds and expiration threshold in minutes
+# from. Prefix with Labels: or Env:, as for ROLE_SESSION_KEY.
+ROLE_SESSION_DURATION_KEY = str_env('ROLE_SESSION_DURATION_KEY')
+ROLE_EXPIRATION_THRESHOLD_KEY = str_env('ROLE_EXPIRATION_THRESHOLD_KEY')
+# Seconds to spread client credential refreshes over. Roles are refreshed this
+# much earlier than ROLE_EXPIRATION_THRESHOLD, and each client is told its
+# credentials expire earlier by an offset within the spread, fixed per client
+# IP or container credentials key. Clients that refresh within the expiration
+# threshold then come back spread out, after the role has been refreshed,
+# rather than all at once as it's due. Disabled if 0.
+CLIENT_REFRESH_SPREAD = int_env('CLIENT_REFRESH_SPREAD', 0)
+# URL of a cache shared between proxies to keep assumed roles in, so a role
+# used on many hosts is assumed by one of them per refresh, rather than by
+# each. redis://, rediss:// and unix:// URLs use a redis backend. Entries are
+# encrypted with the keys in CREDENTIAL_CACHE_KEY_FILE. Disabled if unset.
+CREDENTIAL_CACHE_URL = str_env('CREDENTIAL_CACHE_URL')
+# File of Fernet keys, one per line, provisioned on each host. The first key
+# encrypts, and all of them decrypt.
+CREDENTIAL_CACHE_KEY_FILE = str_env('CREDENTIAL_CACHE_KEY_FILE')
+# Timeout in seconds for calls to the credential cache. If a call fails, the
+# role is assumed directly.
+CREDENTIAL_CACHE_TIMEOUT = float_env('CREDENTIAL_CACHE_TIMEOUT', 0.5)
 # A json file that has a dict mapping of IP addresses to role names. Can be
 # used if docker networking has been disabled and you are managing IP
 # addressing for containers through another process.
@@ -106,6 +244,40 @@ HOSTNAME_MATCH_REGEX = str_env('HOSTNAME_MATCH_REGEX', '^.*$')
 # Optional key in container labels or environment variables to use for role session name.
 # Prefix with Labels: or Env: respectively to indicate where key should be found.
 ROLE_SESSION_KEY = str_env('ROLE_SESSION_KEY')
+# Resolve callers to containers from local kernel state: the network
+# namespace addresses and cgroup of every process under PROC_ROOT, instead
+# of scanning containers. Each container found is inspected once, for its env
+# and labels. Falls back to the docker lookup if no container is found.
+# Requires metadataproxy to run in the host pid namespace.
+PROC_RESOLVER = bool_env('PROC_RESOLVER', False)
+# Where the host's /proc is mounted.
+PROC_ROOT = str_env('PROC_ROOT', '/proc')
+# Interval in seconds at which the /proc index is refreshed in the background.
+# Lookups that miss the index also trigger a refresh.
+PROC_RESOLVER_REFRESH_INTERVAL = int_env('PROC_RESOLVER_REFRESH_INTERVAL', 5)
+# Resolve callers to pods from the kubelet's list of pods on this node, for
+# kubelet managed nodes. IAM_ROLE and IAM_EXTERNAL_ID are read from the pod
+# annotations below, or if a pod doesn't have them from the env of its
+# containers, and ROLE_SESSION_KEY from either pod labels and annotations
+# (Labels:) or container env (Env:). Callers that aren't pods aren't looked
+# up through docker; the /proc resolver is still tried, if enabled.
+KUBELET_RESOLVER = bool_env('KUBELET_RESOLVER', False)
+# The kubelet's pods endpoint.
+KUBELET_PODS_URL = str_env('KUBELET_PODS_URL', 'https://127.0.0.1:10250/pods')
+# Bearer token to authenticate to the kubelet with. Read on every fetch, so
+# rotated service account tokens are picked up. No token is sent if unset.
+KUBELET_TOKEN_FILE = str_env('KUBELET_TOKEN_FILE', '/var/run/secrets/kubernetes.io/serviceaccount/token')
+# CA bundle to verify the kubelet's certificate with. The system CAs are
+# used if unset.
+KUBELET_CA_FILE = str_env('KUBELET_CA_FILE')
+# Timeout in seconds of requests to the kubelet.
+KUBELET_TIMEOUT = float_env('KUBELET_TIMEOUT', 2.0)
+# Interval in seconds at which the pod index is refreshed in the background.
+# Lookups that miss the index also trigger a refresh, at most once a second.
+KUBELET_REFRESH_INTERVAL = int_env('KUBELET_REFRESH_INTERVAL', 5)
+# Pod annotations to read the role and external id from.
+KUBELET_ROLE_ANNOTATION = str_env('KUBELET_ROLE_ANNOTATION', 'iam.amazonaws.com/role')
+KUBELET_EXTERNAL_ID_ANNOTATION = str_env('KUBELET_EXTERNAL_ID_ANNOTATION', 'iam.amazonaws.com/external-id')
 # In case we also want to query the mesos state api
 MESOS_STATE_LOOKUP = bool_env('MESOS_STATE_LOOKUP', False)
 # URL of the mesos state endpoint to query
@@ -113,6 +285,20 @@ MESOS_STATE_URL = str_env('MESOS_STATE_URL', 'http://localhost:5051/state')
 # Timeout to use when calling the mesos state endpoint
 MESOS_STATE_TIMEOUT = int_env('MESOS_STATE_TIMEOUT', 2)
 
+# Serve per-container credentials in the format of the ECS container
+# credentials endpoint, keyed by the token or path a container was launched
+# with rather than by its IP. Containers are registered from the docker events
+# stream.
+ECS_CREDENTIALS_ENABLED = bool_env('ECS_CREDENTIALS_ENABLED', False)
+# Path the container credentials endpoint is served under. Containers set
+# AWS_CONTAINER_CREDENTIALS_FULL_URI to http://<proxy><ECS_CREDENTIALS_PATH>,
+# optionally followed by /<unique id>, and/or AWS_CONTAINER_AUTHORIZATION_TOKEN
+# to a unique token.
+ECS_CREDENTIALS_PATH = str_env('ECS_CREDENTIALS_PATH', '/v2/credentials')
+# Seconds to wait before resyncing containers after the docker events stream
+# fails.
+ECS_CREDENTIALS_RESYNC_DELAY = int_env('ECS_CREDENTIALS_RESYNC_DELAY', 5)
+
 # Patch botocore's allowed hosts for ContainerMetadataFetcher to support aws-vault's
 # --ecs-server option. This will inject docker for mac's URL for the host into the
 # allowed addresses botocore will talk to.
@@ -0,0 +1,327 @@
+# Import python libs
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy import roles
+from metadataproxy.util import once_per_process
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 2
+
+
+def _mesos_params(container):
+    if container is None:
+        return None
+    return roles.get_role_params_from_container(container)
+
+
+def build_snapshot():
+    """The lookup caches, without credentials, as a json serializable dict.
+
+    Mesos lookups are kept as the role params they resolved to, or None,
+    rather than as the task's labels, which can hold anything.
+    """
+    now = time.time()
+    return {
+        'version': SNAPSHOT_VERSION,
+        'written_at': now,
+        'container_mapping': {
+            ip: [container_id, roles.CONTAINER_MAPPING_UPDATED.get(ip, now)]
+            for ip, container_id in list(roles.CONTAINER_MAPPING.items())
+        },
+        'role_arns': {
+            name: [arn, updated]
+            for name, (updated, arn) in list(roles.ROLE_ARNS.items())
+        },
+        'mesos': {
+            ip: [updated, _mesos_params(container)]
+            for ip, (updated, container) in list(roles.MESOS_CONTAINERS.items())
+        }
+    }
+
+
+def container_from_role_params(params):
+    """A container that resolves to role params, to restore mesos lookups.
+
+    The params are written to the env vars and the ROLE_SESSION_KEY,
+    ROLE_SESSION_DURATION_KEY and ROLE_EXPIRATION_THRESHOLD_KEY env vars or
+    labels they're read from.
+    """
+    env = []
+    labels = {}
+    if params['name']:
+        env.append('IAM_ROLE={0}'.format(roles.role_key(params)))
+    if params['external_id']:
+        env.append('IAM_EXTERNAL_ID={0}'.format(params['external_id']))
+    for param, setting in (('session_name', 'ROLE_SESSION_KEY'),
+                           ('duration', 'ROLE_SESSION_DURATION_KEY'),
+                           ('expiration_threshold', 'ROLE_EXPIRATION_THRESHOLD_KEY')):
+        skey = app.config[setting]
+        if params[param] is None:
+            continue
+        if skey.startswith('Env:'):
+            env.append('{0}={1}'.format(skey[4:], params[param]))
+        elif skey.startswith('Labels:'):
+            labels[skey[7:]] = str(params[param])
+    return {'Config': {'Env': env, 'Labels': labels}}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _valid_role_params(params):
+    if params is None:
+        return True
+    if not isinstance(params, dict) or set(params) != set(roles.new_role_params()):
+        return False
+    return all(
+        params[key] is None or isinstance(params[key], str)
+        for key in ('name', 'account_id', 'external_id', 'session_name')
+    ) and all(
+        params[key] is None or isinstance(params[key], int)
+        for key in ('duration', 'expiration_threshold')
+    )
+
+
+# Checks of the entries of each section of a snapshot.
+VALID_ENTRIES = {
+    'container_mapping': lambda e: isinstance(e[0], str) and _is_number(e[1]),
+    'role_arns': lambda e: isinstance(e[0], str) and _is_number(e[1]),
+    'mesos': lambda e: _is_number(e[0]) and _valid_role_params(e[1]),
+}
+
+
+def validate_snapshot(snapshot):
+    """Drop the entries of a snapshot that aren't of the expected shape.
+
+    Returns the number dropped. Raises ValueError if the snapshot itself
+    isn't.
+    """
+    if not isinstance(snapshot, dict) or not _is_number(snapshot.get('written_at')):
+        raise ValueError('not a snapshot')
+    dropped = 0
+    for section, valid in VALID_ENTRIES.items():
+        entries = snapshot.get(section)
+        if not isinstance(entries, dict):
+            raise ValueError('{0} is not a dict'.format(section))
+        for key, entry in list(entries.items()):
+            if not (isinstance(entry, list) and len(entry) == 2 and valid(entry)):
+                del entries[key]
+                dropped += 1
+    return dropped
+
+
+def merge_snapshots(snapshot, other):
+    """Add the entries of another worker's snapshot to snapshot.
+
+    Where both have an IP, the more recent lookup is kept. Entries only in
+    the other snapshot are kept while they're young enough to be restored,
+    so lookups of workers that have exited don't pile up.
+    """
+    now = time.time()
+    mapping = snapshot['container_mapping']
+    for ip, entry in other['container_mapping'].items():
+        if ip in mapping:
+            if entry[1] > mapping[ip][1]:
+                mapping[ip] = entry
+        elif now - entry[1] < app.config['SNAPSHOT_MAX_AGE']:
+            mapping[ip] = entry
+    arns = snapshot['role_arns']
+    for name, entry in other['role_arns'].items():
+        if name in arns:
+            if entry[1] > arns[name][1]:
+                arns[name] = entry
+        elif now - entry[1] < roles.ROLE_ARNS.ttl:
+            arns[name] = entry
+    mesos = snapshot['mesos']
+    for ip, entry in other['mesos'].items():
+        if ip in mesos:
+            if entry[0] > mesos[ip][0]:
+                mesos[ip] = entry
+        elif now - entry[0] < roles.MESOS_CONTAINERS.ttl:
+            mesos[ip] = entry
+    return snapshot
+
+
+def write_snapshot(path):
+    # Each worker has its own caches, so the snapshot on disk is merged
+    # into rather than replaced. The lock keeps workers from merging at the
+    # same time and dropping each other's entries.
+    lock_fd = os.open(path + '.lock', os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        snapshot = build_snapshot()
+        other = read_snapshot(path)
+        if other is not None:
+            merge_snapshots(snapshot, other)
+        # Written to a file of this process's own and renamed into place, so
+        # readers never see part of a snapshot.
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    finally:
+        os.close(lock_fd)
+    msg = 'Wrote snapshot of {0} container mappings, {1} role ARNs and {2} mesos lookups to {3}'
+    log.debug(msg.format(
+        len(snapshot['container_mapping']), len(snapshot['role_arns']), len(snapshot['mesos']), path
+    ))
+
+
+def read_snapshot(path):
+    """Read a snapshot, or return None if there's no usable one at path."""
+    try:
+        with open(path, 'r') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        log.exception('Unable to read snapshot {0}'.format(path))
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        log.error('Ignoring snapshot {0} of an unknown version'.format(path))
+        return None
+    try:
+        dropped = validate_snapshot(snapshot)
+    except ValueError as e:
+        log.error('Ignoring invalid snapshot {0}: {1}'.format(path, e))
+        return None
+    if dropped:
+        log.error('Ignoring {0} invalid entries in snapshot {1}'.format(dropped, path))
+    age = time.time() - snapshot['written_at']
+    if age > app.config['SNAPSHOT_MAX_AGE']:
+        log.info('Ignoring snapshot {0} written {1:.0f}s ago'.format(path, age))
+        return None
+    return snapshot
+
+
+def container_ips(summary):
+    """IPs of a container in the docker container list."""
+    ips = set()
+    networks = (summary.get('NetworkSettings') or {}).get('Networks') or {}
+    for network in networks.values():
+        if network.get('IPAddress'):
+            ips.add(network['IPAddress'])
+    rancher_ip = (summary.get('Labels') or {}).get('io.rancher.container.ip')
+    if rancher_ip:
+        ips.add(rancher_ip.split('/')[0])
+    return ips
+
+
+def restore_container_mapping(entries):
+    """Restore the mappings of IPs to containers that are still running.
+
+    Checked against a single container list call, rather than an inspect per
+    container. A mapping is dropped if the container isn't running or, when
+    the list includes container networks, doesn't have the IP any more;
+    mappings made by hostname are dropped as well, and made again on use.
+    """
+    if not entries or app.config['ROLE_MAPPING_FILE']:
+        return 0
+    try:
+        running = {c['Id']: c for c in roles.docker_client().containers()}
+    except Exception:
+        log.exception('Unable to list containers to check the snapshot against')
+        return 0
+    restored = 0
+    for ip, (container_id, updated) in entries.items():
+        summary = running.get(container_id)
+        if summary is None:
+            continue
+        if 'NetworkSettings' in summary and ip not in container_ips(summary):
+            continue
+        roles.CONTAINER_MAPPING.setdefault(ip, container_id)
+        roles.CONTAINER_MAPPING_UPDATED.setdefault(ip, updated)
+        restored += 1
+    return restored
+
+
+def restore_mesos(entries):
+    if not app.config['MESOS_STATE_LOOKUP']:
+        return 0
+    now = time.time()
+    restored = 0
+    for ip, (updated, params) in entries.items():
+        if now - updated < roles.MESOS_CONTAINERS.ttl and ip not in roles.MESOS_CONTAINERS:
+            container = None if params is None else container_from_role_params(params)
+            roles.MESOS_CONTAINERS[ip] = (updated, container)
+            restored += 1
+    return restored
+
+
+def restore_role_arns(entries):
+    now = time.time()
+    restored = 0
+    for name, (arn, updated) in entries.items():
+        if now - updated < roles.ROLE_ARNS.ttl and name not in roles.ROLE_ARNS:
+            roles.ROLE_ARNS[name] = (updated, arn)
+            restored += 1
+    return restored
+
+
+def restore_snapshot(snapshot):
+    container_mappings = restore_container_mapping(snapshot['container_mapping'])
+    role_arns = restore_role_arns(snapshot['role_arns'])
+    mesos = restore_mesos(snapshot['mesos'])
+    msg = 'Restored {0} of {1} container mappings, {2} of {3} role ARNs and {4} of {5} mesos lookups from snapshot'
+    log.info(msg.format(
+        container_mappings, len(snapshot['container_mapping']), role_arns, len(snapshot['role_arns']),
+        mesos, len(snapshot['mesos'])
+    ))
+
+
+def _write_snapshot_on_exit(path):
+    # Only from the process that loaded it; a forked child inherits atexit.
+    if start_snapshots.pid == os.getpid():
+        try:
+            write_snapshot(path)
+        except Exception:
+            log.exception('Unable to write snapshot {0}'.format(path))
+
+
+def write_snapshots_forever(path):
+    while True:
+        time.sleep(app.config['SNAPSHOT_INTERVAL'])
+        try:
+            write_snapshot(path)
+        except Exception:
+            log.exception('Unable to write snapshot {0}'.format(path))
+
+
+@once_per_process
+def start_snapshots():
+    """Load the snapshot, then write it periodically and on exit.
+
+    Runs on the process's first request, like the admin server. Other
+    requests wait until the snapshot is loaded.
+    """
+    path = app.config['SNAPSHOT_FILE']
+    try:
+        snapshot = read_snapshot(path)
+        if snapshot is not None:
+            restore_snapshot(snapshot)
+    except Exception:
+        log.exception('Unable to restore snapshot {0}'.format(path))
+    atexit.register(_write_snapshot_on_exit, path)
+    thread = threading.Thread(target=write_snapshots_forever, args=(path,), name='snapshot-writer', daemon=True)
+    thread.start()
+
+
+class SnapshotLoader(object):
+    """WSGI middleware that loads the snapshot before the first request."""
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        start_snapshots()
+        return self.wsgi_app(environ, start_response)
@@ -0,0 +1,118 @@
+# Import python libs
+import json
+import logging
+import os
+import random
+import threading
+import time
+import timeit
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy.util import RequestLocal
+
+log = logging.getLogger(__name__)
+
+# Phase timings of the request being handled.
+_current = RequestLocal()
+_trace_lock = threading.Lock()
+_trace_file = None
+_trace_pid = None
+
+
+def add_phase(name, duration):
+    """Add the duration of a timed block to the request being traced, if any."""
+    phases = getattr(_current, 'phases', None)
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + duration
+
+
+def bind(fn):
+    """fn, adding its timed blocks to the request being traced.
+
+    For functions submitted to an executor on behalf of the request, whose
+    phases would otherwise be added in a worker thread with no trace. Phases
+    run concurrently are summed, so they can add up to more than the request.
+    """
+    phases = getattr(_current, 'phases', None)
+    if phases is None:
+        return fn
+
+    def traced(*args, **kwargs):
+        _current.phases = phases
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.phases = None
+    return traced
+
+
+def trace_path(environ):
+    """The request path, without the key of container credential paths.
+
+    Credential paths of the container credentials endpoint are as good as
+    the credentials themselves, so only the endpoint is kept.
+    """
+    path = environ.get('PATH_INFO', '')
+    prefix = app.config['ECS_CREDENTIALS_PATH'].rstrip('/')
+    if app.config['ECS_CREDENTIALS_ENABLED'] and path.startswith(prefix + '/'):
+        return prefix + '/'
+    return path
+
+
+def write_trace(record):
+    global _trace_file, _trace_pid
+    line = json.dumps(record, separators=(',', ':')) + '\n'
+    with _trace_lock:
+        # Opened in each process, since `{pid}` differs between workers.
+        if _trace_pid != os.getpid():
+            path = app.config['TRACE_FILE'].format(pid=os.getpid())
+            _trace_file = open(path, 'a', buffering=1)
+            _trace_pid = os.getpid()
+            log.info('Writing request traces to {0}'.format(path))
+        _trace_file.write(line)
+
+
+class TraceRecorder(object):
+    """WSGI middleware that writes a line of JSON per request to TRACE_FILE.
+
+    Each line has the start time, source IP, method, path, whether an
+    Authorization header was sent, the status, the duration and the time
+    spent in each timed block of roles, in seconds. Replay traces with
+    `python -m benchmarks.replay`.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if random.random() >= app.config['TRACE_SAMPLE_RATE']:
+            return self.wsgi_app(environ, start_response)
+        status = []
+
+        def traced_start_response(_status, headers, exc_info=None):
+            status.append(_status)
+            return start_response(_status, headers, exc_info)
+
+        _current.phases = {}
+        start_time = time.time()
+        start = timeit.default_timer()
+        try:
+            return self.wsgi_app(environ, traced_start_response)
+        finally:
+            duration = timeit.default_timer() - start
+            phases = _current.phases
+            _current.phases = None
+            try:
+                write_trace({
+                    't': round(start_time, 6),
+                    'ip': environ.get('REMOTE_ADDR'),
+                    'method': environ.get('REQUEST_METHOD'),
+                    'path': trace_path(environ),
+                    'auth': 'HTTP_AUTHORIZATION' in environ,
+                    'status': int(status[0].split(' ', 1)[0]) if status else None,
+                    'dur': round(duration, 6),
+                    # Copied, as bound functions may still be adding to it.
+                    'phases': {k: round(v, 6) for k, v in list(phases.items())}
+                })
+            except Exception:
+                log.exception('Unable to write request trace')
@@ -0,0 +1,139 @@
+# Import python libs
+import threading
+import time
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy.util import RequestLocal
+
+EVENTS = ('requests', 'container_misses', 'role_misses', 'sts_calls')
+DIMENSIONS = ('ip', 'role')
+
+# Source IP of the request being handled.
+_current = RequestLocal()
+_lock = threading.Lock()
+_buckets = None
+
+
+class SpaceSaving(object):
+    """Approximate counts of the most frequent keys, in fixed memory.
+
+    Tracks at most `capacity` keys (the space-saving algorithm). When a new
+    key arrives and the table is full, the key with the lowest count is
+    replaced, and the new key inherits that count as its error. Any key with
+    a true count above total / capacity is tracked, and counts are
+    overestimated by at most their error.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # key -> [count, error]
+        self.counts = {}
+
+    def add(self, key, value=1):
+        entry = self.counts.get(key)
+        if entry is not None:
+            entry[0] += value
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = [value, 0]
+        else:
+            victim = min(self.counts, key=lambda k: self.counts[k][0])
+            floor = self.counts.pop(victim)[0]
+            self.counts[key] = [floor + value, floor]
+
+
+def _new_bucket(index):
+    return index, {(event, dim): SpaceSaving(app.config['USAGE_STATS_CAPACITY'])
+                   for event in EVENTS for dim in DIMENSIONS}
+
+
+def _bucket_width():
+    return app.config['USAGE_STATS_WINDOW'] / app.config['USAGE_STATS_BUCKETS']
+
+
+def set_caller(ip):
+    _current.ip = ip
+
+
+def caller():
+    """Source IP of the request being handled, or None."""
+    return getattr(_current, 'ip', None)
+
+
+def record(event, ip=None, role=None):
+    """Count an event for a source IP, a role or both."""
+    global _buckets
+    if not app.config['USAGE_STATS']:
+        return
+    index = int(time.time() // _bucket_width())
+    with _lock:
+        if _buckets is None:
+            _buckets = [(None, None)] * app.config['USAGE_STATS_BUCKETS']
+        slot = index % len(_buckets)
+        if _buckets[slot][0] != index:
+            # Unused so far, or holding counts from a window ago.
+            _buckets[slot] = _new_bucket(index)
+        counters = _buckets[slot][1]
+        if ip is not None:
+            counters[(event, 'ip')].add(ip)
+        if role is not None:
+            counters[(event, 'role')].add(role)
+
+
+def top(event, dim, k=10):
+    """The k keys with the most events over the window, most first.
+
+    Returns dicts of key, count and error; a key's true count is between
+    count - error and count. A key missing from a bucket whose table is full
+    may have been evicted from it, with up to the bucket's lowest count, so
+    that count is added to both its count and its error.
+    """
+    oldest = int(time.time() // _bucket_width()) - app.config['USAGE_STATS_BUCKETS'] + 1
+    totals = {}
+    # Sum of the lowest counts of the full buckets, added to every key; keys
+    # in a bucket add what they have over its lowest count.
+    floors = 0
+    with _lock:
+        for index, counters in _buckets or []:
+            if index is None or index < oldest:
+                continue
+            table = counters[(event, dim)]
+            floor = 0
+            if len(table.counts) >= table.capacity:
+                floor = min(count for count, _ in table.counts.values())
+            floors += floor
+            for key, (count, error) in table.counts.items():
+                total = totals.setdefault(key, [0, 0])
+                total[0] += count - floor
+                total[1] += error - floor
+    for total in totals.values():
+        total[0] += floors
+        total[1] += floors
+    ranked = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:k]
+    return [{'key': key, 'count': count, 'error': error} for key, (count, error) in ranked]
+
+
+def report(k=10):
+    return {
+        event: {dim: top(event, dim, k) for dim in DIMENSIONS}
+        for event in EVENTS
+    }
+
+
+class UsageRecorder(object):
+    """WSGI middleware that counts requests by source IP.
+
+    Cache misses and STS calls made while handling the request are counted
+    for the same IP, and requests, misses and calls are also counted by role.
+    See the admin endpoint's /usage.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        ip = environ.get('REMOTE_ADDR')
+        set_caller(ip)
+        record('requests', ip=ip)
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            set_caller(None)
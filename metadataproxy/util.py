@@ -0,0 +1,65 @@
+# Import python libs
+import functools
+import os
+import threading
+
+# Guards making each function's lock. Only held while making it, never while
+# the function runs, so it's safe to take before gevent patches threading.
+_locks_lock = threading.Lock()
+
+
+def once_per_process(fn):
+    """Run fn on its first call in each process, and return its result after.
+
+    For background threads, sockets and per-process state that must live in
+    the process serving requests. With PRELOAD_APP, gunicorn imports the app
+    in its master and forks the workers from it: anything started at import
+    would run in the master, where the workers don't get it, and locks and
+    semaphores made at import would be made before the gevent worker patches
+    threading. So these are started lazily, on first use, and again in every
+    forked process, keyed by pid. Concurrent first calls wait for the first
+    one. If fn raises, the next call runs it again.
+
+    The wrapper's `pid` is the process it last ran in; tests set it to
+    os.getpid() to skip fn.
+    """
+    state = {'lock': None, 'lock_pid': None}
+
+    @functools.wraps(fn)
+    def wrapper():
+        pid = os.getpid()
+        if wrapper.pid == pid:
+            return wrapper.result
+        with _locks_lock:
+            # Made in this process, after gevent has patched threading.
+            if state['lock_pid'] != pid:
+                state['lock'] = threading.Lock()
+                state['lock_pid'] = pid
+            lock = state['lock']
+        with lock:
+            if wrapper.pid != pid:
+                wrapper.result = fn()
+                wrapper.pid = pid
+        return wrapper.result
+
+    wrapper.pid = None
+    wrapper.result = None
+    return wrapper
+
+
+class RequestLocal(object):
+    """Attributes of the request being handled, such as its deadline.
+
+    A threading.local, which is a greenlet local once gevent has patched
+    threading. With PRELOAD_APP that happens in each worker, after import, so
+    the local is made in each process on first use rather than at import,
+    where it would be a plain thread local shared by every greenlet.
+    """
+    def __init__(self):
+        object.__setattr__(self, '_local', once_per_process(threading.local))
+
+    def __getattr__(self, name):
+        return getattr(self._local(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._local(), name, value)
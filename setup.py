@@ -25,8 +25,8 @@ reqs = reqs_base + reqs_wsgi
 
 setup(
     name="metadataproxy",
-    version="2.2.0",
-    packages=find_packages(exclude=["test*"]),
+    version="2.3.0",
+    packages=find_packages(exclude=["test*", "benchmarks*"]),
     include_package_data=True,
     zip_safe=False,
     install_requires=reqs,
@@ -0,0 +1,113 @@
+# Import python libs
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+# Import metadataproxy libs
+from metadataproxy import admin
+from metadataproxy import app
+from metadataproxy import kubelet
+from metadataproxy import roles
+
+TOKEN = 'AWS_CONTAINER_AUTHORIZATION_TOKEN=secret-token'
+
+
+class FakeKubeletPodIndex(kubelet.KubeletPodIndex):
+    def __init__(self, pods):
+        super(FakeKubeletPodIndex, self).__init__('https://127.0.0.1:10250/pods')
+        self.items = pods
+
+    def fetch(self, timeout=None):
+        return self.items
+
+
+def make_pod(uid, ip):
+    return {
+        'metadata': {'uid': uid, 'name': 'pod-' + uid, 'namespace': 'default', 'resourceVersion': '1'},
+        'spec': {'containers': [{'name': 'app', 'env': [{'name': 'IAM_ROLE', 'value': 'myrole'}]}]},
+        'status': {'phase': 'Running', 'podIP': ip}
+    }
+
+
+def make_container(_id, *env):
+    return {'Id': _id, 'Name': '/' + _id, 'State': {'Running': True},
+            'Config': {'Env': ['IAM_ROLE=myrole'] + list(env), 'Labels': {}}}
+
+
+class AdminCachesTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = roles._kubelet_index, roles._proc_index
+        roles._proc_index = None
+        roles._kubelet_index = FakeKubeletPodIndex([make_pod('a', '10.1.0.1'), make_pod('b', '10.1.0.2')])
+        roles._kubelet_index.refresh()
+        self.clear()
+        self.client = admin.admin_app.test_client()
+
+    def tearDown(self):
+        roles._kubelet_index, roles._proc_index = self.saved
+        self.clear()
+
+    def clear(self):
+        for cache in (roles.PROC_CONTAINERS, roles.CONTAINER_CREDENTIALS, roles.CONTAINER_CREDENTIAL_OWNERS,
+                      roles.CONTAINER_CREDENTIAL_KEYS, roles.CONTAINER_CREDENTIAL_PARAMS):
+            cache.clear()
+
+    def test_lists_every_cache(self):
+        roles.PROC_CONTAINERS['c'] = make_container('c')
+        roles.register_container_credentials(make_container('c', TOKEN))
+        caches = self.client.get('/caches').get_json()
+        self.assertEqual(set(caches), set(admin.CACHES))
+        self.assertEqual(caches['kubelet_pods']['size'], 2)
+        self.assertEqual(caches['proc_index']['size'], 0)
+        self.assertEqual(caches['proc_containers']['size'], 1)
+        self.assertEqual(caches['container_credentials']['size'], 1)
+        for name in admin.CACHES:
+            self.assertEqual(self.client.get('/caches/' + name).status_code, 200)
+
+    def test_redacts_credential_keys(self):
+        roles.register_container_credentials(make_container('c', TOKEN))
+        entries = self.client.get('/caches/container_credentials').get_json()['entries']
+        self.assertEqual(entries, [{'kind': 'token', 'key': 'secr...oken', 'container_id': 'c', 'role': 'myrole'}])
+
+    def test_invalidates_kubelet_pod_by_ip(self):
+        removed = admin.invalidate(ip='10.1.0.1')
+        self.assertEqual(removed['kubelet_pods'], 1)
+        self.assertIsNone(roles._kubelet_index.lookup('10.1.0.1'))
+        self.assertIsNotNone(roles._kubelet_index.lookup('10.1.0.2'))
+        # Read again on the next refresh.
+        roles._kubelet_index.refresh()
+        self.assertEqual(roles._kubelet_index.lookup('10.1.0.1')['Id'], 'a')
+
+    def test_invalidates_container(self):
+        roles.PROC_CONTAINERS['c'] = make_container('c')
+        roles.register_container_credentials(make_container('c', TOKEN))
+        removed = admin.invalidate(container_id='c')
+        self.assertEqual(removed['proc_containers'], 1)
+        self.assertEqual(removed['container_credentials'], 1)
+        self.assertNotIn('c', roles.PROC_CONTAINERS)
+        self.assertNotIn(('token', 'secret-token'), roles.CONTAINER_CREDENTIALS)
+        self.assertNotIn('c', roles.CONTAINER_CREDENTIAL_KEYS)
+
+
+class AdminSocketTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = app.config['ADMIN_SOCKET']
+        self.dir = tempfile.mkdtemp()
+        app.config['ADMIN_SOCKET'] = os.path.join(self.dir, 'admin-{pid}.sock')
+
+    def tearDown(self):
+        app.config['ADMIN_SOCKET'] = self.saved
+        shutil.rmtree(self.dir)
+
+    def test_socket_created_private(self):
+        umask = os.umask(0o022)
+        try:
+            # Past once_per_process, so the test doesn't depend on other tests.
+            admin.start_admin_server.__wrapped__()
+            self.assertEqual(os.umask(0o022), 0o022)
+        finally:
+            os.umask(umask)
+        mode = os.stat(app.config['ADMIN_SOCKET'].format(pid=os.getpid())).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o600)
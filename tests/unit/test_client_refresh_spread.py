@@ -0,0 +1,89 @@
+# Import python libs
+import datetime
+import time
+import unittest
+
+# Import third party libs
+import dateutil.parser
+import dateutil.tz
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy import mockcredentials
+from metadataproxy import roles
+
+CONFIG = ('CLIENT_REFRESH_SPREAD', 'ROLE_EXPIRATION_THRESHOLD', 'CREDENTIAL_CACHE_URL')
+CLIENTS = ['10.0.{0}.{1}'.format(i // 256, i % 256) for i in range(500)]
+
+
+def role_params():
+    params = roles.new_role_params()
+    params.update(name='myrole', account_id='123456789012')
+    return params
+
+
+def assumed_role(lifetime, expires_in):
+    """Credentials issued `lifetime` seconds before they expire, in `expires_in` seconds."""
+    now = datetime.datetime.now(dateutil.tz.tzutc()).replace(microsecond=0)
+    expiration = now + datetime.timedelta(seconds=expires_in)
+    role = mockcredentials.mint_credentials(
+        'arn:aws:iam::123456789012:role/myrole', 'devproxyauth', None, time.time(), lifetime
+    )
+    role['Credentials']['Expiration'] = expiration
+    role['LastUpdated'] = expiration - datetime.timedelta(seconds=lifetime)
+    return role
+
+
+class ClientRefreshSpreadTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = {k: app.config[k] for k in CONFIG}
+        app.config.update(CLIENT_REFRESH_SPREAD=300, ROLE_EXPIRATION_THRESHOLD=15, CREDENTIAL_CACHE_URL='')
+        roles.ROLES.clear()
+
+    def tearDown(self):
+        app.config.update(self.saved)
+        roles.ROLES.clear()
+
+    def offsets(self, role):
+        return [roles.get_client_offset(role_params(), role, client).total_seconds() for client in CLIENTS]
+
+    def test_offsets_spread_over_spread(self):
+        offsets = self.offsets(assumed_role(3600, 3000))
+        self.assertTrue(all(0 <= offset < 300 for offset in offsets))
+        # Spread evenly: about a tenth of the clients in each tenth of it.
+        for tenth in range(10):
+            count = sum(1 for offset in offsets if tenth * 30 <= offset < (tenth + 1) * 30)
+            self.assertTrue(25 <= count <= 75, (tenth, count))
+
+    def test_offset_fixed_per_client(self):
+        role = assumed_role(3600, 3000)
+        self.assertEqual(self.offsets(role), self.offsets(role))
+
+    def test_no_offset_without_client(self):
+        role = assumed_role(3600, 3000)
+        self.assertEqual(roles.get_client_offset(role_params(), role, None), datetime.timedelta(0))
+
+    def test_spread_capped_at_half_duration(self):
+        # 15 minutes plus the spread is more than half of a 40 minute session.
+        app.config['CLIENT_REFRESH_SPREAD'] = 600
+        threshold = roles.get_expiration_threshold(role_params(), 2400)
+        self.assertEqual(threshold, datetime.timedelta(seconds=1200))
+        offsets = self.offsets(assumed_role(2400, 2000))
+        self.assertLessEqual(max(offsets), 300)
+        self.assertGreater(max(offsets), 270)
+
+    def test_no_offset_inside_threshold(self):
+        # Due for refresh and served while the refresh runs: shortened, it
+        # would be inside the client's own refresh window.
+        offsets = self.offsets(assumed_role(3600, 15 * 60 + 100))
+        self.assertIn(0, offsets)
+        for offset in offsets:
+            self.assertTrue(offset == 0 or offset < 100)
+
+    def test_last_updated_moves_with_expiration(self):
+        role = assumed_role(3600, 3000)
+        roles.ROLES[roles.get_role_arn(role_params())] = role
+        for client in CLIENTS[:20]:
+            served = roles.get_assumed_role_credentials(role_params(), client=client)
+            lifetime = dateutil.parser.parse(served['Expiration']) - dateutil.parser.parse(served['LastUpdated'])
+            self.assertAlmostEqual(lifetime.total_seconds(), 3600, delta=1)
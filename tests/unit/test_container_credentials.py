@@ -0,0 +1,105 @@
+# Import python libs
+import os
+import unittest
+
+# Import metadataproxy libs
+from metadataproxy import roles
+
+TOKEN = 'AWS_CONTAINER_AUTHORIZATION_TOKEN=secret-token'
+
+
+def make_container(_id, role, *env, **kwargs):
+    return {
+        'Id': _id,
+        'State': {'Running': kwargs.get('running', True)},
+        'Config': {'Env': ['IAM_ROLE=' + role] + list(env), 'Labels': {}}
+    }
+
+
+class FakeDockerClient(object):
+    def __init__(self, containers):
+        self.running = containers
+        self.inspected = []
+
+    def containers(self):
+        return [{'Id': _id} for _id in self.running]
+
+    def inspect_container(self, container_id):
+        self.inspected.append(container_id)
+        return self.running[container_id]
+
+
+class ContainerCredentialsTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = roles._docker_client, roles.start_container_credentials_watcher.pid
+        # Don't follow docker events; the tests register containers directly.
+        roles.start_container_credentials_watcher.pid = os.getpid()
+        roles._container_credentials_scanned_at = 0
+        self.clear()
+
+    def tearDown(self):
+        roles._docker_client, roles.start_container_credentials_watcher.pid = self.saved
+        self.clear()
+
+    def clear(self):
+        for registry in (roles.CONTAINER_CREDENTIALS, roles.CONTAINER_CREDENTIAL_OWNERS,
+                         roles.CONTAINER_CREDENTIAL_KEYS, roles.CONTAINER_CREDENTIAL_PARAMS):
+            registry.clear()
+
+    def role_for_token(self):
+        params = roles.CONTAINER_CREDENTIALS.get(('token', 'secret-token'))
+        return params and params['name']
+
+    def test_refuses_duplicate_key(self):
+        roles.register_container_credentials(make_container('a', 'role-a', TOKEN))
+        roles.register_container_credentials(make_container('b', 'role-b', TOKEN))
+        self.assertEqual(self.role_for_token(), 'role-a')
+
+    def test_hands_key_over_when_owner_dies(self):
+        roles.register_container_credentials(make_container('a', 'role-a', TOKEN))
+        roles.register_container_credentials(make_container('b', 'role-b', TOKEN))
+        roles.unregister_container_credentials('a')
+        self.assertEqual(self.role_for_token(), 'role-b')
+        self.assertEqual(roles.CONTAINER_CREDENTIAL_OWNERS[('token', 'secret-token')], 'b')
+
+    def test_key_reused_by_new_container(self):
+        roles.register_container_credentials(make_container('a', 'role-a', TOKEN))
+        roles.unregister_container_credentials('a')
+        self.assertIsNone(self.role_for_token())
+        roles.register_container_credentials(make_container('b', 'role-b', TOKEN))
+        self.assertEqual(self.role_for_token(), 'role-b')
+
+    def test_cleans_up_when_container_dies(self):
+        roles.register_container_credentials(make_container(
+            'a', 'role-a', TOKEN, 'AWS_CONTAINER_CREDENTIALS_RELATIVE_URI=/v2/credentials/abc'
+        ))
+        roles.register_container_credentials(make_container('b', 'role-b'))
+        self.assertEqual(len(roles.CONTAINER_CREDENTIALS), 2)
+        roles.unregister_container_credentials('a')
+        roles.unregister_container_credentials('b')
+        self.assertEqual(roles.CONTAINER_CREDENTIALS, {})
+        self.assertEqual(roles.CONTAINER_CREDENTIAL_OWNERS, {})
+        self.assertEqual(roles.CONTAINER_CREDENTIAL_KEYS, {})
+        self.assertEqual(roles.CONTAINER_CREDENTIAL_PARAMS, {})
+
+    def test_ignores_stopped_container(self):
+        roles.register_container_credentials(make_container('a', 'role-a', TOKEN, running=False))
+        self.assertIsNone(self.role_for_token())
+
+    def test_inspects_unregistered_container_on_miss(self):
+        roles._docker_client = FakeDockerClient({
+            'a': make_container('a', 'role-a'),
+            'b': make_container('b', 'role-b', TOKEN)
+        })
+        roles.register_container_credentials(make_container('a', 'role-a'))
+        params = roles.get_container_credentials_params(token='secret-token')
+        self.assertEqual(params['name'], 'role-b')
+        # Containers without keys are remembered as inspected.
+        self.assertEqual(roles._docker_client.inspected, ['b'])
+
+    def test_inspects_at_most_once_a_second(self):
+        roles._docker_client = FakeDockerClient({'a': make_container('a', 'role-a')})
+        self.assertIsNone(roles.get_container_credentials_params(token='unknown'))
+        roles._docker_client.running['b'] = make_container('b', 'role-b', TOKEN)
+        self.assertIsNone(roles.get_container_credentials_params(token='secret-token'))
+        self.assertEqual(roles._docker_client.inspected, ['a'])
@@ -0,0 +1,84 @@
+# Import python libs
+import datetime
+import threading
+import unittest
+
+# Import third party libs
+import dateutil.tz
+from cryptography.fernet import Fernet
+
+# Import metadataproxy libs
+from benchmarks.fakes import FakeRedis
+from metadataproxy import credcache
+from metadataproxy import mockcredentials
+
+ARN = 'arn:aws:iam::123456789012:role/myrole'
+
+
+def assumed_role():
+    now = datetime.datetime.now(dateutil.tz.tzutc()).replace(microsecond=0)
+    role = mockcredentials.mint_credentials(ARN, 'devproxyauth', None, now.timestamp(), 3600)
+    role['LastUpdated'] = now
+    return role
+
+
+class CredentialCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis().start()
+        self.old_key = Fernet.generate_key().decode('ascii')
+        self.new_key = Fernet.generate_key().decode('ascii')
+
+    def tearDown(self):
+        self.redis.stop()
+
+    def cache(self, *keys):
+        return credcache.RedisCredentialCache(self.redis.url, list(keys), 1)
+
+    def test_is_abstract(self):
+        with self.assertRaises(TypeError):
+            credcache.CredentialCache([self.old_key])
+
+    def test_round_trip(self):
+        cache = self.cache(self.old_key)
+        role = assumed_role()
+        key = cache.key(ARN, 'devproxyauth', None, 3600)
+        self.assertIsNone(cache.get(key))
+        cache.set(key, role, 60)
+        self.assertEqual(cache.get(key), role)
+
+    def test_key_includes_duration(self):
+        cache = self.cache(self.old_key)
+        self.assertNotEqual(
+            cache.key(ARN, 'devproxyauth', None, 3600),
+            cache.key(ARN, 'devproxyauth', None, 900)
+        )
+
+    def test_decrypts_with_old_key_after_rotation(self):
+        role = assumed_role()
+        old = self.cache(self.old_key)
+        old.set(old.key(ARN, 'devproxyauth', None, 3600), role, 60)
+        # The new key is added as the first line; entries keep their keys.
+        rotated = self.cache(self.new_key, self.old_key)
+        key = rotated.key(ARN, 'devproxyauth', None, 3600)
+        self.assertEqual(rotated.get(key), role)
+        rotated.set(key, role, 60)
+        with self.assertRaises(credcache.CredentialCacheError):
+            old.get(key)
+
+    def test_lock_is_taken_once(self):
+        cache = self.cache(self.old_key)
+        self.assertTrue(cache.lock('a', 30))
+        self.assertFalse(cache.lock('a', 30))
+        self.assertTrue(cache.lock('b', 30))
+
+    def test_lock_is_taken_once_concurrently(self):
+        taken = []
+
+        def lock():
+            taken.append(self.cache(self.old_key).lock('a', 30))
+        threads = [threading.Thread(target=lock) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(taken), [False] * 7 + [True])
@@ -0,0 +1,132 @@
+# Import python libs
+import datetime
+import threading
+import time
+import unittest
+
+# Import third party libs
+import dateutil.tz
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy import deadline
+from metadataproxy import mockcredentials
+from metadataproxy import roles
+
+
+class SlowSTS(object):
+    """Assumes roles like the mock STS client, after `latency` seconds."""
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = []
+
+    def assume_role(self, RoleArn, RoleSessionName, ExternalId=None, DurationSeconds=None):
+        self.calls.append(RoleSessionName)
+        time.sleep(self.latency)
+        return mockcredentials.mint_credentials(
+            RoleArn, RoleSessionName, ExternalId, time.time(), DurationSeconds or 3600
+        )
+
+
+def role_params(session_name=None):
+    params = roles.new_role_params()
+    params.update(name='myrole', account_id='123456789012', session_name=session_name)
+    return params
+
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.saved_config = {k: app.config[k] for k in ('CREDENTIAL_CACHE_URL', 'REQUEST_DEADLINE')}
+        app.config['CREDENTIAL_CACHE_URL'] = ''
+        app.config['REQUEST_DEADLINE'] = 0.1
+        self.saved_sts = roles._sts_client
+        self.sts = roles._sts_client = SlowSTS(0.3)
+        roles.ROLES.clear()
+        roles.REFRESHES.clear()
+
+    def tearDown(self):
+        # Let refreshes left running in the background finish.
+        for future in list(roles.REFRESHES.values()):
+            future.result()
+        deadline.clear()
+        roles._sts_client = self.saved_sts
+        app.config.update(self.saved_config)
+        roles.ROLES.clear()
+        roles.REFRESHES.clear()
+
+    def cache_role(self, params, expires_in):
+        """Cache credentials for params that are due for refresh."""
+        arn = roles.get_role_arn(params)
+        now = datetime.datetime.now(dateutil.tz.tzutc())
+        assumed_role = mockcredentials.mint_credentials(arn, 'devproxyauth', None, time.time(), 3600)
+        assumed_role['Credentials']['Expiration'] = now + datetime.timedelta(seconds=expires_in)
+        assumed_role['LastUpdated'] = now
+        assumed_role['AssumeKey'] = roles.assume_key(arn, params, None)
+        roles.ROLES[arn] = assumed_role
+        return assumed_role
+
+    def test_timeout_without_current_credentials(self):
+        deadline.start(0.1)
+        start = time.time()
+        with self.assertRaises(deadline.DeadlineExceeded):
+            roles.get_assumed_role(role_params())
+        self.assertLess(time.time() - start, 0.25)
+        # The refresh carries on, and caches the role for the next request.
+        deadline.clear()
+        time.sleep(0.4)
+        self.assertEqual(len(roles.ROLES), 1)
+
+    def test_timeout_serves_current_credentials(self):
+        current = self.cache_role(role_params(), expires_in=60)
+        deadline.start(0.1)
+        self.assertIs(roles.get_assumed_role(role_params()), current)
+        # Later requests don't wait for the refresh in flight.
+        start = time.time()
+        self.assertIs(roles.get_assumed_role(role_params()), current)
+        self.assertLess(time.time() - start, 0.05)
+        self.assertEqual(len(self.sts.calls), 1)
+
+    def test_expired_credentials_are_not_served(self):
+        self.cache_role(role_params(), expires_in=-1)
+        deadline.start(0.1)
+        with self.assertRaises(deadline.DeadlineExceeded):
+            roles.get_assumed_role(role_params())
+
+    def test_current_credentials_of_other_params_are_not_served(self):
+        self.cache_role(role_params(), expires_in=60)
+        deadline.start(0.1)
+        with self.assertRaises(deadline.DeadlineExceeded):
+            roles.get_assumed_role(role_params(session_name='other'))
+
+    def join(self, session_names):
+        self.sts.latency = 0.1
+        results = {}
+
+        def request(i, session_name):
+            deadline.start(1.0)
+            try:
+                results[i] = roles.get_assumed_role(role_params(session_name))
+            finally:
+                deadline.clear()
+
+        threads = [threading.Thread(target=request, args=(i, name)) for i, name in enumerate(session_names)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [results[i] for i in range(len(session_names))]
+
+    def test_concurrent_requests_with_the_same_params_share_a_refresh(self):
+        first, second = self.join(['app', 'app'])
+        self.assertEqual(self.sts.calls, ['app'])
+        self.assertIs(first, second)
+
+    def test_concurrent_requests_with_different_params_refresh_separately(self):
+        first, second = self.join(['app', 'batch'])
+        self.assertEqual(sorted(self.sts.calls), ['app', 'batch'])
+        self.assertTrue(first['AssumedRoleUser']['Arn'].endswith('/app'))
+        self.assertTrue(second['AssumedRoleUser']['Arn'].endswith('/batch'))
+
+    def test_deadline_exceeded_is_a_504(self):
+        with app.test_request_context('/latest/meta-data/iam/security-credentials/myrole'):
+            self.assertEqual(deadline.deadline_exceeded(deadline.DeadlineExceeded('sts.assume_role')), ('', 504))
@@ -0,0 +1,135 @@
+# Import python libs
+import unittest
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy import kubelet
+from metadataproxy import roles
+
+ROLE_ANNOTATION = 'iam.amazonaws.com/role'
+EXTERNAL_ID_ANNOTATION = 'iam.amazonaws.com/external-id'
+
+
+def make_pod(uid, ip, env=(), annotations=None, labels=None, phase='Running', version='1', **spec):
+    containers = [{'name': 'app', 'env': list(env)}]
+    spec.update(containers=containers)
+    return {
+        'metadata': {
+            'uid': uid, 'name': 'pod-' + uid, 'namespace': 'default', 'resourceVersion': version,
+            'annotations': annotations or {}, 'labels': labels or {}
+        },
+        'spec': spec,
+        'status': {'phase': phase, 'podIP': ip, 'podIPs': [{'ip': ip}] if ip else []}
+    }
+
+
+def translate(pod):
+    return kubelet.pod_container(pod, ROLE_ANNOTATION, EXTERNAL_ID_ANNOTATION)
+
+
+class FakeKubeletPodIndex(kubelet.KubeletPodIndex):
+    def __init__(self, pods):
+        super(FakeKubeletPodIndex, self).__init__('https://127.0.0.1:10250/pods')
+        self.items = pods
+        self.fetches = 0
+
+    def fetch(self, timeout=None):
+        self.fetches += 1
+        return self.items
+
+
+class PodContainerTest(unittest.TestCase):
+    def test_literal_env_only(self):
+        container = translate(make_pod('a', '10.1.0.1', env=[
+            {'name': 'IAM_ROLE', 'value': 'env-role'},
+            {'name': 'SECRET', 'valueFrom': {'secretKeyRef': {'name': 's', 'key': 'k'}}}
+        ]))
+        self.assertEqual(container['Config']['Env'], ['IAM_ROLE=env-role'])
+        self.assertEqual(container['Id'], 'a')
+        self.assertEqual(container['Name'], 'default/pod-a')
+
+    def test_annotations_take_precedence_over_env(self):
+        container = translate(make_pod(
+            'a', '10.1.0.1',
+            env=[{'name': 'IAM_ROLE', 'value': 'env-role'}, {'name': 'IAM_EXTERNAL_ID', 'value': 'env-id'}],
+            annotations={ROLE_ANNOTATION: 'annotated-role', EXTERNAL_ID_ANNOTATION: 'annotated-id'}
+        ))
+        params = roles.get_role_params_from_container(container)
+        self.assertEqual(params['name'], 'annotated-role')
+        self.assertEqual(params['external_id'], 'annotated-id')
+
+    def test_env_without_annotations(self):
+        container = translate(make_pod('a', '10.1.0.1', env=[{'name': 'IAM_ROLE', 'value': 'env-role'}]))
+        self.assertEqual(roles.get_role_params_from_container(container)['name'], 'env-role')
+
+    def test_labels_and_annotations(self):
+        container = translate(make_pod(
+            'a', '10.1.0.1', labels={'app': 'web', 'team': 'a'}, annotations={'team': 'b'}
+        ))
+        self.assertEqual(container['Config']['Labels'], {'app': 'web', 'team': 'b'})
+        self.assertEqual(roles.container_value(container, 'Labels:app'), 'web')
+
+    def test_pod_ips(self):
+        pod = make_pod('a', '10.1.0.1')
+        pod['status']['podIPs'].append({'ip': 'fd00::1'})
+        self.assertEqual(kubelet.pod_ips(pod), ['10.1.0.1', 'fd00::1'])
+        del pod['status']['podIPs']
+        self.assertEqual(kubelet.pod_ips(pod), ['10.1.0.1'])
+
+
+class KubeletPodIndexTest(unittest.TestCase):
+    def test_indexes_running_pods(self):
+        index = FakeKubeletPodIndex([
+            make_pod('a', '10.1.0.1'),
+            make_pod('b', '10.1.0.2', phase='Pending'),
+            make_pod('c', '192.168.0.10', hostNetwork=True),
+        ])
+        index.refresh()
+        self.assertEqual(index.lookup('10.1.0.1')['Id'], 'a')
+        self.assertIsNone(index.lookup('10.1.0.2'))
+        self.assertIsNone(index.lookup('192.168.0.10'))
+
+    def test_ip_reused_by_new_pod(self):
+        index = FakeKubeletPodIndex([make_pod('a', '10.1.0.1')])
+        index.refresh()
+        index.items = [make_pod('b', '10.1.0.1', annotations={ROLE_ANNOTATION: 'new-role'})]
+        index.refresh()
+        self.assertEqual(index.lookup('10.1.0.1')['Id'], 'b')
+        self.assertEqual(index.pods.keys(), {'b'})
+
+    def test_rereads_changed_pods(self):
+        index = FakeKubeletPodIndex([make_pod('a', '10.1.0.1')])
+        index.refresh()
+        index.items = [make_pod('a', '10.1.0.1', annotations={ROLE_ANNOTATION: 'new-role'}, version='2')]
+        index.refresh()
+        self.assertIn('IAM_ROLE=new-role', index.lookup('10.1.0.1')['Config']['Env'])
+
+
+class FailingDockerClient(object):
+    def __getattr__(self, name):
+        raise AssertionError('docker called for {0}'.format(name))
+
+
+class FindKubeletContainerTest(unittest.TestCase):
+    def setUp(self):
+        self.saved_config = {k: app.config[k] for k in ('KUBELET_RESOLVER', 'PROC_RESOLVER')}
+        app.config.update(KUBELET_RESOLVER=True, PROC_RESOLVER=False)
+        self.saved = roles._kubelet_index, roles._docker_client
+        roles._kubelet_index = FakeKubeletPodIndex([make_pod('a', '10.1.0.1')])
+        roles._kubelet_index.refresh()
+        roles._docker_client = FailingDockerClient()
+
+    def tearDown(self):
+        app.config.update(self.saved_config)
+        roles._kubelet_index, roles._docker_client = self.saved
+
+    def test_hit(self):
+        self.assertEqual(roles.find_container('10.1.0.1')['Id'], 'a')
+
+    def test_miss_does_not_scan_docker(self):
+        roles._kubelet_index.refreshed_at -= 5
+        self.assertIsNone(roles.find_container('10.1.0.99'))
+        # Refreshed once, for pods started since, and not again a second time.
+        self.assertEqual(roles._kubelet_index.fetches, 2)
+        self.assertIsNone(roles.find_container('10.1.0.99'))
+        self.assertEqual(roles._kubelet_index.fetches, 2)
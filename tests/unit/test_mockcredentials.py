@@ -0,0 +1,29 @@
+# Import python libs
+import unittest
+
+# Import metadataproxy libs
+from metadataproxy import mockcredentials
+
+ARN = 'arn:aws:iam::123456789012:role/myrole'
+
+
+def keys(assumed_role):
+    credentials = assumed_role['Credentials']
+    return credentials['AccessKeyId'], credentials['SecretAccessKey'], credentials['SessionToken']
+
+
+class MintCredentialsTest(unittest.TestCase):
+    def test_same_keys_whenever_issued(self):
+        first = mockcredentials.mint_credentials(ARN, 'devproxyauth', None, 1000, 3600)
+        later = mockcredentials.mint_credentials(ARN, 'devproxyauth', None, 5000, 3600)
+        self.assertEqual(keys(first), keys(later))
+        self.assertEqual(
+            (later['Credentials']['Expiration'] - first['Credentials']['Expiration']).total_seconds(), 4000
+        )
+
+    def test_keys_differ_by_params(self):
+        base = keys(mockcredentials.mint_credentials(ARN, 'devproxyauth', None, 1000, 3600))
+        for args in [('other', None, 3600), ('devproxyauth', 'ext', 3600), ('devproxyauth', None, 900)]:
+            session_name, external_id, duration = args
+            minted = mockcredentials.mint_credentials(ARN, session_name, external_id, 1000, duration)
+            self.assertNotEqual(keys(minted), base)
@@ -0,0 +1,186 @@
+# Import python libs
+import os
+import shutil
+import tempfile
+import unittest
+
+# Import metadataproxy libs
+from metadataproxy import procfs
+from metadataproxy import roles
+
+CONTAINER_ID = 'a' * 64
+
+FIB_TRIE = """Main:
+  +-- 0.0.0.0/0 3 0 5
+     |-- 0.0.0.0
+        /0 universe UNICAST
+     +-- 127.0.0.0/8 2 0 2
+        |-- 127.0.0.1
+           /32 host LOCAL
+     |-- {0}
+        /32 host LOCAL
+"""
+
+
+class FakeProcTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.ticks = 0
+        self.add_process('1', '0::/init.scope')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, pid, name, content):
+        path = os.path.join(self.root, pid, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def add_process(self, pid, cgroup, netns_of=None, ip=None, start_time=None):
+        """Add a process, in the network namespace of pid netns_of if given.
+
+        Processes start in the order they're added, unless start_time is given.
+        """
+        self.ticks += 100
+        stat = '{0} (sh (x)) S 1 {0} {0} 0 -1 4194560 {1}\n'.format(
+            pid, ' '.join(['0'] * 12 + [str(start_time or self.ticks)] + ['0'] * 30)
+        )
+        self.write(pid, 'stat', stat)
+        self.write(pid, 'cgroup', cgroup + '\n')
+        netns = os.path.join(self.root, pid, 'ns', 'net')
+        os.makedirs(os.path.dirname(netns), exist_ok=True)
+        if netns_of:
+            # Hard links share an inode, like processes sharing a namespace.
+            os.link(os.path.join(self.root, netns_of, 'ns', 'net'), netns)
+        else:
+            open(netns, 'w').close()
+        self.set_ip(pid, ip)
+
+    def set_ip(self, pid, ip):
+        self.write(pid, 'net/fib_trie', FIB_TRIE.format(ip) if ip else '')
+
+    def remove_process(self, pid):
+        shutil.rmtree(os.path.join(self.root, pid))
+
+
+class ProcNetIndexTest(FakeProcTestCase):
+    def test_indexes_container_ips(self):
+        self.add_process('100', '0::/system.slice/docker-{0}.scope'.format(CONTAINER_ID), ip='172.17.0.2')
+        index = procfs.ProcNetIndex(self.root)
+        index.refresh()
+        self.assertEqual(index.lookup('172.17.0.2'), (CONTAINER_ID, '100'))
+        self.assertIsNone(index.lookup('127.0.0.1'))
+
+    def test_skips_host_network(self):
+        self.add_process('100', '12:memory:/docker/' + CONTAINER_ID, netns_of='1', ip='10.0.0.1')
+        index = procfs.ProcNetIndex(self.root)
+        index.refresh()
+        self.assertIsNone(index.lookup('10.0.0.1'))
+
+    def test_prefers_oldest_process(self):
+        cgroup = '12:memory:/docker/' + CONTAINER_ID
+        self.add_process('200', cgroup, ip='172.17.0.2')
+        index = procfs.ProcNetIndex(self.root)
+        index.refresh()
+        self.add_process('150', cgroup, netns_of='200', ip='172.17.0.2', start_time=50)
+        index.refresh()
+        self.assertEqual(index.lookup('172.17.0.2'), (CONTAINER_ID, '150'))
+        self.remove_process('150')
+        index.refresh()
+        self.assertEqual(index.lookup('172.17.0.2'), (CONTAINER_ID, '200'))
+        self.remove_process('200')
+        index.refresh()
+        self.assertIsNone(index.lookup('172.17.0.2'))
+
+    def test_prefers_oldest_process_after_pid_wraparound(self):
+        cgroup = '12:memory:/docker/' + CONTAINER_ID
+        self.add_process('30000', cgroup, ip='172.17.0.2', start_time=500)
+        # A later child whose pid wrapped around to a lower number.
+        self.add_process('40', cgroup, netns_of='30000', ip='172.17.0.2', start_time=900)
+        index = procfs.ProcNetIndex(self.root)
+        index.refresh()
+        self.assertEqual(index.lookup('172.17.0.2'), (CONTAINER_ID, '30000'))
+        self.remove_process('30000')
+        index.refresh()
+        self.assertEqual(index.lookup('172.17.0.2'), (CONTAINER_ID, '40'))
+
+    def test_rereads_process_moved_into_container_cgroup(self):
+        # runc starts the process before moving it into the container cgroup.
+        self.add_process('100', '0::/system.slice/containerd.service', ip='172.17.0.2')
+        index = procfs.ProcNetIndex(self.root)
+        index.refresh()
+        self.assertIsNone(index.lookup('172.17.0.2'))
+        self.write('100', 'cgroup', '0::/kubepods/besteffort/pod1234/{0}\n'.format(CONTAINER_ID))
+        index.refresh()
+        self.assertEqual(index.lookup('172.17.0.2'), (CONTAINER_ID, '100'))
+
+    def test_stops_rereading_after_retry_window(self):
+        self.add_process('100', '0::/user.slice', ip='172.17.0.2')
+        index = procfs.ProcNetIndex(self.root, retry_window=0)
+        index.refresh()
+        index.refresh()
+        self.assertNotIn('100', index.unresolved)
+        self.write('100', 'cgroup', '12:memory:/docker/{0}\n'.format(CONTAINER_ID))
+        index.refresh()
+        self.assertIsNone(index.lookup('172.17.0.2'))
+
+    def test_rereads_namespace_configured_later(self):
+        # The namespace exists before libnetwork configures its interface.
+        cgroup = '12:memory:/docker/' + CONTAINER_ID
+        self.add_process('100', cgroup)
+        index = procfs.ProcNetIndex(self.root)
+        index.refresh()
+        self.set_ip('100', '172.17.0.2')
+        self.add_process('101', cgroup, netns_of='100', ip='172.17.0.2')
+        index.refresh()
+        self.assertEqual(index.lookup('172.17.0.2'), (CONTAINER_ID, '100'))
+
+    def test_refresh_if_older(self):
+        index = procfs.ProcNetIndex(self.root)
+        self.assertTrue(index.refresh_if_older(1))
+        self.assertFalse(index.refresh_if_older(1))
+        self.assertTrue(index.refresh_if_older(0))
+
+
+class FakeDockerClient(object):
+    def __init__(self, containers):
+        self.containers = containers
+        self.inspects = 0
+
+    def inspect_container(self, container_id):
+        self.inspects += 1
+        return self.containers[container_id]
+
+
+class ProcResolverTest(FakeProcTestCase):
+    def setUp(self):
+        super(ProcResolverTest, self).setUp()
+        self.add_process('100', '12:memory:/docker/' + CONTAINER_ID, ip='172.17.0.2')
+        self.docker = FakeDockerClient({CONTAINER_ID: {
+            'Id': CONTAINER_ID,
+            'State': {'Running': True},
+            'Config': {'Env': ['IAM_ROLE=configured-role'], 'Labels': {}}
+        }})
+        self.saved = roles._proc_index, roles._docker_client
+        roles._proc_index = procfs.ProcNetIndex(self.root)
+        roles._proc_index.refresh()
+        roles._docker_client = self.docker
+        roles.PROC_CONTAINERS.clear()
+
+    def tearDown(self):
+        roles._proc_index, roles._docker_client = self.saved
+        roles.PROC_CONTAINERS.clear()
+        super(ProcResolverTest, self).tearDown()
+
+    def test_env_comes_from_docker_not_process_memory(self):
+        # A process can rewrite its own environment after exec.
+        self.write('100', 'environ', 'IAM_ROLE=configured-role\0IAM_ROLE=admin-role\0')
+        container = roles.find_proc_container('172.17.0.2')
+        params = roles.get_role_params_from_container(container)
+        self.assertEqual(params['name'], 'configured-role')
+
+    def test_inspects_each_container_once(self):
+        roles.find_proc_container('172.17.0.2')
+        roles.find_proc_container('172.17.0.2')
+        self.assertEqual(self.docker.inspects, 1)
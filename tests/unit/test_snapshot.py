@@ -0,0 +1,162 @@
+# Import python libs
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy import roles
+from metadataproxy import snapshot
+
+CONFIG = ('MESOS_STATE_LOOKUP', 'ROLE_SESSION_KEY', 'ROLE_SESSION_DURATION_KEY', 'ROLE_EXPIRATION_THRESHOLD_KEY')
+ARN = 'arn:aws:iam::123456789012:role/myrole'
+
+
+def mesos_container(*labels):
+    # As made by lookup_mesos_container from a task's labels.
+    env = ['{0}={1}'.format(key, value) for key, value in labels]
+    return {'Config': {'Env': env, 'Labels': env}}
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.saved = {k: app.config[k] for k in CONFIG}
+        app.config['MESOS_STATE_LOOKUP'] = True
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'snapshot.json')
+        self.clear()
+
+    def tearDown(self):
+        app.config.update(self.saved)
+        shutil.rmtree(self.dir)
+        self.clear()
+
+    def clear(self):
+        for cache in (roles.CONTAINER_MAPPING, roles.CONTAINER_MAPPING_UPDATED,
+                      roles.ROLE_ARNS, roles.MESOS_CONTAINERS):
+            cache.clear()
+
+    def round_trip(self):
+        """Write the caches, clear them and restore them from the snapshot."""
+        snapshot.write_snapshot(self.path)
+        self.clear()
+        snapshot.restore_snapshot(snapshot.read_snapshot(self.path))
+
+
+class MesosSnapshotTest(SnapshotTestCase):
+    def test_keeps_role_params_not_labels(self):
+        app.config['ROLE_SESSION_KEY'] = 'Env:SESSION'
+        container = mesos_container(
+            ('IAM_ROLE', 'arn:aws:iam::123456789012:role/myrole'),
+            ('IAM_EXTERNAL_ID', 'ext'),
+            ('SESSION', 'my session'),
+            ('DB_PASSWORD', 'hunter2')
+        )
+        params = roles.get_role_params_from_container(container)
+        roles.MESOS_CONTAINERS['10.0.0.1'] = (time.time(), container)
+        roles.MESOS_CONTAINERS['10.0.0.2'] = (time.time(), None)
+        self.round_trip()
+        with open(self.path) as f:
+            self.assertNotIn('hunter2', f.read())
+        restored = roles.MESOS_CONTAINERS['10.0.0.1'][1]
+        self.assertEqual(roles.get_role_params_from_container(restored), params)
+        self.assertIsNone(roles.MESOS_CONTAINERS['10.0.0.2'][1])
+
+    def test_restores_params_read_from_labels(self):
+        app.config['ROLE_SESSION_DURATION_KEY'] = 'Labels:duration'
+        params = roles.new_role_params()
+        params.update(name='myrole', duration=900)
+        container = snapshot.container_from_role_params(params)
+        self.assertEqual(roles.get_role_params_from_container(container), params)
+
+    def test_drops_expired_lookups(self):
+        roles.MESOS_CONTAINERS['10.0.0.1'] = (time.time() - roles.MESOS_CONTAINERS.ttl - 1, None)
+        self.round_trip()
+        self.assertNotIn('10.0.0.1', roles.MESOS_CONTAINERS)
+
+
+class RoleArnSnapshotTest(SnapshotTestCase):
+    def test_keeps_lookup_time(self):
+        updated = time.time() - 100
+        roles.ROLE_ARNS['myrole'] = (updated, ARN)
+        self.round_trip()
+        self.assertEqual(roles.ROLE_ARNS['myrole'], (updated, ARN))
+
+    def test_drops_expired_arns(self):
+        roles.ROLE_ARNS['myrole'] = (time.time() - roles.ROLE_ARNS.ttl - 1, ARN)
+        self.round_trip()
+        self.assertNotIn('myrole', roles.ROLE_ARNS)
+
+
+class MergeSnapshotTest(SnapshotTestCase):
+    def test_workers_merge_into_snapshot(self):
+        # Each child writes its own entries, at the same time as the others.
+        children = []
+        for worker in range(4):
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    for i in range(20):
+                        roles.ROLE_ARNS['role-{0}-{1}'.format(worker, i)] = (time.time(), ARN)
+                        snapshot.write_snapshot(self.path)
+                    code = 0
+                finally:
+                    os._exit(code)
+            children.append(pid)
+        for pid in children:
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        written = snapshot.read_snapshot(self.path)
+        self.assertEqual(len(written['role_arns']), 80)
+
+    def test_keeps_latest_lookup(self):
+        now = time.time()
+        mine = {'container_mapping': {'10.0.0.1': ['a', now - 10]}, 'role_arns': {}, 'mesos': {}}
+        other = {'container_mapping': {'10.0.0.1': ['b', now], '10.0.0.2': ['c', now]},
+                 'role_arns': {'myrole': [ARN, now]}, 'mesos': {}}
+        merged = snapshot.merge_snapshots(mine, other)
+        self.assertEqual(merged['container_mapping'], {'10.0.0.1': ['b', now], '10.0.0.2': ['c', now]})
+        self.assertEqual(merged['role_arns'], {'myrole': [ARN, now]})
+
+
+class ValidateSnapshotTest(SnapshotTestCase):
+    def write(self, data):
+        with open(self.path, 'w') as f:
+            json.dump(data, f)
+
+    def snapshot(self, **sections):
+        data = {'version': snapshot.SNAPSHOT_VERSION, 'written_at': time.time(),
+                'container_mapping': {}, 'role_arns': {}, 'mesos': {}}
+        data.update(sections)
+        return data
+
+    def test_drops_invalid_entries(self):
+        params = roles.new_role_params()
+        params['name'] = 'myrole'
+        self.write(self.snapshot(
+            container_mapping={'10.0.0.1': ['a', time.time()], '10.0.0.2': 'a'},
+            role_arns={'myrole': [ARN, time.time()], 'other': [ARN]},
+            mesos={
+                '10.0.0.1': [time.time(), params],
+                '10.0.0.2': [time.time(), {'Config': {'Env': ['IAM_ROLE=admin']}}],
+                '10.0.0.3': [time.time(), dict(params, duration='900')]
+            }
+        ))
+        written = snapshot.read_snapshot(self.path)
+        self.assertEqual(list(written['container_mapping']), ['10.0.0.1'])
+        self.assertEqual(list(written['role_arns']), ['myrole'])
+        self.assertEqual(list(written['mesos']), ['10.0.0.1'])
+
+    def test_ignores_invalid_snapshot(self):
+        for data in ([], self.snapshot(mesos=[]), self.snapshot(written_at='now'),
+                     self.snapshot(version=1), self.snapshot(written_at=time.time() - 7200)):
+            self.write(data)
+            self.assertIsNone(snapshot.read_snapshot(self.path))
+
+    def test_ignores_unreadable_snapshot(self):
+        with open(self.path, 'w') as f:
+            f.write('{"version": ')
+        self.assertIsNone(snapshot.read_snapshot(self.path))
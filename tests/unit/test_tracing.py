@@ -0,0 +1,35 @@
+# Import python libs
+import concurrent.futures
+import unittest
+
+# Import metadataproxy libs
+from metadataproxy import tracing
+
+
+class BindTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        tracing._current.phases = None
+
+    def test_adds_phases_from_worker_thread(self):
+        tracing._current.phases = {}
+        futures = [
+            self.executor.submit(tracing.bind(tracing.add_phase), 'Container inspect', 0.5)
+            for _ in range(2)
+        ]
+        for future in futures:
+            future.result()
+        self.assertEqual(tracing._current.phases, {'Container inspect': 1.0})
+
+    def test_worker_thread_has_no_trace_after(self):
+        tracing._current.phases = {}
+        self.executor.submit(tracing.bind(tracing.add_phase), 'sts.assume_role', 0.5).result()
+        phases = self.executor.submit(lambda: tracing._current.phases).result()
+        self.assertIsNone(phases)
+
+    def test_untraced_request(self):
+        tracing._current.phases = None
+        self.assertIs(tracing.bind(tracing.add_phase), tracing.add_phase)
@@ -0,0 +1,53 @@
+# Import python libs
+import time
+import unittest
+
+# Import metadataproxy libs
+from metadataproxy import app
+from metadataproxy import usage
+
+KEYS = ('USAGE_STATS', 'USAGE_STATS_WINDOW', 'USAGE_STATS_BUCKETS', 'USAGE_STATS_CAPACITY')
+
+
+class TopTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = {k: app.config[k] for k in KEYS}
+        app.config.update(USAGE_STATS=True, USAGE_STATS_WINDOW=20, USAGE_STATS_BUCKETS=2, USAGE_STATS_CAPACITY=2)
+        usage._buckets = None
+
+    def tearDown(self):
+        app.config.update(self.saved)
+        usage._buckets = None
+
+    def fill(self, *buckets):
+        """Set the window's buckets, oldest first, to counts of ips."""
+        index = int(time.time() // usage._bucket_width())
+        usage._buckets = []
+        for i, ips in enumerate(buckets):
+            bucket = usage._new_bucket(index - len(buckets) + 1 + i)
+            for ip, count in ips:
+                bucket[1][('requests', 'ip')].add(ip, count)
+            usage._buckets.append(bucket)
+
+    def top(self):
+        return {row['key']: (row['count'], row['error']) for row in usage.top('requests', 'ip')}
+
+    def test_sums_buckets(self):
+        self.fill([('a', 5)], [('a', 3), ('b', 1)])
+        self.assertEqual(self.top(), {'a': (8, 0), 'b': (1, 0)})
+
+    def test_key_missing_from_full_bucket(self):
+        # 'c' may have been counted in the first bucket and evicted, with at
+        # most its lowest count.
+        self.fill([('a', 5), ('b', 2)], [('c', 4)])
+        self.assertEqual(self.top(), {'a': (5, 0), 'b': (2, 0), 'c': (6, 2)})
+
+    def test_bounds_hold_after_eviction(self):
+        # 'c' evicts 'b' in the first bucket.
+        self.fill([('a', 5), ('b', 2), ('c', 1)], [('b', 4)])
+        top = self.top()
+        self.assertEqual(top['c'], (3, 2))
+        true_counts = {'a': 5, 'b': 6, 'c': 1}
+        for key, (count, error) in top.items():
+            self.assertLessEqual(count - error, true_counts[key])
+            self.assertGreaterEqual(count, true_counts[key])
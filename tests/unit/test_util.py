@@ -0,0 +1,45 @@
+# Import python libs
+import os
+import unittest
+
+# Import metadataproxy libs
+from metadataproxy.util import once_per_process
+
+
+class OncePerProcessTest(unittest.TestCase):
+    def test_runs_once_and_returns_result(self):
+        calls = []
+
+        @once_per_process
+        def start():
+            calls.append(1)
+            return len(calls)
+        self.assertEqual(start(), 1)
+        self.assertEqual(start(), 1)
+        self.assertEqual(start.pid, os.getpid())
+
+    def test_runs_again_in_forked_process(self):
+        calls = []
+
+        @once_per_process
+        def start():
+            calls.append(1)
+        start()
+        # As inherited by a forked worker.
+        start.pid = -1
+        start()
+        self.assertEqual(len(calls), 2)
+
+    def test_runs_again_after_error(self):
+        calls = []
+
+        @once_per_process
+        def start():
+            calls.append(1)
+            if len(calls) == 1:
+                raise ValueError('first call fails')
+        with self.assertRaises(ValueError):
+            start()
+        start()
+        start()
+        self.assertEqual(len(calls), 2)